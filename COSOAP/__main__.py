@@ -1,64 +1,166 @@
 import os
+import contextlib
 import numpy as np
 from .config import get_args
-from .io import read_input, write_outputs
-from .soap import split_structures, build_cache
-from .dedup import run_deduplication
+from .io import read_input, write_outputs, list_input_files, iter_input_frames, frame_records
+from .soap import split_structures, build_caches, stream_structures, save_group_index
+from .manifest import manifest_path, save_manifest, load_manifest
+from .seeds import load_seeds, exclude_seeded, save_train_rows
+from .dedup import run_deduplication, allocate_fps
+from .store import pack_store, report_selection_diff
+from .reduce import reduce_caches
+from .shard import plan_shards, load_plan, shard_groups, save_part, merge_shards
+from .pipeline import run_pipeline
+from .sweep import run_sweep
 from .utils import soap_param_hash
+from .profiling import measure, write_report
 
 def main():
     args = get_args()
     os.makedirs("soap_cache", exist_ok=True)
 
-    # 1. 读取
-    atoms_all = read_input(args.input_path, args.nproc)
-    
-    # 2. 分组
+    # --profile: 运行报告 (各阶段/各组的耗时与内存、缓存命中、过滤与选中数量)
+    report = {"args": vars(args), "stages": {}, "filter": {},
+              "cache": {"frame_index": {}, "descriptors": {}}, "groups": {}}
+    selection_stats = {}
+
+    def stage(name):
+        if args.profile is None:
+            return contextlib.nullcontext()
+        return measure(report["stages"].setdefault(name, {}))
+
     center_elements = args.atoms.split()
-    groups = split_structures(atoms_all, center_elements)
+    filter_opts = {"e_min": args.energy_range[0], "e_max": args.energy_range[1],
+                   "f_max": args.max_force, "max_kpts": args.max_kpts}
+    tag = soap_param_hash(args.rcut, centers=center_elements)
+
+    # 分片执行：plan 与 merge 各自独立完成；分片 K 的输入、SOAP 与筛选参数都取自计划
+    if args.shard_merge:
+        merge_shards(args.shard_dir)
+        return
+    if args.shard is not None:
+        plan, plan_groups, records = load_plan(args.shard_dir)
+        input_files, center_elements, tag = plan["files"], plan["atoms"], plan["tag"]
+        filter_opts = plan["filters"]
+        args.rcut, args.mode, args.num, args.simlT = plan["rcut"], plan["mode"], plan["num"], plan["simlT"]
+    else:
+        input_files = list_input_files(args.input_path)
+    if args.shard_plan is not None:
+        plan_shards(args.shard_dir, args.shard_plan, input_files, tag, center_elements, args.rcut,
+                    filter_opts, args.mode, args.num, args.simlT)
+        return
+
+    backend_opts = None
+    if args.mode == "threshold" and args.backend == "lsh":
+        backend_opts = {"n_tables": args.lsh_tables, "n_bits": args.lsh_bits,
+                        "recall_sample": args.recall_sample, "min_recall": args.lsh_min_recall,
+                        "min_rows": args.lsh_min_rows}
+
+    hier_opts = None
+    if args.hier:
+        hier_opts = {"min_rows": args.hier_min_rows, "n_clusters": args.hier_clusters,
+                     "oversample": args.hier_oversample, "coverage_sample": args.coverage_sample}
+
+    checkpoint_opts = None
+    if args.checkpoint_every > 0 or args.resume:
+        checkpoint_opts = {"every": args.checkpoint_every, "resume": args.resume}
+
+    # 0. 缓存清单：输入与参数未变时直接使用上次的分组结果，跳过读取、分组与描述符计算
+    manifest_file = manifest_path("soap_cache", input_files, tag, filter_opts)
+    results = None   # 流水线模式在读取的同时完成筛选
+    cached = None if args.reparse or args.shard is not None or args.sweep \
+        else load_manifest(manifest_file, "soap_cache", tag)
+    if args.shard is not None:
+        # 1+2. 只解析本分片各组的帧 (分组与过滤已在计划中完成)
+        with stage("read_input"):
+            groups = shard_groups(plan_groups, records, input_files, args.shard)
+        atoms_all = None
+    elif cached is not None:
+        groups, records, report["filter"] = cached
+        atoms_all = None
+        for key, g in groups.items():
+            save_group_index("soap_cache", tag, key, g["rows"], g["has_label"])
+        print(f"[CACHE] Inputs unchanged, using manifest {manifest_file} "
+              f"({sum(len(g['indices']) for g in groups.values())} structures in {len(groups)} groups)")
+    elif args.pipeline:
+        # 1+2+3+5. 流水线：解析、描述符计算与筛选重叠进行 (不保留 Atoms)
+        print(f"[IO] Pipelining {len(input_files)} file(s) in batches of {args.batch_size}...")
+        atoms_all = None
+        with stage("pipeline"):
+            groups, records, results = run_pipeline(
+                input_files, center_elements, "soap_cache", args.nproc, rcut=args.rcut,
+                batch_size=args.batch_size, chunk_frames=args.batch_size, filter_opts=filter_opts,
+                mode=args.mode, num=args.num, simlT=args.simlT, backend=args.backend,
+                backend_opts=backend_opts, hier_opts=hier_opts, checkpoint_opts=checkpoint_opts,
+                stats=report["filter"], cache_stats=report["cache"]["descriptors"],
+                group_stats=selection_stats, profile=args.profile_selection)
+    elif args.stream:
+        # 1+2. 流式读取、分组并计算描述符 (不保留 Atoms)
+        print(f"[IO] Streaming {len(input_files)} file(s) in batches of {args.batch_size}...")
+        atoms_all = None
+        with stage("stream"):
+            groups, records = stream_structures(
+                iter_input_frames(input_files, "soap_cache"), center_elements,
+                cache_dir="soap_cache", nproc=args.nproc, rcut=args.rcut,
+                batch_size=args.batch_size, filter_opts=filter_opts,
+                stats=report["filter"], cache_stats=report["cache"]["descriptors"])
+    else:
+        # 1. 读取 (同时建立帧偏移索引，输出时直接复制源文件文本)
+        with stage("read_input"):
+            atoms_all, features = read_input(args.input_path, args.nproc, with_features=True)
+        try:
+            with stage("frame_index"):
+                records = frame_records(input_files, "soap_cache", stats=report["cache"]["frame_index"])
+        except ValueError as e:
+            print(f"[WARN] Frame index failed ({e}); outputs will be re-written with ASE")
+            records = None
+        if records is not None and len(records["file"]) != len(atoms_all):
+            print(f"[WARN] Frame index has {len(records['file'])} frames but {len(atoms_all)} "
+                  f"were read; outputs will be re-written with ASE")
+            records = None
+
+        # 2. 分组
+        with stage("split_structures"):
+            groups = split_structures(atoms_all, center_elements, filter_opts, features,
+                                      stats=report["filter"])
+
+    # --sweep: 同一次分组在多组 SOAP 参数下计算并筛选，只输出比较结果
+    if args.sweep:
+        with stage("sweep"):
+            run_sweep(groups, "soap_cache", args.nproc, center_elements, args.sweep, args.mode,
+                      num=args.num, simlT=args.simlT, backend=args.backend,
+                      backend_opts=backend_opts, hier_opts=hier_opts,
+                      checkpoint_opts=checkpoint_opts, coverage_sample=args.coverage_sample,
+                      report_path=args.sweep_report, stats=report["cache"]["descriptors"])
+        if args.profile is not None:
+            write_report(args.profile, report)
+        return
     
-    # 3. 准备参数 / 分配数量
+    # 3. 缓存 (按结构内容寻址，只计算缓存中没有的结构)
+    if cached is None and not args.stream and results is None:
+        with stage("build_cache"):
+            build_caches(groups, cache_dir="soap_cache", nproc=args.nproc,
+                         center_elements=center_elements, rcut=args.rcut,
+                         stats=report["cache"]["descriptors"])
+    if cached is None and records is not None and args.shard is None:
+        save_manifest(manifest_file, groups, records, report["filter"])
+
+    # --seed-train: 已有训练集作为固定种子，已在训练集中的结构不再参与筛选
+    seeds = None
+    if args.seed_train:
+        with stage("seeds"):
+            seeds = load_seeds(args.seed_train, "soap_cache", tag, center_elements,
+                               nproc=args.nproc, rcut=args.rcut)
+            exclude_seeded(groups, seeds, "soap_cache", tag)
+
+    # 4. 准备参数 / 分配数量
     dedup_param = None # 传递给 dedup 的主参数
     
     if args.mode == "fps":
         # === FPS 模式：执行分配算法 (修复版) ===
-        valid_total_structures = sum(len(g["atoms"]) for g in groups.values())
-        target_total = min(args.num, valid_total_structures)
-        
-        print(f"[FPS] Distributing {target_total} samples from {valid_total_structures} structures...")
-        
-        allocations = {}
-        remainders = []
-        current_sum = 0
-        
-        for key in groups:
-            n_this_group = len(groups[key]["atoms"])
-            if valid_total_structures > 0:
-                raw_share = target_total * (n_this_group / valid_total_structures)
-            else:
-                raw_share = 0
-            base_alloc = int(raw_share)
-            allocations[key] = base_alloc
-            current_sum += base_alloc
-            
-            if base_alloc < n_this_group:
-                remainders.append((raw_share - base_alloc, key))
-            else:
-                remainders.append((-1.0, key)) # 已满
-
-        deficit = target_total - current_sum
-        remainders.sort(key=lambda x: x[0], reverse=True)
-        
-        for i in range(deficit):
-            if i >= len(remainders): break
-            key_to_add = remainders[i][1]
-            if allocations[key_to_add] < len(groups[key_to_add]["atoms"]):
-                allocations[key_to_add] += 1
-
-        for key in groups:
-            groups[key]["n_select"] = allocations[key]
-            print(f"  - Group {key:<10}: Select {allocations[key]}")
-            
+        # 分片时各组的数量已在计划中按全体数据分配
+        if args.shard is None and results is None:
+            allocate_fps(groups, args.num)
         dedup_param = None # FPS 模式下，参数已经写入 groups 字典里了
         
     else:
@@ -66,23 +168,62 @@ def main():
         print(f"[Threshold] Running Cosine Deduplication with simlT = {args.simlT}")
         dedup_param = args.simlT
 
-    # 4. 缓存
-    tag = soap_param_hash(args.rcut)
-    need_build = any(not os.path.exists(f"soap_cache/SOAP_{tag}_{k}.npy") for k in groups)
-    if need_build:
-        print(f"[CACHE] Building SOAP caches...")
-        for key in sorted(groups.keys()):
-            build_cache(groups[key], cache_dir="soap_cache", nproc=args.nproc,
-                        center_elements=center_elements, rcut=args.rcut)
+    # --reduce: 降维后的缓存 (按降维参数寻址)，之后的存储与筛选都在其上进行
+    select_tag = tag
+    if args.reduce != "off":
+        report["reduce"] = {}
+        with stage("reduce"):
+            select_tag = reduce_caches(groups, "soap_cache", tag, args.reduce, args.reduce_dim,
+                                       sample=args.reduce_sample, n_pairs=args.distortion_pairs,
+                                       stats=report["reduce"])
+
+    store = None
+    if args.store != "off":
+        with stage("pack_store"):
+            store = pack_store(groups, "soap_cache", select_tag, args.store)
 
     # 5. 运行筛选
     # 将 mode 和 param 传进去
-    train_label_idx, train_unlabel_idx, test_label_idx, test_unlabel_idx = \
-                run_deduplication(groups, cache_dir="soap_cache", nproc=args.nproc, 
-                                  mode=args.mode, param=dedup_param)
+    if results is None:
+        with stage("selection"):
+            results = run_deduplication(groups, cache_dir="soap_cache", tag=select_tag,
+                                        nproc=args.nproc, mode=args.mode, param=dedup_param,
+                                        backend=args.backend, backend_opts=backend_opts, store=store,
+                                        group_stats=selection_stats, profile=args.profile_selection,
+                                        seeds=seeds, hier_opts=hier_opts,
+                                        checkpoint_opts=checkpoint_opts)
+    train_label_idx, train_unlabel_idx, test_label_idx, test_unlabel_idx = results
+
+    if store is not None and args.store_report:
+        print("[STORE] Re-running selection on float32 caches for comparison...")
+        with stage("selection_float32"):
+            reference = run_deduplication(groups, cache_dir="soap_cache", tag=select_tag,
+                                          nproc=args.nproc,
+                                          mode=args.mode, param=dedup_param,
+                                          backend=args.backend, backend_opts=backend_opts,
+                                          seeds=seeds, hier_opts=hier_opts)
+        report["store_diff"] = report_selection_diff(reference, results, label=args.store)
 
     # 6. 输出
-    write_outputs(atoms_all, train_label_idx, train_unlabel_idx, test_label_idx, test_unlabel_idx)
+    with stage("write_outputs"):
+        if args.shard is not None:
+            save_part(args.shard_dir, args.shard, plan, groups, "soap_cache", tag, results)
+        else:
+            write_outputs(atoms_all, train_label_idx, train_unlabel_idx, test_label_idx, test_unlabel_idx,
+                          files=input_files, records=records)
+            save_train_rows("train_rows.npz", groups, "soap_cache", tag,
+                            train_label_idx, train_unlabel_idx, seeds)
+
+    if args.profile is not None:
+        for key in groups:
+            report["groups"][key] = {"n_frames": len(groups[key]["indices"]),
+                                     "cache": report["cache"]["descriptors"].get(key),
+                                     "selection": selection_stats.get(key)}
+        report["selection"] = {"train_labeled": len(train_label_idx),
+                               "train_unlabeled": len(train_unlabel_idx),
+                               "test_labeled": len(test_label_idx),
+                               "test_unlabeled": len(test_unlabel_idx)}
+        write_report(args.profile, report)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+import os
+import contextlib
+import numpy as np
+from multiprocessing import Pool
+from .filters import frame_features
+from .soap import split_structures, build_caches, _init_soap_worker
+from .seeds import load_seeds, seed_groups_from_structures, exclude_seeded
+from .dedup import (run_deduplication, allocate_fps, fps_selection_target_n,
+                    cosine_threshold_dedup, _init_worker)
+from .store import OUTPUT_NAMES
+from .utils import soap_param_hash, limit_blas_threads
+
+# =========================================================
+# 进程内 API：在主动学习等循环中反复筛选，不经过命令行，也不写出 xyz 文件
+# =========================================================
+def _init_api_worker(rcut, center_elements):
+    """常驻进程池的 worker 同时用于描述符计算与筛选"""
+    _init_soap_worker(rcut, center_elements)
+    _init_worker()
+
+
+def _as_result(lists):
+    return {name: np.asarray(idx, dtype=np.int64) for name, idx in zip(OUTPUT_NAMES, lists)}
+
+
+class Selector:
+    """
+    持有缓存目录、SOAP 参数与常驻进程池，多次调用 select 时复用：
+    worker 中的 SOAP 对象只构造一次，描述符按结构内容缓存在 cache_dir 中，已算过的结构不再计算；
+    已打开的各组缓存 (mmap) 按 (组名, tag) 保存在实例中，之后的调用直接复用；
+    nproc == 1 时描述符与筛选都在本进程中计算，不创建进程池
+
+        with Selector("runs/soap_cache", center_elements=["C", "H", "O"], nproc=8) as sel:
+            res = sel.select(pool_atoms, mode="fps", n=200, seeds=train_atoms)
+            picked = [pool_atoms[i] for i in res["train_labeled"]]
+
+    filter_opts 覆盖 filters.DEFAULT_FILTERS 中的项 (与命令行相同的 k 点与标签范围过滤)
+    """
+    def __init__(self, cache_dir, center_elements=("C", "H", "O"), rcut=6.0, nproc=1,
+                 filter_opts=None):
+        self.cache_dir = cache_dir
+        self.center_elements = list(center_elements)
+        self.rcut, self.nproc = rcut, nproc
+        self.filter_opts = filter_opts
+        self.tag = soap_param_hash(rcut, centers=self.center_elements)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._pool = None
+        self._arrays = {}
+
+    @property
+    def pool(self):
+        """常驻进程池，第一次需要时创建 (nproc == 1 时为 None)"""
+        if self._pool is None and self.nproc > 1:
+            self._pool = Pool(self.nproc, initializer=_init_api_worker,
+                              initargs=(self.rcut, self.center_elements))
+        return self._pool
+
+    def close(self):
+        self._arrays.clear()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def select(self, atoms, mode="fps", n=1000, simlT=0.005, seeds=None, backend="exact",
+               backend_opts=None, hier_opts=None):
+        """
+        在 atoms (Atoms 列表) 中筛选，返回 {train_labeled, train_unlabeled, test_labeled,
+        test_unlabeled}，值为 atoms 中的序号 (int64 数组)，被过滤掉的结构不在其中
+        seeds 为已有训练集：Atoms 列表，或上次命令行运行写出的 train_rows.npz 路径
+        其余参数同命令行 (n 为 FPS 总数，simlT 为 threshold 阈值)
+        """
+        if mode not in ("fps", "threshold"):
+            raise ValueError(f"Unknown selection mode: {mode}")
+        groups = split_structures(atoms, self.center_elements, self.filter_opts,
+                                  frame_features(atoms))
+        build_caches(groups, self.cache_dir, self.nproc, self.center_elements, self.rcut,
+                     pool=self.pool)
+
+        seed_rows = None
+        if isinstance(seeds, (str, os.PathLike)):
+            seed_rows = load_seeds([os.fspath(seeds)], self.cache_dir, self.tag,
+                                   self.center_elements, self.nproc, self.rcut)
+        elif seeds is not None and len(seeds):
+            seed_rows = seed_groups_from_structures(seeds, self.cache_dir, self.nproc,
+                                                    self.center_elements, self.rcut,
+                                                    pool=self.pool)
+        if seed_rows is not None:
+            exclude_seeded(groups, seed_rows, self.cache_dir, self.tag)
+
+        if mode == "fps":
+            allocate_fps(groups, n)
+        results = run_deduplication(groups, self.cache_dir, self.tag, self.nproc, mode,
+                                    None if mode == "fps" else simlT, backend=backend,
+                                    backend_opts=backend_opts, seeds=seed_rows,
+                                    hier_opts=hier_opts, pool=self.pool, arrays=self._arrays)
+        return _as_result(results)
+
+
+def select_descriptors(X, has_label=None, mode="fps", n=1000, simlT=0.005, groups=None,
+                       seeds=None, seed_labels=None, n_threads=1):
+    """
+    直接在描述符数组 X (N, D) 上筛选，不计算 SOAP，也不读写缓存；返回值同 Selector.select
+    has_label 缺省为全部有标签；groups 为每行的组名 (可选)，给出时按组分别筛选，
+    FPS 的总数 n 按组大小分配 (同命令行)
+    seeds 为已有训练集的描述符：没有 groups 时为数组，有 groups 时为 {组名: 数组}；
+    seed_labels 结构与 seeds 相同，缺省为全部有标签
+    """
+    if mode not in ("fps", "threshold"):
+        raise ValueError(f"Unknown selection mode: {mode}")
+    N = X.shape[0]
+    has_label = np.ones(N, dtype=bool) if has_label is None else np.asarray(has_label, dtype=bool)
+    keys = np.zeros(N, dtype=np.int64) if groups is None else np.asarray(groups)
+    if groups is not None and seeds is not None and not isinstance(seeds, dict):
+        raise ValueError("seeds must be a {group: array} dict when groups are given")
+
+    grouped = {k: {"indices": np.flatnonzero(keys == k)} for k in np.unique(keys).tolist()}
+    if mode == "fps":
+        allocate_fps(grouped, n)
+
+    out = [[], [], [], []]
+    with limit_blas_threads(1) if n_threads > 1 else contextlib.nullcontext():
+        for k, g in grouped.items():
+            rows = g["indices"]
+            s = seeds.get(k) if isinstance(seeds, dict) else seeds
+            s_labels = seed_labels.get(k) if isinstance(seed_labels, dict) else seed_labels
+            if s is not None:
+                s = np.asarray(s)
+                if s_labels is None:
+                    s_labels = np.ones(len(s), dtype=bool)
+            if mode == "fps":
+                res = fps_selection_target_n(X[rows], has_label[rows], g["n_select"],
+                                             n_threads=n_threads, seeds=s)
+            else:
+                res = cosine_threshold_dedup(X[rows], has_label[rows], simlT, n_threads=n_threads,
+                                             seeds=s, seed_labels=s_labels)
+            for lst, idx in zip(out, res):
+                lst.extend(rows[np.asarray(idx, dtype=np.int64)].tolist())
+    return _as_result(out)
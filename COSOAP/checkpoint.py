@@ -0,0 +1,61 @@
+import os
+import time
+import hashlib
+import numpy as np
+
+# =========================================================
+# 筛选状态的检查点：长时间运行的 FPS / Threshold 定期保存进度，--resume 时从中继续
+# =========================================================
+def fingerprint(*parts):
+    """检查点的身份摘要：参数与组内容 (行号、标签、种子) 都相同时才能续算"""
+    h = hashlib.md5()
+    for part in parts:
+        if part is None:
+            h.update(b"\0")
+        elif isinstance(part, np.ndarray) or hasattr(part, "__array__"):
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode())
+        h.update(b"|")
+    return h.hexdigest()[:16]
+
+
+def checkpoint_path(cache_dir, tag, mode, key):
+    return f"{cache_dir}/checkpoint/SELECT_{tag}_{mode}_{key}.npz"
+
+
+class Checkpoint:
+    """
+    单个组的筛选检查点 (npz)：due() 在距上次保存 every 秒后为真，save() 写临时文件后原子替换
+    resume=False 时照常保存但 load() 总是返回 None；指纹不符的旧检查点被忽略
+    """
+    def __init__(self, path, fingerprint, every=600.0, resume=False):
+        self.path, self.fingerprint = path, fingerprint
+        self.every, self.resume = every, resume
+        self._last = time.perf_counter()
+
+    def load(self):
+        if not self.resume or not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as z:
+            if str(z["fingerprint"]) != self.fingerprint:
+                print(f"[RESUME] Ignoring stale checkpoint {self.path}")
+                return None
+            state = {k: z[k] for k in z.files if k != "fingerprint"}
+        print(f"[RESUME] Continuing from {self.path}")
+        return state
+
+    def due(self):
+        return self.every > 0 and time.perf_counter() - self._last >= self.every
+
+    def save(self, **arrays):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path[:-len(".npz")] + ".tmp.npz"
+        np.savez(tmp_path, fingerprint=np.array(self.fingerprint), **arrays)
+        os.replace(tmp_path, self.path)
+        self._last = time.perf_counter()
+
+    def clear(self):
+        """组完成后删除检查点"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
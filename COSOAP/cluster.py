@@ -0,0 +1,61 @@
+import numpy as np
+from .utils import map_row_chunks
+
+
+# =========================================================
+# Mini-batch k-means：两级筛选的粗分簇，每次只读取一小批行 (适用于 mmap 缓存)
+# =========================================================
+def nearest_center(X, centers, c_sq=None):
+    """各行最近的中心 (欧氏距离)，只需 |c|^2 - 2 x.c"""
+    if c_sq is None:
+        c_sq = np.einsum("ij,ij->i", centers, centers)
+    d = np.asarray(X, dtype=np.float32) @ centers.T
+    d *= -2.0
+    d += c_sq
+    return d.argmin(axis=1)
+
+
+def assign_clusters(X, centers, chunk_rows=16384, executor=None):
+    """按行块把所有行分配到最近的中心"""
+    c_sq = np.einsum("ij,ij->i", centers, centers)
+    labels = np.empty(X.shape[0], dtype=np.int64)
+
+    def assign(start, end):
+        labels[start:end] = nearest_center(X[start:end], centers, c_sq)
+
+    map_row_chunks(assign, X.shape[0], chunk_rows, executor)
+    return labels
+
+
+def minibatch_kmeans(X, n_clusters, batch_size=2048, n_iter=100, seed=0, executor=None):
+    """
+    Mini-batch k-means (Sculley 2010)：中心初始化为随机行，
+    每次迭代随机抽取 batch_size 行，各中心以累计样本数的倒数为步长移向分给它的样本均值
+    返回 (centers, labels)，labels 由最后一次全量分块分配得到
+    """
+    N = X.shape[0]
+    n_clusters = max(1, min(int(n_clusters), N))
+    rng = np.random.default_rng(seed)
+    centers = np.asarray(X[np.sort(rng.choice(N, n_clusters, replace=False))],
+                         dtype=np.float32).copy()
+    counts = np.zeros(n_clusters, dtype=np.float64)
+
+    for _ in range(n_iter):
+        batch = np.sort(rng.choice(N, min(batch_size, N), replace=False))
+        B = np.asarray(X[batch], dtype=np.float32)
+        lab = nearest_center(B, centers)
+        order = np.argsort(lab, kind="stable")
+        hit, starts, n_c = np.unique(lab[order], return_index=True, return_counts=True)
+        sums = np.add.reduceat(B[order].astype(np.float64), starts, axis=0)
+        counts[hit] += n_c
+        step = (sums - n_c[:, None] * centers[hit]) / counts[hit, None]
+        centers[hit] += step.astype(np.float32)
+
+    return centers, assign_clusters(X, centers, executor=executor)
+
+
+def cluster_members(labels):
+    """各非空簇的行号 (簇内保持原始顺序)"""
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(labels.max() + 2)) if len(labels) else [0]
+    return [order[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
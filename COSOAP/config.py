@@ -1,5 +1,6 @@
 import argparse
 from multiprocessing import cpu_count
+from .sweep import parse_setting
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -32,13 +33,167 @@ Output files:
     parser.add_argument("-s", "--simlT", type=float, default=0.005,
                         help="[Threshold Mode] Similarity threshold (1 - cosine). Default: 0.005")
 
+    parser.add_argument("--backend", type=str, default="exact", choices=["exact", "lsh"],
+                        help="[Threshold Mode] Neighbour search: 'exact' (blocked all-pairs) or "
+                             "'lsh' (random-projection index, approximate). Default: exact")
+
+    parser.add_argument("--lsh-tables", dest="lsh_tables", type=int, default=None,
+                        help="[LSH] Number of hash tables. Default: enough for 95%% recall at simlT (at most 32)")
+
+    parser.add_argument("--lsh-bits", dest="lsh_bits", type=int, default=None,
+                        help="[LSH] Hash bits per table. Default: the most bits the table budget allows at simlT")
+
+    parser.add_argument("--lsh-min-rows", dest="lsh_min_rows", type=int, default=50000,
+                        help="[LSH] Groups smaller than this use the exact backend. Default: 50000")
+
+    parser.add_argument("--recall-sample", dest="recall_sample", type=int, default=200,
+                        help="[LSH] Reference frames per group used to estimate recall vs exact (0: off). Default: 200")
+
+    parser.add_argument("--lsh-min-recall", dest="lsh_min_recall", type=float, default=0.9,
+                        help="[LSH] Groups whose sampled recall is below this fall back to the exact backend. Default: 0.9")
+
+    parser.add_argument("--hier", action="store_true",
+                        help="Two-stage selection for large groups: mini-batch k-means clusters, "
+                             "then FPS / threshold dedup within clusters and across cluster "
+                             "representatives (approximate)")
+
+    parser.add_argument("--hier-min-rows", dest="hier_min_rows", type=int, default=200000,
+                        help="[Hier] Groups smaller than this use the exact selection. Default: 200000")
+
+    parser.add_argument("--hier-clusters", dest="hier_clusters", type=int, default=None,
+                        help="[Hier] Clusters per group. Default: sqrt(oversample * n_select) for "
+                             "FPS, sqrt(group size) for threshold")
+
+    parser.add_argument("--hier-oversample", dest="hier_oversample", type=float, default=4.0,
+                        help="[Hier] FPS candidates kept from the clusters, as a multiple of the "
+                             "group's target. Default: 4")
+
+    parser.add_argument("--coverage-sample", dest="coverage_sample", type=int, default=2000,
+                        help="[Hier] Rows per group on which exact and two-stage selection are both "
+                             "run to compare coverage radius (0: off). Default: 2000")
+
     parser.add_argument("-a", "--atoms", type=str, default="C H O",
                         help="SOAP centers (e.g. 'C H O')")
 
     parser.add_argument("-r", "--rcut", type=float, default=6.0,
                         help="SOAP cutoff radius")
 
+    parser.add_argument("--energy-range", dest="energy_range", type=float, nargs=2,
+                        default=[-10.0, -1.0], metavar=("EMIN", "EMAX"),
+                        help="Labeled structures with energy per atom outside [EMIN, EMAX] (eV/atom) "
+                             "are dropped. Default: -10 -1")
+
+    parser.add_argument("--max-force", dest="max_force", type=float, default=10.0,
+                        help="Labeled structures with any atomic force above this (eV/A) are dropped. "
+                             "Default: 10")
+
+    parser.add_argument("--max-kpts", dest="max_kpts", type=int, default=100,
+                        help="Structures whose estimated k-point count exceeds this are dropped. "
+                             "Default: 100")
+
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream frames instead of loading every structure; descriptors are "
+                             "computed in batches and outputs are copied from the source files")
+
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=512,
+                        help="[Stream/Pipeline] Frames per descriptor batch (and per parse chunk with "
+                             "--pipeline). Default: 512")
+
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap reading, descriptor computation and selection in one worker "
+                             "pool: frames are parsed in parallel and each group is selected as "
+                             "soon as its descriptors are done, with bounded queues between stages")
+
+    parser.add_argument("--store", type=str, default="off", choices=["off", "float32", "float16", "int8"],
+                        help="Pack all group caches into one memory-mapped store and select on it, "
+                             "optionally quantized to float16/int8. Default: off")
+
+    parser.add_argument("--store-report", dest="store_report", action="store_true",
+                        help="[Store] Also select on the float32 caches and report how the "
+                             "selections differ")
+
+    parser.add_argument("--reduce", type=str, default="off", choices=["off", "pca", "rp"],
+                        help="Reduce descriptor dimension before selection: 'pca' (uncentered, "
+                             "fitted on a sample per group) or 'rp' (Gaussian random projection). "
+                             "Reduced matrices are cached next to the originals. Default: off")
+
+    parser.add_argument("--reduce-dim", dest="reduce_dim", type=int, default=128,
+                        help="[Reduce] Target dimension. Default: 128")
+
+    parser.add_argument("--reduce-sample", dest="reduce_sample", type=int, default=20000,
+                        help="[Reduce] Rows per group used to fit PCA. Default: 20000")
+
+    parser.add_argument("--distortion-pairs", dest="distortion_pairs", type=int, default=2000,
+                        help="[Reduce] Random row pairs per group used to report distance "
+                             "distortion vs the full descriptors (0: off). Default: 2000")
+
+    parser.add_argument("--sweep", nargs="+", type=parse_setting, default=None,
+                        metavar="RCUT[:NMAX[:LMAX]]",
+                        help="Compare several SOAP settings (n_max/l_max default 8/6): inputs are "
+                             "read and grouped once, all settings are computed in one pass per "
+                             "frame and cached separately, then selection runs per setting and "
+                             "the selections are compared (overlap, coverage). -r is ignored and "
+                             "no xyz outputs are written")
+
+    parser.add_argument("--sweep-report", dest="sweep_report", default="sweep_report.json",
+                        metavar="FILE", help="[Sweep] JSON comparison report. Default: sweep_report.json")
+
+    parser.add_argument("--reparse", action="store_true",
+                        help="Ignore the cache manifest and re-read every input file even if "
+                             "nothing changed since the last run")
+
+    parser.add_argument("--seed-train", dest="seed_train", nargs="+", default=None, metavar="FILE",
+                        help="Existing training set used as fixed seeds: FPS continues from it and "
+                             "threshold mode drops structures similar to it. Accepts train_rows.npz "
+                             "from a previous run (no parsing) or structure files such as "
+                             "train_labeled.xyz")
+
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted FPS / threshold selection from its last "
+                             "checkpoint (descriptor caches always resume from their last commit)")
+
+    parser.add_argument("--checkpoint-every", dest="checkpoint_every", type=float, default=600.0,
+                        metavar="SECONDS",
+                        help="Save selection progress of each running group at most this often "
+                             "(0: off). Default: 600")
+
+    shard = parser.add_mutually_exclusive_group()
+    shard.add_argument("--shard-plan", dest="shard_plan", type=int, default=None, metavar="N",
+                       help="Read the inputs once (no descriptors), assign groups to N shards "
+                            "balanced by frame and atom count, write SHARD_DIR/plan.npz and exit. "
+                            "Input, SOAP, filter and selection options are fixed by the plan")
+
+    shard.add_argument("--shard", type=int, default=None, metavar="K",
+                       help="Run shard K (0-based) of the plan: parse only its frames, build its "
+                            "caches, select and write SHARD_DIR/part_K.npz")
+
+    shard.add_argument("--shard-merge", dest="shard_merge", action="store_true",
+                       help="Combine all shard results into the final outputs and train_rows.npz")
+
+    parser.add_argument("--shard-dir", dest="shard_dir", type=str, default="shards",
+                        help="[Shard] Directory of the plan and shard results. Default: shards")
+
+    parser.add_argument("--profile", nargs="?", const="run_report.json", default=None, metavar="REPORT",
+                        help="Write a JSON run report: wall/CPU time and peak memory per stage and "
+                             "group, cache hits/misses, filter drops and selection counts. "
+                             "Default file: run_report.json")
+
+    parser.add_argument("--profile-selection", dest="profile_selection", default=None, metavar="FILE",
+                        help="Dump a cProfile of the selection stage (all groups, including pool "
+                             "workers) to FILE; view with 'python -m pstats FILE'")
+
     args = parser.parse_args()
+    if args.shard is not None and (args.store != "off" or args.seed_train):
+        parser.error("--store and --seed-train are not supported with --shard")
+    if args.pipeline and (args.store != "off" or args.reduce != "off" or args.seed_train
+                          or args.shard is not None or args.shard_plan is not None):
+        parser.error("--pipeline cannot be combined with --store, --reduce, --seed-train "
+                     "or sharding")
+    if args.sweep and (args.stream or args.pipeline or args.store != "off" or args.reduce != "off"
+                       or args.seed_train or args.shard is not None
+                       or args.shard_plan is not None or args.shard_merge):
+        parser.error("--sweep cannot be combined with --stream, --pipeline, --store, --reduce, "
+                     "--seed-train or sharding")
 
     print("=" * 60)
     print(f"SOAP Selection Tool | Mode: {args.mode.upper()}")
@@ -47,6 +202,25 @@ Output files:
         print(f"  Target Total N  : {args.num}")
     else:
         print(f"  Siml Threshold  : {args.simlT} (1-Cos)")
+        print(f"  Backend         : {args.backend}")
+    if args.pipeline:
+        print(f"  Pipeline        : batches of {args.batch_size}")
+    if args.sweep:
+        print(f"  Sweep           : {', '.join(f'r{r:g} n{n} l{l}' for r, n, l in args.sweep)}")
+    if args.hier:
+        print(f"  Two-stage       : groups >= {args.hier_min_rows} rows")
+    if args.reduce != "off":
+        print(f"  Reduce          : {args.reduce} to {args.reduce_dim} dims")
+    if args.store != "off":
+        print(f"  Store           : {args.store}")
+    if args.seed_train:
+        print(f"  Seed Train Set  : {' '.join(args.seed_train)}")
+    if args.shard_plan is not None:
+        print(f"  Shard Plan      : {args.shard_plan} shards in {args.shard_dir}")
+    elif args.shard is not None:
+        print(f"  Shard           : {args.shard} ({args.shard_dir})")
+    elif args.shard_merge:
+        print(f"  Shard Merge     : {args.shard_dir}")
     print(f"  Processes       : {args.nproc}")
     print("=" * 60)
 
@@ -1,218 +1,860 @@
+import os
+import pstats
+import cProfile
+import contextlib
 import numpy as np
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from .soap import soap_param_hash
+from .soap import load_cache_with_label, load_cache_rows
+from .store import DescriptorStore
+from .profiling import measure
+from .utils import normalize_rows, NormalizedRows, row_sq_norms, row_mean, limit_blas_threads, map_row_chunks
+from .lsh import LSHIndex, lsh_recall, lsh_params
+from .cluster import minibatch_kmeans, cluster_members
+from .checkpoint import Checkpoint, checkpoint_path, fingerprint
 
-def load_cache_with_label(symbols_str, cache_dir):
-    tag = soap_param_hash()
-    soap = np.load(f"{cache_dir}/SOAP_{tag}_{symbols_str}.npy", mmap_mode="r")
-    idx = np.load(f"{cache_dir}/INDEX_{symbols_str}.npy")
-    has_label = np.load(f"{cache_dir}/HAS_LABEL_{symbols_str}.npy")
-    return soap, idx, has_label
+def _load_group(symbols_str, cache_dir, tag, store=None, arrays=None):
+    """
+    组的描述符、行号与标签：给出 store 时从合并存储读取 (可能是量化数据)
+    arrays 为跨调用复用的已打开缓存 (见 soap._open_cache)
+    """
+    if store is not None:
+        return DescriptorStore(store).group(symbols_str)
+    return load_cache_with_label(symbols_str, cache_dir, tag, arrays)
 
 # =========================================================
 # 算法 1: FPS (最远点采样) - 指定数量
 # =========================================================
-def fps_selection_target_n(soap, has_label_list, n_select):
+class _FPSState:
+    """
+    FPS 的预分配状态：平方范数、最小平方距离、已选标记与缓冲区
+    距离用 |x-m|^2 + |c-m|^2 - 2 (x-m).(c-m) 展开 (m 为均值，减小相消误差)，
+    每次选点只做一次 float32 的分块矩阵-向量乘法，按块读取 mmap 缓存；
+    n_threads > 1 时各行块由线程并行更新 (numpy 在 dot 中释放 GIL)
+    """
+    def __init__(self, soap, chunk_rows=65536, n_threads=1):
+        N = soap.shape[0]
+        self.soap = soap
+        self.chunk_rows = max(1, min(chunk_rows, -(-N // max(1, n_threads))))
+        self.executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+        self.mean = row_mean(soap, self.chunk_rows)
+        self.sq_norms = row_sq_norms(soap, self.chunk_rows, center=self.mean)
+        self.min_dists = np.full(N, np.inf, dtype=np.float64)
+        self.selected = np.zeros(N, dtype=bool)
+        self._dot = np.empty(N, dtype=np.float32)
+        self._buf = np.empty(N, dtype=np.float64)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def select(self, idx):
+        """选中第 idx 行，原地更新所有行到已选集合的最小平方距离"""
+        self.selected[idx] = True
+        c = np.asarray(self.soap[idx], dtype=np.float64) - self.mean
+        c_sq = self.sq_norms[idx]
+        c_shift = float(self.mean @ c)
+        c = c.astype(np.float32)
+
+        def update(start, end):
+            dot, d = self._dot[start:end], self._buf[start:end]
+            np.dot(np.asarray(self.soap[start:end], dtype=np.float32), c, out=dot)
+            np.subtract(dot, c_shift, out=d)
+            d *= -2.0
+            d += self.sq_norms[start:end]
+            d += c_sq
+            np.minimum(self.min_dists[start:end], d, out=self.min_dists[start:end])
+
+        map_row_chunks(update, len(self.min_dists), self.chunk_rows, self.executor)
+
+    def seed(self, seeds, seed_chunk=4096, row_chunk=2048):
+        """
+        用固定种子 (已有训练集的描述符) 初始化最小距离，种子本身不在候选中
+        按 (行块 x 种子块) 做矩阵乘法，开销与 N * 种子数成正比
+        """
+        N = len(self.min_dists)
+        row_chunk = max(1, min(row_chunk, self.chunk_rows))
+        for s0 in range(0, seeds.shape[0], seed_chunk):
+            S = np.asarray(seeds[s0:s0 + seed_chunk], dtype=np.float64) - self.mean
+            s_term = np.einsum("ij,ij->i", S, S) + 2.0 * (S @ self.mean)   # |s|^2 + 2 m.s
+            S = S.astype(np.float32)
+
+            def update(start, end):
+                dot = np.asarray(self.soap[start:end], dtype=np.float32) @ S.T
+                d = s_term - 2.0 * dot.astype(np.float64)
+                d = d.min(axis=1)
+                d += self.sq_norms[start:end]
+                np.minimum(self.min_dists[start:end], d, out=self.min_dists[start:end])
+
+            map_row_chunks(update, N, row_chunk, self.executor)
+
+    def farthest(self, cand):
+        """cand 中 min_dists 最大的行 (并列取最靠前者)，cand 为空时返回 -1"""
+        def chunk_best(start, end):
+            score = self._buf[start:end]
+            score.fill(-np.inf)
+            np.copyto(score, self.min_dists[start:end], where=cand[start:end])
+            k = int(np.argmax(score))
+            return start + k, score[k]
+
+        best, best_val = -1, -np.inf
+        for idx, val in map_row_chunks(chunk_best, len(self.min_dists), self.chunk_rows,
+                                       self.executor):
+            if val > best_val:
+                best, best_val = idx, val
+        return best
+
+
+def fps_selection_target_n(soap, has_label_list, n_select, chunk_rows=65536, n_threads=1,
+                           seeds=None, checkpoint=None):
     """
     基于数量的 FPS 筛选，使用欧几里得距离 (对归一化SOAP等价于Cosine距离)
+    先在有标签结构中选，不足再从无标签结构中补
+    seeds 为已有训练集的描述符 (固定种子)：最小距离从种子初始化，第一个点也取最远点
+    checkpoint (见 checkpoint.Checkpoint) 不为 None 时定期保存已选序号与 min_dists，
+    有可用的检查点时从中继续
     """
-    N = soap.shape[0]
-    has_label = np.array(has_label_list, dtype=bool)
-    
+    has_label = np.asarray(has_label_list, dtype=bool)
     uniq_label_idx, uniq_unlabel_idx = [], []
-    all_indices = np.arange(N)
-    labeled_indices = all_indices[has_label]
-    unlabeled_indices = all_indices[~has_label]
-    
-    n_labeled = len(labeled_indices)
-    min_dists = np.full(N, np.inf, dtype=np.float32)
-    current_count = 0
-    
-    # --- Phase 1: Labeled ---
-    n_from_labeled = min(n_labeled, n_select)
-    if n_from_labeled > 0:
-        first_idx = labeled_indices[0]
-        uniq_label_idx.append(first_idx)
-        dists = np.linalg.norm(soap - soap[first_idx], axis=1)
-        min_dists = np.minimum(min_dists, dists)
-        current_count += 1
-        
-        remaining_mask = np.ones(n_labeled, dtype=bool)
-        remaining_mask[0] = False
-        
-        for _ in range(n_from_labeled - 1):
-            current_dists_subset = min_dists[labeled_indices]
-            masked_dists = current_dists_subset.copy()
-            masked_dists[~remaining_mask] = -1.0
-            
-            best_local_idx = np.argmax(masked_dists)
-            best_global_idx = labeled_indices[best_local_idx]
-            
-            uniq_label_idx.append(best_global_idx)
-            remaining_mask[best_local_idx] = False
-            current_count += 1
-            
-            new_dists = np.linalg.norm(soap - soap[best_global_idx], axis=1)
-            min_dists = np.minimum(min_dists, new_dists)
-
-    # --- Phase 2: Unlabeled ---
-    n_needed = n_select - current_count
-    if n_needed > 0 and len(unlabeled_indices) > 0:
-        remaining_mask = np.ones(len(unlabeled_indices), dtype=bool)
-        
-        if current_count == 0:
-            first_idx = unlabeled_indices[0]
-            uniq_unlabel_idx.append(first_idx)
-            dists = np.linalg.norm(soap - soap[first_idx], axis=1)
-            min_dists = np.minimum(min_dists, dists)
-            remaining_mask[0] = False
-            n_needed -= 1
-
-        for _ in range(n_needed):
-            if not np.any(remaining_mask): break
-            current_dists_subset = min_dists[unlabeled_indices]
-            masked_dists = current_dists_subset.copy()
-            masked_dists[~remaining_mask] = -1.0
-            
-            best_local_idx = np.argmax(masked_dists)
-            best_global_idx = unlabeled_indices[best_local_idx]
-            
-            uniq_unlabel_idx.append(best_global_idx)
-            remaining_mask[best_local_idx] = False
-            
-            new_dists = np.linalg.norm(soap - soap[best_global_idx], axis=1)
-            min_dists = np.minimum(min_dists, new_dists)
+
+    if soap.shape[0] > 0 and n_select > 0:
+        state = _FPSState(soap, chunk_rows, n_threads)
+        seeded = seeds is not None and seeds.shape[0] > 0
+        resumed = checkpoint.load() if checkpoint is not None else None
+        if resumed is not None:
+            uniq_label_idx = resumed["label"].tolist()
+            uniq_unlabel_idx = resumed["unlabel"].tolist()
+            state.min_dists[:] = resumed["min_dists"]
+            state.selected[uniq_label_idx + uniq_unlabel_idx] = True
+        elif seeded:
+            state.seed(seeds)
+        n_labeled = int(has_label.sum())
+
+        def save_progress():
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save(label=np.array(uniq_label_idx, dtype=np.int64),
+                                unlabel=np.array(uniq_unlabel_idx, dtype=np.int64),
+                                min_dists=state.min_dists)
+
+        # --- Phase 1: Labeled ---
+        n_from_labeled = min(n_labeled, n_select)
+        cand = has_label & ~state.selected
+        for k in range(len(uniq_label_idx), n_from_labeled):
+            # 第一个点取第一个有标签结构，之后取最远点
+            idx = int(np.argmax(cand)) if k == 0 and not seeded else state.farthest(cand)
+            uniq_label_idx.append(idx)
+            cand[idx] = False
+            state.select(idx)
+            save_progress()
+
+        # --- Phase 2: Unlabeled ---
+        n_needed = n_select - n_from_labeled
+        cand = ~has_label & ~state.selected
+        for k in range(len(uniq_unlabel_idx), n_needed):
+            if k == 0 and n_from_labeled == 0 and not seeded:
+                idx = int(np.argmax(cand)) if cand.any() else -1
+            else:
+                idx = state.farthest(cand)
+            if idx < 0: break
+            uniq_unlabel_idx.append(idx)
+            cand[idx] = False
+            state.select(idx)
+            save_progress()
+
+        state.close()
+        selected = state.selected
+    else:
+        selected = np.zeros(soap.shape[0], dtype=bool)
 
     # 剩余的归为 Test
-    selected_set = set(uniq_label_idx + uniq_unlabel_idx)
-    test_label_idx = [i for i in labeled_indices if i not in selected_set]
-    test_unlabel_idx = [i for i in unlabeled_indices if i not in selected_set]
+    test_label_idx = np.flatnonzero(has_label & ~selected).tolist()
+    test_unlabel_idx = np.flatnonzero(~has_label & ~selected).tolist()
 
     return uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx
 
 # =========================================================
 # 算法 2: Cosine Threshold (贪婪去重) - 指定阈值
 # =========================================================
-def cosine_threshold_dedup(soap, has_label_list, simlT):
+def _assign_group(similar_group, has_label, uniq_label_idx, uniq_unlabel_idx,
+                  test_label_idx, test_unlabel_idx):
+    """
+    组内优先选有标签 (similar_group 按原始顺序排列，第一个为参考点)
+    """
+    similar_group = [int(k) for k in similar_group]
+    if len(similar_group) >= 2:
+        labeled_in_group = [k for k in similar_group if has_label[k]]
+        if labeled_in_group:
+            uniq_label_idx.append(labeled_in_group[0])
+            if len(labeled_in_group) >= 2:
+                test_label_idx.append(labeled_in_group[-1])
+            else:
+                # 选一个无标签的做测试
+                others = [k for k in similar_group if k != labeled_in_group[0]]
+                if others: test_unlabel_idx.append(others[0])
+        else:
+            uniq_unlabel_idx.append(similar_group[0])
+            test_unlabel_idx.append(similar_group[1])
+    else:
+        if has_label[similar_group[0]]: uniq_label_idx.append(similar_group[0])
+        else: uniq_unlabel_idx.append(similar_group[0])
+
+
+def _seed_claims(X, seeds, sim_min, seed_chunk=4096, row_chunk=4096, executor=None):
+    """每一行第一个相似 (cos >= sim_min) 的种子序号，没有则为 -1；X 为 NormalizedRows"""
+    N = X.shape[0]
+    claim = np.full(N, -1, dtype=np.int64)
+    for s0 in range(0, seeds.shape[0], seed_chunk):
+        S = normalize_rows(seeds[s0:s0 + seed_chunk])
+
+        def assign(start, end):
+            free = np.flatnonzero(claim[start:end] < 0) + start
+            if free.size == 0:
+                return
+            hit = X.matmul(free, S.T) >= sim_min
+            any_hit = hit.any(axis=1)
+            claim[free[any_hit]] = s0 + hit[any_hit].argmax(axis=1)
+
+        map_row_chunks(assign, N, row_chunk, executor)
+    return claim
+
+
+def _drop_seeds(lists, N):
+    """去掉结果中的种子 (序号 >= N)"""
+    return [[k for k in idx if k < N] for idx in lists]
+
+
+def cosine_threshold_dedup(soap, has_label_list, simlT, block_size=256, col_chunk=4096,
+                           n_threads=1, seeds=None, seed_labels=None, checkpoint=None, owner=None):
     """
-    原始的贪婪去重逻辑：相似度 > (1-simlT) 则丢弃
+    贪婪去重：相似度 > (1-simlT) 则丢弃
+    按归一化的行计算 (NormalizedRows，逐块读取与反量化)：每次取 remaining 的前 block_size 行，
+    先在块内顺序确定参考点，再用一次矩阵乘法把剩余点分配给第一个相似的参考点，
+    结果与逐点遍历的原始实现一致；n_threads > 1 时剩余点按行块多线程计算
+    seeds 为已有训练集的描述符 (固定种子，标签为 seed_labels)：视为排在最前面的参考点，
+    与种子相似的结构按同样的组规则处理，种子本身不出现在结果中
+    checkpoint 不为 None 时定期保存尚未处理的 remaining 与已有结果，有可用的检查点时从中继续
+    owner 不为 None 时 (长度 N 的整数数组) 写入每行所属相似组的参考点序号 (种子 s 记为 N + s)
     """
     N = soap.shape[0]
-    # 需要计算 Norms 进行 Cosine 计算
-    norms = np.linalg.norm(soap, axis=1)
-    has_label = np.array(has_label_list)
+    has_label = np.asarray(has_label_list, dtype=bool)
+    X = NormalizedRows(soap)
+    sim_min = 1.0 - simlT
 
-    remaining = list(range(N))
     uniq_label_idx, uniq_unlabel_idx = [], []
     test_label_idx, test_unlabel_idx = [], []
 
-    while remaining:
-        i = remaining[0]
-        ref, ref_norm = soap[i], norms[i]
+    executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+    remaining = np.arange(N)
+    resumed = checkpoint.load() if checkpoint is not None else None
+    if resumed is not None:
+        remaining = resumed["remaining"]
+        uniq_label_idx = resumed["uniq_label"].tolist()
+        uniq_unlabel_idx = resumed["uniq_unlabel"].tolist()
+        test_label_idx = resumed["test_label"].tolist()
+        test_unlabel_idx = resumed["test_unlabel"].tolist()
+    elif seeds is not None and seeds.shape[0] > 0:
+        # 种子序号记为 N + s，与组内序号共用 _assign_group
+        claim = _seed_claims(X, seeds, sim_min, executor=executor)
+        has_label = np.concatenate([has_label, np.asarray(seed_labels, dtype=bool)])
+        claimed = np.flatnonzero(claim >= 0)
+        claimed = claimed[np.argsort(claim[claimed], kind="stable")]
+        if owner is not None:
+            owner[claimed] = N + claim[claimed]
+        owners, starts = np.unique(claim[claimed], return_index=True)
+        for s, members in zip(owners, np.split(claimed, starts[1:])):
+            _assign_group(np.concatenate([[N + s], members]), has_label, uniq_label_idx,
+                          uniq_unlabel_idx, test_label_idx, test_unlabel_idx)
+        uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = _drop_seeds(
+            [uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx], N)
+        remaining = np.flatnonzero(claim < 0)
+    while remaining.size:
+        blk = remaining[:block_size]
+        rest = remaining[block_size:]
 
-        similar_group = [i]
-        next_remain = []
+        # 块内：顺序确定参考点及其认领的块内成员
+        Xb = X[blk]
+        gram = Xb @ Xb.T
+        owner_blk = np.full(len(blk), -1, dtype=np.int64)
+        refs = []
+        for b in range(len(blk)):
+            if owner_blk[b] >= 0:
+                continue
+            hit = (gram[b] >= sim_min) & (owner_blk < 0)
+            hit[b] = True
+            owner_blk[hit] = len(refs)
+            refs.append(b)
 
-        # 遍历剩余点
-        for j in remaining[1:]:
-            # Cosine Sim
-            cos_sim = ref.dot(soap[j]) / (ref_norm * norms[j] + 1e-12)
-            # 如果相似 (1 - cos <= simlT)
-            if 1 - cos_sim <= simlT:
-                similar_group.append(j)
-            else:
-                next_remain.append(j)
-
-        # 组内优先选有标签
-        if len(similar_group) >= 2:
-            labeled_in_group = [k for k in similar_group if has_label[k]]
-            if labeled_in_group:
-                uniq_label_idx.append(labeled_in_group[0])
-                if len(labeled_in_group) >= 2:
-                    test_label_idx.append(labeled_in_group[-1])
-                else:
-                    # 选一个无标签的做测试
-                    others = [k for k in similar_group if k!= labeled_in_group[0]]
-                    if others: test_unlabel_idx.append(others[0])
-            else:
-                uniq_unlabel_idx.append(similar_group[0])
-                if len(similar_group) >= 2:
-                    test_unlabel_idx.append(similar_group[1])
-        else:
-            if has_label[similar_group[0]]: uniq_label_idx.append(similar_group[0])
-            else: uniq_unlabel_idx.append(similar_group[0])
+        # 块外：每个点归属第一个相似的参考点
+        Xr = Xb[refs]
+        owner_rest = np.full(len(rest), -1, dtype=np.int64)
+
+        def assign(start, end):
+            hit = X.matmul(rest[start:end], Xr.T) >= sim_min
+            any_hit = hit.any(axis=1)
+            owner_rest[start:end][any_hit] = hit[any_hit].argmax(axis=1)
+
+        chunk = col_chunk if executor is None else max(1, min(col_chunk, -(-len(rest) // n_threads)))
+        map_row_chunks(assign, len(rest), chunk, executor)
+
+        # 拼出每个参考点的相似组 (块内成员在前，保持原始顺序)
+        claimed = np.nonzero(owner_rest >= 0)[0]
+        order = np.argsort(owner_rest[claimed], kind="stable")
+        claimed = claimed[order]
+        bounds = np.searchsorted(owner_rest[claimed], np.arange(len(refs) + 1))
+        if owner is not None:
+            owner[blk] = blk[np.asarray(refs)[owner_blk]]
+            owner[rest[claimed]] = blk[np.asarray(refs)[owner_rest[claimed]]]
+        for r in range(len(refs)):
+            similar_group = np.concatenate([blk[owner_blk == r],
+                                            rest[claimed[bounds[r]:bounds[r + 1]]]])
+            _assign_group(similar_group, has_label, uniq_label_idx, uniq_unlabel_idx,
+                          test_label_idx, test_unlabel_idx)
+
+        remaining = rest[owner_rest < 0]
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save(remaining=remaining,
+                            uniq_label=np.array(uniq_label_idx, dtype=np.int64),
+                            uniq_unlabel=np.array(uniq_unlabel_idx, dtype=np.int64),
+                            test_label=np.array(test_label_idx, dtype=np.int64),
+                            test_unlabel=np.array(test_unlabel_idx, dtype=np.int64))
+
+    if executor is not None:
+        executor.shutdown()
+    return uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx
+
+def lsh_threshold_dedup(soap, has_label_list, simlT, n_tables=None, n_bits=None, seed=0,
+                        recall_sample=0, min_recall=0.9, stats=None, n_threads=1):
+    """
+    LSH 近似贪婪去重：参考点只与 LSH 同桶候选比较，其余逻辑与 cosine_threshold_dedup 相同
+    漏掉的相似点 (召回损失) 会作为新的参考点保留在 train 中
+    n_tables / n_bits 缺省时由 simlT 推出 (见 lsh.lsh_params)
+    recall_sample > 0 时抽样估计召回率，写入 stats["recall"] / stats["n_exact"]；
+    抽样召回率低于 min_recall 时改用精确计算 (stats["fallback"] = True)
+    n_threads > 1 时按块取接下来的若干个存活行，多线程核对各自的同桶候选，再按顺序应用，
+    结果与逐点执行相同
+    """
+    N = soap.shape[0]
+    has_label = np.asarray(has_label_list, dtype=bool)
+    X = NormalizedRows(soap)
+    n_tables, n_bits, expected = lsh_params(simlT, n_tables, n_bits)
+    index = LSHIndex(X, n_tables, n_bits, seed)
+    sim_min = 1.0 - simlT
+    stats = {} if stats is None else stats
+    stats.update(n_tables=n_tables, n_bits=n_bits, expected_recall=expected)
+
+    if recall_sample > 0:
+        stats["recall"], stats["n_exact"] = lsh_recall(X, index, simlT, recall_sample, seed)
+        if stats["recall"] < min_recall:
+            stats["fallback"] = True
+            return cosine_threshold_dedup(soap, has_label, simlT, n_threads=n_threads)
+
+    uniq_label_idx, uniq_unlabel_idx = [], []
+    test_label_idx, test_unlabel_idx = [], []
+
+    executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+    block = 1 if executor is None else n_threads * 16
+    window = max(64, block * 4)
+    alive = np.ones(N, dtype=bool)
+
+    def hits_of(i):
+        """第 i 行的同桶候选中相似的存活行 (不含 i)；只读 alive"""
+        cand = index.candidates(i, alive)
+        cand = cand[cand != i]
+        return cand[X.matmul(cand, X[i]) >= sim_min]
+
+    start = 0
+    while start < N:
+        refs = start + np.flatnonzero(alive[start:start + window])[:block]
+        start = refs[-1] + 1 if len(refs) == block else start + window
+        hits = executor.map(hits_of, refs) if executor is not None else map(hits_of, refs)
+        for i, hit in zip(refs, list(hits)):
+            # 块内前面的参考点可能已认领 i 或其候选
+            if not alive[i]:
+                continue
+            alive[i] = False
+            hit = hit[alive[hit]]
+            alive[hit] = False
+            _assign_group(np.concatenate([[i], hit]), has_label, uniq_label_idx, uniq_unlabel_idx,
+                          test_label_idx, test_unlabel_idx)
+
+    if executor is not None:
+        executor.shutdown()
+    return uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx
+
+
+# =========================================================
+# 两级 (粗分簇 -> 簇内精细) 筛选：用于行数很大的组
+# =========================================================
+def _auto_clusters(n):
+    return int(max(1, np.ceil(np.sqrt(max(n, 1)))))
+
+
+def hier_fps_selection(soap, has_label_list, n_select, n_clusters=None, oversample=4.0, seed=0,
+                       n_threads=1, seeds=None):
+    """
+    两级 FPS：mini-batch k-means 粗分簇，在每个簇内用 FPS 选出候选，
+    候选数为目标的 oversample 倍，有标签和无标签结构按各自的目标数量分别按簇大小分配；
+    再在全部候选上做精确 FPS (先有标签后无标签，与 fps_selection_target_n 相同)
+    n_clusters 默认为 sqrt(oversample * n_select)，使分簇与簇内 FPS 的开销相当
+    """
+    N = soap.shape[0]
+    has_label = np.asarray(has_label_list, dtype=bool)
+    n_select = min(n_select, N)
+    if n_select <= 0:
+        return fps_selection_target_n(soap, has_label, 0)
+
+    n_labeled = int(has_label.sum())
+    n_lab_target = min(n_labeled, n_select)
+    targets = ((has_label, n_lab_target, n_labeled),
+               (~has_label, n_select - n_lab_target, N - n_labeled))
+    if n_clusters is None:
+        n_clusters = _auto_clusters(oversample * n_select)
+
+    executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+    _, labels = minibatch_kmeans(soap, n_clusters, seed=seed, executor=executor)
+
+    def candidates(members):
+        pool = []
+        for mask, want, total in targets:
+            rows = members[mask[members]]
+            if want == 0 or len(rows) == 0:
+                continue
+            quota = min(len(rows), int(np.ceil(oversample * want * len(rows) / total)))
+            picked = fps_selection_target_n(np.asarray(soap[rows]), np.ones(len(rows), dtype=bool),
+                                            quota)[0]
+            pool.append(rows[picked])
+        return pool
 
-        remaining = next_remain
+    clusters = cluster_members(labels)
+    parts = executor.map(candidates, clusters) if executor is not None else map(candidates, clusters)
+    pool = np.sort(np.concatenate([p for part in parts for p in part]))
+    if executor is not None:
+        executor.shutdown()
 
+    u_lbl, u_unlbl, _, _ = fps_selection_target_n(np.asarray(soap[pool]), has_label[pool], n_select,
+                                                  n_threads=n_threads, seeds=seeds)
+    selected = np.zeros(N, dtype=bool)
+    uniq_label_idx, uniq_unlabel_idx = pool[u_lbl].tolist(), pool[u_unlbl].tolist()
+    selected[uniq_label_idx + uniq_unlabel_idx] = True
+    test_label_idx = np.flatnonzero(has_label & ~selected).tolist()
+    test_unlabel_idx = np.flatnonzero(~has_label & ~selected).tolist()
     return uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx
 
 
-def run_deduplication(groups, cache_dir, nproc, mode, param):
+def hier_threshold_dedup(soap, has_label_list, simlT, n_clusters=None, seed=0, n_threads=1):
     """
+    两级贪婪去重：mini-batch k-means 粗分簇，簇内做精确的 cosine_threshold_dedup，
+    再对各簇保留的参考点 (train) 做一次跨簇去重；跨簇相似的参考点连同各自簇内的 test
+    合为一个相似组，按同样的组规则重新分配 (每组一个 train、至多一个 test)
+    n_clusters 默认为 sqrt(N)
+    """
+    N = soap.shape[0]
+    has_label = np.asarray(has_label_list, dtype=bool)
+    if N == 0:
+        return [], [], [], []
+    if n_clusters is None:
+        n_clusters = _auto_clusters(N)
+
+    executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+    _, labels = minibatch_kmeans(soap, n_clusters, seed=seed, executor=executor)
+
+    def dedup(members):
+        owner = np.empty(len(members), dtype=np.int64)
+        res = cosine_threshold_dedup(np.asarray(soap[members]), has_label[members], simlT,
+                                     owner=owner)
+        return [members[np.asarray(idx, dtype=np.int64)] for idx in res] + [members[owner]]
+
+    clusters = cluster_members(labels)
+    parts = list(executor.map(dedup, clusters) if executor is not None else map(dedup, clusters))
+    if executor is not None:
+        executor.shutdown()
+
+    # 簇内相似组：每行的参考点 -> 该组的 train
+    group_ref = np.empty(N, dtype=np.int64)
+    for members, p in zip(clusters, parts):
+        group_ref[members] = p[4]
+    reps = np.sort(np.concatenate([p[0] for p in parts] + [p[1] for p in parts]))
+    train_of = np.full(N, -1, dtype=np.int64)
+    train_of[group_ref[reps]] = reps
+    tests = np.concatenate([p[2] for p in parts] + [p[3] for p in parts]).astype(np.int64)
+
+    # 跨簇去重：每个 train 所属的跨簇相似组，簇内 test 跟随其 train
+    cross = np.empty(len(reps), dtype=np.int64)
+    cosine_threshold_dedup(np.asarray(soap[reps]), has_label[reps], simlT, n_threads=n_threads,
+                           owner=cross)
+    cross_of = np.empty(N, dtype=np.int64)
+    cross_of[reps] = reps[cross]
+    cross_of[tests] = cross_of[train_of[group_ref[tests]]]
+
+    # 每组内 train 在前 (同跨簇去重的顺序)，test 在后
+    rows = np.concatenate([reps, tests])
+    is_test = np.concatenate([np.zeros(len(reps), dtype=bool), np.ones(len(tests), dtype=bool)])
+    order = np.lexsort((rows, is_test, cross_of[rows]))
+    rows = rows[order]
+    starts = np.flatnonzero(np.diff(cross_of[rows], prepend=-1))
+
+    uniq_label_idx, uniq_unlabel_idx = [], []
+    test_label_idx, test_unlabel_idx = [], []
+    for similar_group in np.split(rows, starts[1:]):
+        _assign_group(similar_group, has_label, uniq_label_idx, uniq_unlabel_idx,
+                      test_label_idx, test_unlabel_idx)
+    return uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx
+
+
+def nearest_distances(X, selected, metric="euclidean", chunk_rows=4096):
+    """X 各行到已选行的最小距离 (欧氏距离，或 cosine 模式下的 1-cos)；没有已选行时为 inf"""
+    selected = np.asarray(selected, dtype=np.int64)
+    if len(selected) == 0:
+        return np.full(X.shape[0], np.inf)
+    if metric == "cosine":
+        X = NormalizedRows(X)
+    S = np.asarray(X[selected], dtype=np.float64)
+    s_sq = np.einsum("ij,ij->i", S, S)
+    out = np.empty(X.shape[0], dtype=np.float64)
+    for start in range(0, X.shape[0], chunk_rows):
+        B = np.asarray(X[start:start + chunk_rows], dtype=np.float64)
+        dot = B @ S.T
+        if metric == "cosine":
+            d = 1.0 - dot.max(axis=1)
+        else:
+            d = np.einsum("ij,ij->i", B, B) + (s_sq - 2.0 * dot).min(axis=1)
+            d = np.sqrt(np.maximum(d, 0.0))
+        out[start:start + chunk_rows] = d
+    return out
+
+
+def coverage_radius(X, selected, metric="euclidean", chunk_rows=4096):
+    """覆盖半径：X 各行到已选行的最小距离的最大值 (欧氏距离，或 cosine 模式下的 1-cos)"""
+    if len(selected) == 0:
+        return float("inf")
+    return float(nearest_distances(X, selected, metric, chunk_rows).max(initial=0.0))
+
+
+def hier_coverage(soap, has_label_list, mode, param, hier_opts, n_sample, seed=0):
+    """
+    抽样比较两级筛选与精确筛选的覆盖半径：在 n_sample 行的随机样本上分别运行两者
+    (FPS 的选取数量按样本比例缩小)，返回 {sample, exact, hier}
+    覆盖半径为样本各行到 train (有标签 + 无标签) 的最小距离的最大值，越小覆盖越好
+    """
+    N = soap.shape[0]
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(N, min(n_sample, N), replace=False))
+    X = np.asarray(soap[rows], dtype=np.float32)
+    has_label = np.asarray(has_label_list, dtype=bool)[rows]
+    n_clusters = hier_opts.get("n_clusters")
+    if n_clusters is not None:
+        n_clusters = max(1, int(round(n_clusters * len(rows) / N)))
+
+    if mode == 'fps':
+        n = max(1, int(round(param * len(rows) / N)))
+        exact = fps_selection_target_n(X, has_label, n)
+        hier = hier_fps_selection(X, has_label, n, n_clusters=n_clusters,
+                                  oversample=hier_opts.get("oversample", 4.0), seed=seed)
+        metric = "euclidean"
+    else:
+        exact = cosine_threshold_dedup(X, has_label, param)
+        hier = hier_threshold_dedup(X, has_label, param, n_clusters=n_clusters, seed=seed)
+        metric = "cosine"
+    return {"sample": len(rows),
+            "exact": coverage_radius(X, exact[0] + exact[1], metric),
+            "hier": coverage_radius(X, hier[0] + hier[1], metric)}
+
+
+def estimate_cost(n_rows, n_dim, mode, param, backend="exact", hier_opts=None):
+    """粗略估计一个组的筛选开销 (浮点运算量量级)，只用于排序和判断大组"""
+    if hier_opts is not None and n_rows >= hier_opts.get("min_rows", 0):
+        # 分簇 (K 次扫描) 与簇内筛选相当
+        k = hier_opts.get("n_clusters") or _auto_clusters(
+            hier_opts.get("oversample", 4.0) * param if mode == 'fps' else n_rows)
+        return n_rows * n_dim * 2 * k
+    if mode == 'fps':
+        return n_rows * n_dim * max(1, param)
+    if backend == 'lsh':
+        return n_rows * n_dim * 64
+    return n_rows * n_rows * n_dim
+
+
+def allocate_fps(groups, num):
+    """
+    FPS 模式的数量分配：按各组结构数的比例把总数 num 分给各组 (最大余数法，不超过组大小)，
+    结果写入 groups[key]["n_select"] 并返回 {key: n_select}
+    """
+    valid_total_structures = sum(len(g["indices"]) for g in groups.values())
+    target_total = min(num, valid_total_structures)
+    
+    print(f"[FPS] Distributing {target_total} samples from {valid_total_structures} structures...")
+    
+    allocations = {}
+    remainders = []
+    current_sum = 0
+    
+    for key in groups:
+        n_this_group = len(groups[key]["indices"])
+        if valid_total_structures > 0:
+            raw_share = target_total * (n_this_group / valid_total_structures)
+        else:
+            raw_share = 0
+        base_alloc = int(raw_share)
+        allocations[key] = base_alloc
+        current_sum += base_alloc
+        
+        if base_alloc < n_this_group:
+            remainders.append((raw_share - base_alloc, key))
+        else:
+            remainders.append((-1.0, key)) # 已满
+
+    deficit = target_total - current_sum
+    remainders.sort(key=lambda x: x[0], reverse=True)
+    
+    for i in range(deficit):
+        if i >= len(remainders): break
+        key_to_add = remainders[i][1]
+        if allocations[key_to_add] < len(groups[key_to_add]["indices"]):
+            allocations[key_to_add] += 1
+
+    for key in groups:
+        groups[key]["n_select"] = allocations[key]
+        print(f"  - Group {key:<10}: Select {allocations[key]}")
+    return allocations
+
+
+def group_task(groups, k, cache_dir, tag, mode, param, backend="exact", backend_opts=None,
+               store=None, profile=None, seeds=None, hier_opts=None, checkpoint_opts=None,
+               n_threads=1, arrays=None):
+    """单个组的筛选任务 (_worker 的参数) 及其估计开销，参数同 run_deduplication"""
+    # FPS 模式从 groups 字典中获取分配好的数量，threshold 模式直接使用传入的阈值 simlT
+    p_val = groups[k].get("n_select", 0) if mode == 'fps' else param
+    n_rows, n_dim = _load_group(k, cache_dir, tag, store, arrays)[0].shape
+    seed_info = (seeds or {}).get(k)
+    cost = estimate_cost(n_rows, n_dim, mode, p_val, backend, hier_opts)
+    if seed_info is not None:
+        # 种子与组内各行的一次分块相似度/距离计算
+        cost += float(n_rows) * len(seed_info[0]) * n_dim
+    return (k, cache_dir, tag, store, mode, p_val, backend, backend_opts or {},
+            seed_info, hier_opts, checkpoint_opts, profile, n_threads), cost
+
+
+def run_deduplication(groups, cache_dir, tag, nproc, mode, param, backend="exact", backend_opts=None,
+                      store=None, group_stats=None, profile=None, seeds=None, hier_opts=None,
+                      checkpoint_opts=None, pool=None, submitted=None, arrays=None):
+    """
+    tag: 缓存参数摘要 (见 soap_param_hash)
+    store: 合并存储文件 (见 store.pack_store)，给出时直接在其中的 (量化) 描述符上筛选
+    group_stats: 不为 None 时写入每个组的耗时、CPU、峰值内存与各类选中数量
+    profile: cProfile 输出文件，各组 (含进程池中的) 的筛选过程合并写入
+    seeds: {key: (缓存行号, 标签)}，已有训练集作为固定种子 (见 seeds.load_seeds)；
+           有种子的组在 threshold 模式下总是使用精确后端
+    hier_opts: 两级筛选参数 {min_rows, n_clusters, oversample, seed, coverage_sample}，
+           行数不小于 min_rows 的组先粗分簇再筛选 (见 hier_fps_selection / hier_threshold_dedup)
+    checkpoint_opts: {every, resume}，精确 FPS / Threshold 每 every 秒保存一次各组的进度，
+           resume 为 True 时从已有的检查点继续 (见 checkpoint.Checkpoint)
     mode: 'fps' or 'threshold'
     param: n_select (if fps) OR simlT (if threshold)
     注意：如果 mode='fps'，param 应该是一个字典 {key: n_select} 或者在 groups 里面读取
+    backend: threshold 模式的近邻后端 'exact' (分块精确计算) 或 'lsh' (随机投影近似)
+    backend_opts: lsh 参数 {n_tables, n_bits, seed, recall_sample, min_recall, min_rows}
+
+    pool: 已有的进程池 (worker 须调用过 _init_worker)，不给出时临时创建；
+          nproc == 1 且不给出时全部组在主进程中依次计算，不创建进程池
+    arrays: {(组名, tag): 缓存 mmap}，主进程中计算的组从中取已打开的缓存并存入新打开的
+            (进程内 API 跨调用复用，见 api.Selector)
+    submitted: {key: AsyncResult}，已提交到 pool 的组 (见 pipeline.run_pipeline)，在此只收集结果
+
+    调度：按估计开销从大到小排序，每个组只计算一次；
+    开销超过总量 1/nproc 的大组在主进程中用 nproc 个线程分块计算，其余组交给进程池：
+    小组先全部异步提交，大组计算期间进程池中的 worker 同时处理小组
     """
-    tasks = []
+    submitted = submitted or {}
+    tasks, costs = [], {}
     for k in groups.keys():
-        if mode == 'fps':
-            # 从 groups 字典中获取分配好的数量
-            p_val = groups[k].get("n_select", 0)
-        else:
-            # 直接使用传入的阈值 simlT
-            p_val = param
-            
-        tasks.append((k, cache_dir, mode, p_val))
-        
+        task, costs[k] = group_task(groups, k, cache_dir, tag, mode, param, backend, backend_opts,
+                                    store, profile, seeds, hier_opts, checkpoint_opts,
+                                    arrays=arrays)
+        if k not in submitted:
+            tasks.append(task)
+
+    tasks.sort(key=lambda task: costs[task[0]], reverse=True)
+    total_cost = sum(costs.values())
+    large = [task for task in tasks if nproc > 1 and costs[task[0]] * nproc > total_cost]
+    small = [task for task in tasks if task not in large]
+
     uniq_label_all, uniq_unlabel_all = [], []
     test_label_all, test_unlabel_all = [], []
+    recall_stats, coverage_stats, wall_times, profile_parts = {}, {}, {}, []
+    threaded = {task[0] for task in large}
 
     desc_str = "FPS Selection" if mode == "fps" else "Cosine Dedup"
 
-    with Pool(nproc) as pool:
-        for _, u_lbl, u_unlbl, t_lbl, t_unlbl in tqdm(
-            pool.imap_unordered(_worker, tasks), total=len(tasks), desc=desc_str):
-            
-            # _worker 返回的是局部索引，需要 groups 里的 indices 映射回全局
-            # 这里 _worker 返回的 key (symbols_str) 用来查找 groups
-            # 但 _worker 的返回值里第一项是 symbols_str
-            pass 
-            
-            # 修正：imap_unordered 返回结果，我们需要在下面处理
-            # 为了方便，我们在 worker 里不返回 indices 内容，只返回 index 列表
-            # 这里逻辑有点绕，直接在 worker 返回 global indices 比较难，
-            # 还是保持原来的逻辑：worker 返回局部 index，这里映射。
-            
-            # 这里的 _ 占位符实际上是 worker 返回的 symbols_str
-            # 我们需要捕获它
-        pass
-
-    # 由于 imap_unordered 的写法，重写一下循环
-    with Pool(nproc) as pool:
-        for res in tqdm(pool.imap_unordered(_worker, tasks), total=len(tasks), desc=desc_str):
-            symbols_str, u_lbl, u_unlbl, t_lbl, t_unlbl = res
-            
-            indices = np.array(groups[symbols_str]["indices"])
-            
-            uniq_label_all.extend(indices[u_lbl].tolist())
-            uniq_unlabel_all.extend(indices[u_unlbl].tolist())
-            test_label_all.extend(indices[t_lbl].tolist())
-            test_unlabel_all.extend(indices[t_unlbl].tolist())
+    def collect(res):
+        symbols_str, u_lbl, u_unlbl, t_lbl, t_unlbl, stats = res
+        indices = np.array(groups[symbols_str]["indices"])
 
-    return uniq_label_all, uniq_unlabel_all, test_label_all, test_unlabel_all
+        uniq_label_all.extend(indices[u_lbl].tolist())
+        uniq_unlabel_all.extend(indices[u_unlbl].tolist())
+        test_label_all.extend(indices[t_lbl].tolist())
+        test_unlabel_all.extend(indices[t_unlbl].tolist())
+        wall_times[symbols_str] = stats["wall_s"]
+        if "recall" in stats:
+            recall_stats[symbols_str] = stats
+        if "coverage" in stats:
+            coverage_stats[symbols_str] = stats["coverage"]
+        if "profile_part" in stats:
+            profile_parts.append(stats.pop("profile_part"))
+        if group_stats is not None:
+            group_stats[symbols_str] = dict(stats, n_rows=len(indices),
+                                            threaded=symbols_str in threaded,
+                                            train_labeled=len(u_lbl), train_unlabeled=len(u_unlbl),
+                                            test_labeled=len(t_lbl), test_unlabeled=len(t_unlbl))
 
-def _worker(args):
-    symbols_str, cache_dir, mode, param = args
-    soap, idx_map, has_label = load_cache_with_label(symbols_str, cache_dir)
-    
-    if mode == 'fps':
-        # param is n_select
-        uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
-            fps_selection_target_n(soap, has_label, param)
+    in_process = pool is None and nproc == 1
+    if small and pool is None and not in_process:
+        pool_ctx = Pool(min(nproc, len(small)), initializer=_init_worker)
     else:
-        # param is simlT
-        uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
-            cosine_threshold_dedup(soap, has_label, param)
-            
-    return symbols_str, uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx
+        pool_ctx = contextlib.nullcontext(pool)
+    with tqdm(total=len(tasks) + len(submitted), desc=desc_str) as pbar, pool_ctx as pool:
+        if in_process:
+            small_results = (_worker(task, arrays) for task in small)
+        else:
+            # 小组：先全部提交到进程池，大的在前 (chunksize=1 使空闲进程随时领取下一个)
+            small_results = pool.imap_unordered(_worker, small, chunksize=1) if small else ()
+        # 大组：主进程内多线程，逐个执行，同时进程池处理小组
+        for task in large:
+            collect(_worker(task[:-1] + (nproc,), arrays))
+            pbar.update()
+        # 已在进程池中运行的组 (流水线提交) 与小组的结果
+        for res in submitted.values():
+            collect(res.get())
+            pbar.update()
+        for res in small_results:
+            collect(res)
+            pbar.update()
+
+    if recall_stats:
+        n_exact = sum(s["n_exact"] for s in recall_stats.values())
+        n_found = sum(s["recall"] * s["n_exact"] for s in recall_stats.values())
+        print(f"[LSH] Sampled recall vs exact: {n_found / n_exact if n_exact else 1.0:.4f} "
+              f"({n_exact} exact neighbour pairs)")
+        for k, s in sorted(recall_stats.items()):
+            note = ", fell back to exact" if s.get("fallback") else ""
+            print(f"  - Group {k:<10}: recall {s['recall']:.4f} ({s['n_exact']} pairs, "
+                  f"{s['n_tables']} tables x {s['n_bits']} bits{note})")
+        fallback = sorted(k for k, s in recall_stats.items() if s.get("fallback"))
+        if fallback:
+            print(f"[WARN] Sampled LSH recall below the minimum in {len(fallback)} groups "
+                  f"({', '.join(fallback)}); the exact backend was used for them")
+
+    if coverage_stats:
+        metric = "Euclidean" if mode == 'fps' else "1-cos"
+        print(f"[HIER] Coverage radius ({metric}) on a sample, exact vs two-stage:")
+        for k, c in sorted(coverage_stats.items()):
+            ratio = c["hier"] / c["exact"] if c["exact"] > 0 else float("inf")
+            print(f"  - Group {k:<10}: exact {c['exact']:.4g}, two-stage {c['hier']:.4g} "
+                  f"(x{ratio:.2f}, {c['sample']} rows)")
+
+    report_wall_times(wall_times, groups, threaded=threaded)
+    if profile is not None:
+        merge_profiles(profile, profile_parts)
+
+    return uniq_label_all, uniq_unlabel_all, test_label_all, test_unlabel_all
+
+
+def report_wall_times(wall_times, groups, threaded=(), top=20):
+    """按耗时从大到小打印各组的筛选时间"""
+    print(f"[TIME] Selection wall time per group (total {sum(wall_times.values()):.2f} s):")
+    ranked = sorted(wall_times.items(), key=lambda kv: kv[1], reverse=True)
+    for k, sec in ranked[:top]:
+        tag = " (threaded)" if k in threaded else ""
+        print(f"  - Group {k:<10}: {len(groups[k]['indices']):>8} frames, {sec:8.2f} s{tag}")
+    if len(ranked) > top:
+        rest = sum(sec for _, sec in ranked[top:])
+        print(f"  - ... {len(ranked) - top} more groups, {rest:.2f} s")
+
+
+def merge_profiles(path, parts):
+    """把各组的 cProfile 结果合并为一个文件 (可用 python -m pstats 查看)，并删除分片"""
+    if not parts:
+        return
+    stats = pstats.Stats(parts[0])
+    for part in parts[1:]:
+        stats.add(part)
+    stats.dump_stats(path)
+    for part in parts:
+        os.remove(part)
+    print(f"[PROFILE] Selection profile written to {path}")
+
+
+# 当前进程是否为筛选进程池的 worker
+_POOL_WORKER = {"active": False}
+
+
+def _init_worker():
+    # 进程池内每个进程单线程 BLAS，避免 nproc x BLAS 线程的超额订阅
+    limit_blas_threads(1)
+    _POOL_WORKER["active"] = True
+
+
+def _worker(args, arrays=None):
+    """单个组的筛选；arrays 只在主进程内调用时给出 (见 run_deduplication)"""
+    (symbols_str, cache_dir, tag, store, mode, param, backend, backend_opts, seed_info, hier_opts,
+     checkpoint_opts, profile, n_threads) = args
+    stats = {}
+    profiler = cProfile.Profile() if profile else None
+
+    # 进程池中的组单独统计峰值内存；主进程内计算的组不重置，避免打断外层阶段的统计
+    with measure(stats, reset_peak=_POOL_WORKER["active"]), \
+            profiler if profiler is not None else contextlib.nullcontext(), \
+            limit_blas_threads(1) if n_threads > 1 else contextlib.nullcontext():
+        soap, idx_map, has_label = _load_group(symbols_str, cache_dir, tag, store, arrays)
+        seeds = seed_labels = None
+        if seed_info is not None:
+            seeds = load_cache_rows(symbols_str, cache_dir, tag, seed_info[0], arrays)
+            seed_labels = seed_info[1]
+        # 两级筛选；threshold 模式下有种子的组仍用精确计算
+        hier = (hier_opts is not None and soap.shape[0] >= hier_opts.get("min_rows", 0)
+                and (mode == 'fps' or seeds is None))
+        opts = {k: v for k, v in (hier_opts or {}).items() if k in ("n_clusters", "seed")}
+        checkpoint = None
+        if checkpoint_opts is not None:
+            checkpoint = Checkpoint(
+                checkpoint_path(cache_dir, tag, mode, symbols_str),
+                fingerprint(store, mode, param, idx_map, has_label,
+                            *(seed_info if seed_info is not None else (None, None))),
+                every=checkpoint_opts.get("every", 600.0),
+                resume=checkpoint_opts.get("resume", False))
+        if mode == 'fps' and hier:
+            uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
+                hier_fps_selection(soap, has_label, param, n_threads=n_threads, seeds=seeds,
+                                   oversample=hier_opts.get("oversample", 4.0), **opts)
+        elif mode == 'fps':
+            # param is n_select
+            uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
+                fps_selection_target_n(soap, has_label, param, n_threads=n_threads, seeds=seeds,
+                                       checkpoint=checkpoint)
+        elif hier:
+            uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
+                hier_threshold_dedup(soap, has_label, param, n_threads=n_threads, **opts)
+        elif backend == 'lsh' and seeds is None and soap.shape[0] >= backend_opts.get("min_rows", 0):
+            # param is simlT；小组直接走精确计算
+            lsh_opts = {k: v for k, v in backend_opts.items() if k != "min_rows"}
+            uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
+                lsh_threshold_dedup(soap, has_label, param, stats=stats, n_threads=n_threads,
+                                    **lsh_opts)
+        else:
+            # param is simlT
+            uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx = \
+                cosine_threshold_dedup(soap, has_label, param, n_threads=n_threads,
+                                       seeds=seeds, seed_labels=seed_labels, checkpoint=checkpoint)
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    # 覆盖半径的抽样对比不计入本组的筛选时间
+    if hier and hier_opts.get("coverage_sample", 0) > 0:
+        stats["coverage"] = hier_coverage(soap, has_label, mode, param, hier_opts,
+                                          hier_opts["coverage_sample"], seed=hier_opts.get("seed", 0))
+
+    if profiler is not None:
+        stats["profile_part"] = f"{profile}.{os.getpid()}.{symbols_str}"
+        profiler.dump_stats(stats["profile_part"])
+    return symbols_str, uniq_label_idx, uniq_unlabel_idx, test_label_idx, test_unlabel_idx, stats
@@ -0,0 +1,72 @@
+import numpy as np
+from .utils import get_Kpts_batch
+
+# =========================================================
+# 预过滤：一次性把 cell / 能量 / 力 / 组成提取为数组，再批量过滤
+# =========================================================
+# k 点密度上限、每原子能量范围 (eV/atom) 与最大原子力 (eV/A)
+DEFAULT_FILTERS = {"max_kpts": 100, "e_min": -10.0, "e_max": -1.0, "f_max": 10.0}
+
+
+def composition_key(numbers):
+    """按元素计数的组成 key (元素按符号排序，计数为 1 时省略)，如 'C2H4O'"""
+    from ase.data import chemical_symbols
+    z, counts = np.unique(numbers, return_counts=True)
+    items = sorted((chemical_symbols[a], int(c)) for a, c in zip(z, counts))
+    return "".join(f"{s}{c}" if c > 1 else s for s, c in items)
+
+
+def frame_features(atoms_list):
+    """
+    逐帧提取过滤所需的信息：cell (N, 3, 3)、每原子能量与最大力 (无标签为 nan)、组成 key
+    能量和力直接取自计算器结果 (ASE 读入的 SinglePointCalculator)，不会触发计算
+    """
+    n = len(atoms_list)
+    cells = np.empty((n, 3, 3), dtype=np.float64)
+    energy = np.full(n, np.nan)
+    max_force = np.full(n, np.nan)
+    keys = []
+    for i, atoms in enumerate(atoms_list):
+        cells[i] = atoms.cell.array
+        keys.append(composition_key(atoms.numbers))
+        results = atoms.calc.results if atoms.calc is not None else {}
+        if results.get("energy") is not None and results.get("forces") is not None and len(atoms):
+            energy[i] = results["energy"] / len(atoms)
+            max_force[i] = np.sqrt(np.einsum("ij,ij->i", results["forces"], results["forces"]).max())
+    return {"cell": cells, "energy_per_atom": energy, "max_force": max_force, "key": keys}
+
+
+def merge_features(features_list):
+    """按顺序拼接多个文件的 frame_features 结果"""
+    return {
+        "cell": np.concatenate([f["cell"] for f in features_list]).reshape(-1, 3, 3),
+        "energy_per_atom": np.concatenate([f["energy_per_atom"] for f in features_list]),
+        "max_force": np.concatenate([f["max_force"] for f in features_list]),
+        "key": [k for f in features_list for k in f["key"]],
+    }
+
+
+def prefilter(features, filter_opts=None):
+    """
+    批量应用 k 点与标签有效性过滤
+    有能量和力的结构视为有标签，超出能量/力范围的有标签结构被丢弃
+    返回 (keep, has_label, counts)，counts 为各原因丢弃的数量
+    """
+    opts = {**DEFAULT_FILTERS, **(filter_opts or {})}
+    energy, max_force = features["energy_per_atom"], features["max_force"]
+    has_label = ~np.isnan(energy)
+
+    bad_kpts = get_Kpts_batch(features["cell"]) > opts["max_kpts"]
+    with np.errstate(invalid="ignore"):
+        valid = (opts["e_min"] <= energy) & (energy <= opts["e_max"]) & (max_force <= opts["f_max"])
+    bad_label = has_label & ~valid & ~bad_kpts
+    keep = ~bad_kpts & ~bad_label
+
+    counts = {"total": len(keep), "kept": int(keep.sum()),
+              "kpts": int(bad_kpts.sum()), "label_range": int(bad_label.sum())}
+    return keep, has_label, counts
+
+
+def report_filter(counts):
+    print(f"[FILTER] Kept {counts['kept']} of {counts['total']} structures "
+          f"(k-points > limit: {counts['kpts']}, labels out of range: {counts['label_range']})")
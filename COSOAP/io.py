@@ -1,23 +1,36 @@
 import os
+import io
+import mmap
+import numpy as np
+from collections import deque
 from multiprocessing import Pool
 from functools import partial
 from tqdm import tqdm
-from ase.io import read, write
+from .utils import file_signature
+from .filters import frame_features, merge_features
+
+TEXT_FORMATS = ('.xyz', '.extxyz')
+# ase 在用到时才导入：缓存命中的重跑只做字节复制，不需要解析结构
 
 def read_single_file(filename):
+    from ase.io import read
     try:
         return read(filename, index=":", parallel=False)
     except Exception as e:
         print(f"[ERROR] Reading {filename}: {e}")
         return []
 
-def read_input(input_path, nproc):
+def read_single_file_with_features(filename):
+    """读取单个文件并在 worker 内提取预过滤特征 (见 filters.frame_features)"""
+    atoms = read_single_file(filename)
+    return atoms, frame_features(atoms)
+
+def list_input_files(input_path):
+    """单个文件或文件夹下所有 .xyz/.extxyz/.traj 文件 (排序后)"""
     input_path = input_path.strip()
     if os.path.isfile(input_path):
-        print(f"[IO] Reading single file: {input_path}")
-        return read(input_path, ":")
+        return [input_path]
     elif os.path.isdir(input_path):
-        print(f"[IO] Reading folder: {input_path}")
         xyz_files = []
         for root, _, files in os.walk(input_path):
             for f in files:
@@ -26,21 +39,244 @@ def read_input(input_path, nproc):
         if not xyz_files:
             raise ValueError("No .xyz files found in folder")
         xyz_files.sort()
+        return xyz_files
+    else:
+        raise ValueError(f"Input path not found: {input_path}")
+
+def read_input(input_path, nproc, with_features=False):
+    """
+    读取输入；with_features=True 时同时返回预过滤特征 (atoms, features)，
+    文件夹输入时特征在各读取进程中按文件并行提取
+    """
+    from ase.io import read
+    input_path = input_path.strip()
+    if os.path.isfile(input_path):
+        print(f"[IO] Reading single file: {input_path}")
+        atoms = read(input_path, ":")
+        return (atoms, frame_features(atoms)) if with_features else atoms
+    else:
+        xyz_files = list_input_files(input_path)
+        print(f"[IO] Reading folder: {input_path}")
         print(f"[IO] Found {len(xyz_files)} files, reading with {nproc} processes...")
+        reader = read_single_file_with_features if with_features else read_single_file
         with Pool(nproc) as pool:
-            results = list(tqdm(pool.imap_unordered(read_single_file, xyz_files),
+            # 保持文件顺序，使全局序号与帧偏移索引一一对应
+            results = list(tqdm(pool.imap(reader, xyz_files),
                                 total=len(xyz_files), desc="Reading files"))
-        atoms = [a for sub in results for a in sub]
+        if with_features:
+            atoms = [a for sub, _ in results for a in sub]
+            features = merge_features([f for _, f in results])
+        else:
+            atoms = [a for sub in results for a in sub]
         print(f"[IO] Total structures loaded: {len(atoms)}")
-        return atoms
+        return (atoms, features) if with_features else atoms
+
+def scan_frame_offsets(filename, block_size=1 << 26):
+    """
+    单次扫描 xyz/extxyz 文件，返回每帧的 (字节偏移, 字节长度)，形状 (n, 2) 的 int64
+    用 numpy 在大块数据中查找换行符，每帧只需 O(1) 的 Python 操作
+    """
+    size = os.path.getsize(filename)
+    frames = []
+    if size == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        newlines = np.empty(0, dtype=np.int64)   # 尚未消费的换行符位置
+        pos, scanned = 0, 0                      # 下一帧起点 / 已扫描到的位置
+        while True:
+            if scanned < size:
+                end = min(scanned + block_size, size)
+                found = np.flatnonzero(np.frombuffer(mm, np.uint8, end - scanned, scanned) == 10)
+                newlines = np.concatenate([newlines, found + scanned])
+                scanned = end
+                if scanned == size and mm[size - 1] != 10:
+                    newlines = np.append(newlines, size)   # 末行没有换行符
+            k = 0
+            while k < len(newlines):
+                line = mm[pos:newlines[k]]
+                if not line.strip():
+                    pos = int(newlines[k]) + 1
+                    k += 1
+                    continue
+                n_lines = int(line) + 2
+                if k + n_lines > len(newlines):
+                    break
+                frame_end = min(int(newlines[k + n_lines - 1]) + 1, size)
+                frames.append((pos, frame_end - pos))
+                pos = frame_end
+                k += n_lines
+            newlines = newlines[k:]
+            if scanned == size:
+                if len(newlines):
+                    raise ValueError(f"Truncated frame at byte {pos} in {filename}")
+                break
+    return np.array(frames, dtype=np.int64).reshape(-1, 2)
+
+def frame_index(filename, cache_dir="soap_cache", stats=None):
+    """
+    帧偏移索引，按 (路径, 大小, 修改时间) 缓存在 {cache_dir}/frames/ 下
+    非文本格式 (如 .traj) 返回 (帧号, -1)；stats 不为 None 时累计缓存命中/未命中数
+    """
+    index_file = f"{cache_dir}/frames/FRAMES_{file_signature(filename)}.npy"
+    hit = os.path.exists(index_file)
+    if stats is not None:
+        stats["hits" if hit else "misses"] = stats.get("hits" if hit else "misses", 0) + 1
+    if hit:
+        return np.load(index_file)
+    if filename.lower().endswith(TEXT_FORMATS):
+        index = scan_frame_offsets(filename)
     else:
-        raise ValueError(f"Input path not found: {input_path}")
+        from ase.io.trajectory import Trajectory
+        with Trajectory(filename) as traj:
+            n_frames = len(traj)
+        index = np.stack([np.arange(n_frames), np.full(n_frames, -1)], axis=1).astype(np.int64)
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    np.save(index_file, index)
+    return index
+
+def frame_records(files, cache_dir="soap_cache", stats=None):
+    """所有输入文件按顺序拼接后的逐帧记录 {file, offset, length}"""
+    indexes = [frame_index(f, cache_dir, stats) for f in tqdm(files, desc="Indexing frames")]
+    return {
+        "file": np.concatenate([np.full(len(ix), i, dtype=np.int32) for i, ix in enumerate(indexes)]),
+        "offset": np.concatenate([ix[:, 0] for ix in indexes]),
+        "length": np.concatenate([ix[:, 1] for ix in indexes]),
+    }
+
+def iter_frames(filename, cache_dir="soap_cache"):
+    """
+    逐帧读取单个文件，产出 (offset, length, atoms)
+    xyz/extxyz 按帧偏移索引切帧，offset/length 为该帧在文件中的字节范围；
+    其他格式 (如 .traj) offset 为帧号，length 为 -1
+    """
+    from ase.io import read, iread
+    if filename.lower().endswith(TEXT_FORMATS):
+        index = frame_index(filename, cache_dir)
+        with open(filename, "rb", buffering=1 << 20) as f:
+            for offset, length in index:
+                f.seek(offset)
+                atoms = read(io.StringIO(f.read(length).decode()), format="extxyz")
+                yield int(offset), int(length), atoms
+    else:
+        for i, atoms in enumerate(iread(filename)):
+            yield i, -1, atoms
+
+def iter_input_frames(files, cache_dir="soap_cache"):
+    """依次流式读取所有输入文件，产出 (file_id, offset, length, atoms)"""
+    for file_id, filename in enumerate(files):
+        try:
+            for offset, length, atoms in iter_frames(filename, cache_dir):
+                yield file_id, offset, length, atoms
+        except Exception as e:
+            print(f"[ERROR] Reading {filename}: {e}")
+
+def _parse_frames(args):
+    """解析同一文件中一段连续的帧 (一次读取整段字节)，返回 Atoms 列表"""
+    from ase.io import read
+    filename, index = args
+    start = int(index[0, 0])
+    with open(filename, "rb") as f:
+        f.seek(start)
+        blob = f.read(int(index[-1, 0] + index[-1, 1]) - start)
+    return [read(io.StringIO(blob[o - start:o - start + n].decode()), format="extxyz")
+            for o, n in index.tolist()]
+
+def iter_input_frames_parallel(files, pool, cache_dir="soap_cache", chunk_frames=256,
+                               max_pending=8):
+    """
+    同 iter_input_frames，但文本格式的帧按 chunk_frames 一段交给进程池解析，按原顺序产出
+    同时在途的段不超过 max_pending (读取领先消费的量有上限)；非文本格式在主进程中逐帧读取
+    """
+    for file_id, filename in enumerate(files):
+        try:
+            if not filename.lower().endswith(TEXT_FORMATS):
+                for offset, length, atoms in iter_frames(filename, cache_dir):
+                    yield file_id, offset, length, atoms
+                continue
+            index = frame_index(filename, cache_dir)
+            chunks = [index[i:i + chunk_frames] for i in range(0, len(index), chunk_frames)]
+            pending = deque()
+            for n_done in range(len(chunks)):
+                while len(pending) < max_pending and n_done + len(pending) < len(chunks):
+                    chunk = chunks[n_done + len(pending)]
+                    pending.append((chunk, pool.apply_async(_parse_frames, ((filename, chunk),))))
+                chunk, res = pending.popleft()
+                for (offset, length), atoms in zip(chunk.tolist(), res.get()):
+                    yield file_id, offset, length, atoms
+        except Exception as e:
+            print(f"[ERROR] Reading {filename}: {e}")
+
+def copy_frames(files, records, idx_list, out_path, atoms_all=None,
+                window_bytes=1 << 26, max_gap=1 << 20):
+    """
+    按记录把选中的帧从源文件原样复制到 out_path，保持 idx_list 的顺序
+    每个窗口 (约 window_bytes) 内按源文件位置排序，相邻或间隔小于 max_gap 的帧合并为一次大块读取
+    非文本格式的帧 (length < 0) 经 ASE 转写，优先使用内存中的 atoms_all
+    """
+    idx_list = np.asarray(idx_list, dtype=np.int64)
+    file_all = np.asarray(records["file"])[idx_list]
+    offset_all = np.asarray(records["offset"])[idx_list]
+    len_all = np.asarray(records["length"])[idx_list]
+    # 按累计字节数切窗口
+    bounds = np.searchsorted(np.cumsum(np.maximum(len_all, 0)),
+                             np.arange(window_bytes, max(1, len_all.sum()) + window_bytes, window_bytes),
+                             side="right")
+    bounds = np.unique(np.concatenate([[0], bounds, [len(idx_list)]]).clip(0, len(idx_list)))
+
+    handles = {}
+    with open(out_path, "wb") as out:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            window = idx_list[start:stop]
+            file_ids, offsets, lens = file_all[start:stop], offset_all[start:stop], len_all[start:stop]
+
+            text = {}
+            order = [j for j in np.lexsort((offsets, file_ids)) if lens[j] >= 0]
+            k = 0
+            while k < len(order):
+                # 合并同一文件中相邻的帧
+                fid, run_start = file_ids[order[k]], offsets[order[k]]
+                run_end, m = run_start + lens[order[k]], k + 1
+                while (m < len(order) and file_ids[order[m]] == fid
+                       and offsets[order[m]] - run_end <= max_gap):
+                    run_end = max(run_end, offsets[order[m]] + lens[order[m]])
+                    m += 1
+                if fid not in handles:
+                    handles[fid] = open(files[fid], "rb")
+                handles[fid].seek(run_start)
+                blob = handles[fid].read(run_end - run_start)
+                for j in order[k:m]:
+                    text[j] = blob[offsets[j] - run_start:offsets[j] - run_start + lens[j]]
+                k = m
+
+            for j, i in enumerate(window):
+                if lens[j] >= 0:
+                    out.write(text[j])
+                    if not text[j].endswith(b"\n"):   # 源文件末帧可能没有换行符
+                        out.write(b"\n")
+                else:
+                    from ase.io import read, write
+                    atoms = atoms_all[i] if atoms_all is not None \
+                        else read(files[file_ids[j]], index=int(offsets[j]))
+                    buf = io.StringIO()
+                    write(buf, atoms, format="extxyz")
+                    out.write(buf.getvalue().encode())
+    for fh in handles.values():
+        fh.close()
 
-def write_outputs(atoms_all, train_label_idx, train_unlabel_idx, test_label_idx, test_unlabel_idx):
-    write("train_labeled.xyz", [atoms_all[i] for i in train_label_idx])
-    write("train_unlabeled.xyz", [atoms_all[i] for i in train_unlabel_idx])
-    write("test_labeled.xyz", [atoms_all[i] for i in test_label_idx])
-    write("test_unlabeled.xyz", [atoms_all[i] for i in test_unlabel_idx])
+def write_outputs(atoms_all, train_label_idx, train_unlabel_idx, test_label_idx, test_unlabel_idx,
+                  files=None, records=None):
+    """
+    写出四个结果文件；给出 files/records 时直接从源文件复制原始文本 (保留原格式与 info 字段)，
+    否则经 ASE 重新写出 atoms_all
+    """
+    outputs = [("train_labeled.xyz", train_label_idx), ("train_unlabeled.xyz", train_unlabel_idx),
+               ("test_labeled.xyz", test_label_idx), ("test_unlabeled.xyz", test_unlabel_idx)]
+    for out_path, idx_list in outputs:
+        if records is not None:
+            copy_frames(files, records, idx_list, out_path, atoms_all)
+        else:
+            from ase.io import write
+            write(out_path, [atoms_all[i] for i in idx_list])
     print(f"[OUTPUT] train_labeled.xyz: {len(train_label_idx)}, "
             f"train_unlabeled.xyz: {len(train_unlabel_idx)}, "
             f"test_labeled.xyz: {len(test_label_idx)}, "
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+# =========================================================
+# 随机投影 LSH (SimHash)：只在同桶候选中做 Cosine 比较
+# =========================================================
+TARGET_RECALL = 0.95
+MAX_TABLES = 32
+
+
+def bit_collision_prob(simlT):
+    """阈值处的一对向量 (1-cos = simlT) 在一个过原点随机超平面同侧的概率 1 - theta/pi"""
+    theta = np.arccos(np.clip(1.0 - simlT, -1.0, 1.0))
+    return 1.0 - theta / np.pi
+
+
+def tables_needed(p, n_bits, target_recall=TARGET_RECALL):
+    """每位碰撞概率 p、每表 n_bits 位时，使 1 - (1 - p^n_bits)^L >= target_recall 的最小表数 L"""
+    hit = p ** n_bits
+    if hit >= 1.0:
+        return 1
+    if hit <= 0.0:
+        return np.iinfo(np.int64).max
+    return max(1, int(np.ceil(np.log(1.0 - target_recall) / np.log1p(-hit))))
+
+
+def lsh_params(simlT, n_tables=None, n_bits=None, target_recall=TARGET_RECALL,
+               max_tables=MAX_TABLES):
+    """
+    由阈值选择哈希位数与表数：阈值处的近邻对 (夹角 arccos(1-simlT)) 至少以 target_recall
+    的概率在某张表中同桶；位数越多桶越小 (候选越少)，因此在表数不超过 n_tables
+    (缺省 max_tables) 的前提下取最多的位数
+    返回 (n_tables, n_bits, 阈值处的理论召回率)
+    """
+    p = bit_collision_prob(simlT)
+    if n_bits is None:
+        limit = n_tables or max_tables
+        n_bits = 1
+        for b in range(62, 0, -1):
+            if tables_needed(p, b, target_recall) <= limit:
+                n_bits = b
+                break
+    if not 1 <= n_bits <= 62:
+        raise ValueError("n_bits must be in [1, 62]")
+    if n_tables is None:
+        n_tables = min(tables_needed(p, n_bits, target_recall), max_tables)
+    recall = 1.0 - (1.0 - p ** n_bits) ** n_tables
+    return int(n_tables), int(n_bits), float(recall)
+
+
+def simhash_codes(X, n_tables, n_bits, seed=0, chunk_rows=4096):
+    """
+    对归一化后的描述符计算 n_tables 组 n_bits 位的随机超平面哈希 (SimHash)
+    超平面过原点，两行同侧的概率只取决于其夹角，因此可由阈值算出召回率 (见 lsh_params)
+    返回 (n_tables, N) 的 int64 编码
+    """
+    N, D = X.shape
+    if not 1 <= n_bits <= 62:
+        raise ValueError("n_bits must be in [1, 62]")
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((D, n_tables * n_bits)).astype(np.float32)
+    weights = (1 << np.arange(n_bits, dtype=np.int64))
+
+    codes = np.empty((n_tables, N), dtype=np.int64)
+    for start in range(0, N, chunk_rows):
+        bits = (np.asarray(X[start:start + chunk_rows], dtype=np.float32) @ planes) > 0
+        bits = bits.reshape(-1, n_tables, n_bits)
+        codes[:, start:start + chunk_rows] = (bits @ weights).T
+    return codes
+
+
+class LSHIndex:
+    """
+    多表 SimHash 索引，每张表按编码排序，桶即排序后的一段连续区间
+    """
+    def __init__(self, X, n_tables, n_bits, seed=0):
+        self.codes = simhash_codes(X, n_tables, n_bits, seed)
+        self.order = []
+        self.bucket_start = np.empty_like(self.codes)
+        self.bucket_end = np.empty_like(self.codes)
+        for t, code in enumerate(self.codes):
+            order = np.argsort(code, kind="stable")   # 桶内保持原始顺序
+            _, first, inverse, counts = np.unique(code[order], return_index=True,
+                                                  return_inverse=True, return_counts=True)
+            self.order.append(order)
+            self.bucket_start[t, order] = first[inverse]
+            self.bucket_end[t, order] = first[inverse] + counts[inverse]
+
+    def candidates(self, i, alive=None):
+        """与第 i 行在任一张表中同桶的所有行 (升序，含 i 本身)，可只保留 alive 中的行"""
+        cand = np.concatenate([order[self.bucket_start[t, i]:self.bucket_end[t, i]]
+                               for t, order in enumerate(self.order)])
+        if alive is not None:
+            cand = cand[alive[cand]]
+        return np.unique(cand)
+
+
+def lsh_recall(X, index, simlT, n_sample=1000, seed=0, chunk_rows=4096):
+    """
+    抽样估计 LSH 召回率：对随机参考点，精确近邻 (1-cos <= simlT) 中有多少与它在某张表中同桶
+    X 为归一化后的描述符，返回 (recall, 精确近邻总数)
+    """
+    N = X.shape[0]
+    sim_min = 1.0 - simlT
+
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(N, size=min(n_sample, N), replace=False))
+    Q = np.asarray(X[sample], dtype=np.float32)
+    n_exact, n_found = 0, 0
+    for start in range(0, N, chunk_rows):
+        sims = np.asarray(X[start:start + chunk_rows], dtype=np.float32) @ Q.T
+        rows, cols = np.nonzero(sims >= sim_min)
+        rows += start
+        keep = rows != sample[cols]
+        rows, cols = rows[keep], cols[keep]
+        n_exact += len(rows)
+        n_found += (index.codes[:, rows] == index.codes[:, sample[cols]]).any(axis=0).sum()
+
+    recall = n_found / n_exact if n_exact else 1.0
+    return float(recall), int(n_exact)
@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+import numpy as np
+from .utils import file_signature
+
+# =========================================================
+# 缓存清单：记录一次运行的分组结果，输入未变时跳过读取/分组/描述符计算
+# 按 (输入文件的路径/大小/修改时间, SOAP 参数, 过滤条件) 寻址
+# =========================================================
+MANIFEST_VERSION = 1
+
+
+def manifest_path(cache_dir, files, tag, filter_opts):
+    s = json.dumps({"files": [file_signature(f) for f in files], "tag": tag,
+                    "filters": filter_opts}, sort_keys=True)
+    return f"{cache_dir}/manifest/MANIFEST_{hashlib.md5(s.encode()).hexdigest()[:12]}.npz"
+
+
+def save_manifest(path, groups, records, filter_counts=None):
+    """
+    保存各组的全局序号、标签、缓存行号与逐帧记录 (输出时字节复制用)
+    groups 中的组需带 "rows" (build_caches / stream_structures 写入)
+    """
+    keys = list(groups)
+    meta = {"version": MANIFEST_VERSION, "keys": keys,
+            "species": [groups[k]["species"] for k in keys], "filter": filter_counts or {}}
+
+    def concat(field, dtype):
+        parts = [np.asarray(groups[k][field], dtype=dtype) for k in keys]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)),
+             bounds=np.cumsum([0] + [len(groups[k]["indices"]) for k in keys]),
+             indices=concat("indices", np.int64), has_label=concat("has_label", bool),
+             rows=concat("rows", np.int64),
+             rec_file=np.asarray(records["file"], dtype=np.int32),
+             rec_offset=np.asarray(records["offset"], dtype=np.int64),
+             rec_length=np.asarray(records["length"], dtype=np.int64))
+    os.replace(tmp_path, path)
+
+
+def load_manifest(path, cache_dir, tag):
+    """
+    读取清单，返回 (groups, records, filter_counts)，groups 中不含 atoms
+    清单不存在、版本不符或描述符缓存不完整 (缺文件/行数不足) 时返回 None
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        if meta.get("version") != MANIFEST_VERSION:
+            return None
+        bounds, indices, has_label, rows = z["bounds"], z["indices"], z["has_label"], z["rows"]
+        records = {"file": z["rec_file"], "offset": z["rec_offset"], "length": z["rec_length"]}
+
+    groups = {}
+    for i, (key, species) in enumerate(zip(meta["keys"], meta["species"])):
+        lo, hi = bounds[i], bounds[i + 1]
+        hash_file = f"{cache_dir}/HASH_{tag}_{key}.npy"
+        if not (os.path.exists(hash_file) and os.path.exists(f"{cache_dir}/SOAP_{tag}_{key}.npy")):
+            return None
+        n_cached = np.load(hash_file, mmap_mode="r").shape[0]
+        if hi > lo and rows[lo:hi].max() >= n_cached:
+            return None
+        groups[key] = {"species": species, "indices": indices[lo:hi],
+                       "has_label": has_label[lo:hi], "rows": rows[lo:hi]}
+    return groups, records, meta["filter"]
@@ -0,0 +1,81 @@
+import time
+from multiprocessing import Pool
+from .io import iter_input_frames_parallel
+from .soap import stream_structures, _init_soap_worker
+from .dedup import (run_deduplication, allocate_fps, group_task, estimate_cost, _init_worker,
+                    _worker)
+from .utils import soap_param_hash
+
+# =========================================================
+# 流水线执行：读取 -> 描述符 -> 筛选 在同一个进程池中重叠进行
+#   解析：文本帧按段交给进程池解析 (在途段数有上限)
+#   描述符：按组攒批计算并追加写入缓存 (在途批次与缓冲帧数有上限，见 stream_structures)
+#   筛选：读取结束后，每个组的缓存一写完就提交筛选，其他组仍在计算描述符
+# 各阶段之间的队列都有上限，内存占用与数据量无关
+# =========================================================
+def _init_pipeline_worker(rcut, center_elements):
+    """同一个进程池的 worker 同时用于解析、描述符计算与筛选"""
+    _init_soap_worker(rcut, center_elements)
+    _init_worker()
+
+
+def run_pipeline(files, center_elements, cache_dir, nproc, rcut=6.0, batch_size=512,
+                 chunk_frames=256, filter_opts=None, mode="fps", num=1000, simlT=0.005,
+                 backend="exact", backend_opts=None, hier_opts=None, checkpoint_opts=None,
+                 stats=None, cache_stats=None, group_stats=None, profile=None):
+    """
+    流式读取并计算描述符，同时筛选已完成的组；返回 (groups, records, results)，
+    groups / records 同 stream_structures，results 同 run_deduplication
+    FPS 的数量分配需要全部组的大小，在读取结束时进行；
+    开销超过总量 1/nproc 的大组仍留到最后在主进程中多线程计算 (同 run_deduplication)；
+    开销由行数与描述符维度估计，维度取自已写入的批次 (尚未写入任何一批的组用已知维度的平均值)，
+    主进程不构造 SOAP 对象
+    """
+    tag = soap_param_hash(rcut, centers=center_elements)
+    param = None if mode == "fps" else simlT
+    submitted, sched = {}, {}
+    t0 = time.perf_counter()
+
+    def frames():
+        yield from iter_input_frames_parallel(files, pool, cache_dir, chunk_frames,
+                                              max_pending=nproc * 2)
+        sched["read_s"] = time.perf_counter() - t0
+
+    with Pool(nproc, initializer=_init_pipeline_worker, initargs=(rcut, center_elements)) as pool:
+        def on_group_done(key, groups):
+            if "costs" not in sched:
+                # 第一个组完成时读取已经结束，全部组已知
+                if mode == "fps":
+                    allocate_fps(groups, num)
+                widths = [g["n_dim"] for g in groups.values() if "n_dim" in g]
+                mean_width = sum(widths) / len(widths) if widths else 1
+                costs = {k: estimate_cost(len(g["indices"]), g.get("n_dim", mean_width), mode,
+                                          g.get("n_select", 0) if mode == "fps" else simlT,
+                                          backend, hier_opts)
+                         for k, g in groups.items()}
+                sched["costs"], sched["total"] = costs, sum(costs.values())
+            if nproc > 1 and sched["costs"][key] * nproc > sched["total"]:
+                return
+            task, _ = group_task(groups, key, cache_dir, tag, mode, param, backend, backend_opts,
+                                 profile=profile, hier_opts=hier_opts,
+                                 checkpoint_opts=checkpoint_opts)
+            submitted[key] = pool.apply_async(_worker, (task,))
+
+        groups, records = stream_structures(
+            frames(), center_elements, cache_dir=cache_dir, nproc=nproc, rcut=rcut, batch_size=batch_size,
+            filter_opts=filter_opts, stats=stats, cache_stats=cache_stats, pool=pool,
+            on_group_done=on_group_done)
+        t_describe = time.perf_counter() - t0
+        if "costs" not in sched and mode == "fps":
+            allocate_fps(groups, num)
+        print(f"[PIPELINE] {len(submitted)} of {len(groups)} groups already submitted for "
+              f"selection when descriptors finished")
+        results = run_deduplication(groups, cache_dir=cache_dir, tag=tag, nproc=nproc, mode=mode,
+                                    param=param, backend=backend,
+                                    backend_opts=backend_opts, group_stats=group_stats,
+                                    profile=profile, hier_opts=hier_opts,
+                                    checkpoint_opts=checkpoint_opts, pool=pool,
+                                    submitted=submitted)
+    print(f"[PIPELINE] Read {sched.get('read_s', t_describe):.1f}s, descriptors done "
+          f"{t_describe:.1f}s, selection done {time.perf_counter() - t0:.1f}s")
+    return groups, records, results
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import time
+import resource
+import contextlib
+
+# =========================================================
+# 分阶段计时与峰值内存 (RSS)
+# =========================================================
+def _status_kb(field):
+    """/proc/self/status 中的内存字段 (kB)，不可用时返回 None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """重置本进程的峰值 RSS (Linux 的 clear_refs)，成功返回 True"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """本进程的峰值 RSS (MiB)；可以重置时为上次重置以来的峰值"""
+    kb = _status_kb("VmHWM")
+    if kb is None:
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            kb //= 1024
+    return kb / 1024
+
+
+def children_peak_rss_mb():
+    """已结束的子进程 (进程池 worker) 中最大的峰值 RSS (MiB)，不可重置"""
+    kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        kb //= 1024
+    return kb / 1024
+
+
+def cpu_seconds():
+    """本进程与已结束子进程的 CPU 时间 (用户 + 系统)"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+@contextlib.contextmanager
+def measure(record, reset_peak=True):
+    """
+    记录一个阶段的墙钟时间、CPU 时间与峰值内存，写入 record (dict)：
+    wall_s, cpu_s, peak_rss_mb (阶段内本进程峰值，无法重置时为进程启动以来的峰值),
+    children_peak_rss_mb (到阶段结束为止子进程的最大峰值)
+    嵌套在另一个阶段内时用 reset_peak=False，不打断外层阶段的峰值统计
+    """
+    resettable = reset_peak_rss() if reset_peak else False
+    cpu0, t0 = cpu_seconds(), time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - t0
+        record["cpu_s"] = cpu_seconds() - cpu0
+        record["peak_rss_mb"] = peak_rss_mb()
+        if resettable:
+            record["peak_rss_scope"] = "stage"
+        else:
+            record["peak_rss_scope"] = "process" if reset_peak else "enclosing"
+        record["children_peak_rss_mb"] = children_peak_rss_mb()
+
+
+def _json_default(obj):
+    """numpy 标量/数组转为 JSON 可写的类型"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def write_report(path, report):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=_json_default)
+    print(f"[PROFILE] Run report written to {path}")
@@ -0,0 +1,145 @@
+import os
+import hashlib
+import numpy as np
+from .soap import load_row_hashes, save_group_index
+from .utils import NpyAppender, take_rows
+
+# =========================================================
+# 描述符降维：非中心化 PCA 或高斯随机投影
+# 降维后的矩阵作为另一组缓存保存 (SOAP/HASH/INDEX/HAS_LABEL_{rtag}_{key})，
+# 与原缓存逐行对应，筛选阶段只需把 tag 换成 rtag
+# =========================================================
+REDUCE_METHODS = ("pca", "rp")
+
+
+def reduce_param_hash(tag, method, dim, sample, seed=0):
+    s = f"{tag}_{method}_d{dim}_s{sample}_seed{seed}"
+    return f"{tag}{method}{hashlib.md5(s.encode()).hexdigest()[:6]}"
+
+
+def fit_pca(X, dim, n_oversample=10, n_power=2, seed=0):
+    """
+    非中心化 PCA (二阶矩矩阵的主方向)：投影同时近似保持内积 (Cosine) 与欧氏距离
+    用随机化 SVD (Halko et al. 2011)，开销与 样本数 x 维度 x dim 成正比
+    返回 (D, dim) 的正交投影矩阵
+    """
+    X = np.asarray(X, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = min(dim + n_oversample, *X.shape)
+    Q = (X @ rng.standard_normal((X.shape[1], k)).astype(np.float32)).astype(np.float64)
+    for _ in range(n_power):
+        Q, _ = np.linalg.qr(Q)
+        Q = (X @ (X.T @ Q.astype(np.float32))).astype(np.float64)
+    Q, _ = np.linalg.qr(Q)
+    _, _, vt = np.linalg.svd(Q.T @ X.astype(np.float64), full_matrices=False)
+    return np.ascontiguousarray(vt[:dim].T, dtype=np.float32)
+
+
+def random_projection(n_in, dim, seed=0):
+    """高斯随机投影 (Johnson-Lindenstrauss)，按 1/sqrt(dim) 缩放使距离的期望不变"""
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n_in, dim)) / np.sqrt(dim)).astype(np.float32)
+
+
+def distortion(X, Y, n_pairs=2000, seed=0):
+    """
+    随机行对上降维前后的失真：欧氏距离的相对误差与 Cosine 距离 (1-cos) 的绝对误差
+    X, Y 为同一组行的原始/降维描述符，返回各分位数
+    """
+    N = X.shape[0]
+    rng = np.random.default_rng(seed)
+    i, j = rng.integers(0, N, n_pairs), rng.integers(0, N, n_pairs)
+    i, j = i[i != j], j[i != j]
+    if len(i) == 0:
+        return {"pairs": 0}
+    rows = np.unique(np.concatenate([i, j]))
+    pi, pj = np.searchsorted(rows, i), np.searchsorted(rows, j)
+
+    def pair_dists(data):
+        A = np.asarray(data[rows], dtype=np.float64)
+        dist = np.linalg.norm(A[pi] - A[pj], axis=1)
+        norms = np.linalg.norm(A, axis=1) + 1e-12
+        cos = np.einsum("ij,ij->i", A[pi], A[pj]) / (norms[pi] * norms[pj])
+        return dist, 1.0 - cos
+
+    d_full, c_full = pair_dists(X)
+    d_red, c_red = pair_dists(Y)
+    ok = d_full > 0
+    rel = np.abs(d_red[ok] - d_full[ok]) / d_full[ok]
+    cos_err = np.abs(c_red - c_full)
+    return {"pairs": int(len(i)),
+            "dist_rel_median": float(np.median(rel)) if len(rel) else 0.0,
+            "dist_rel_p95": float(np.percentile(rel, 95)) if len(rel) else 0.0,
+            "dist_rel_max": float(rel.max()) if len(rel) else 0.0,
+            "cos_abs_p95": float(np.percentile(cos_err, 95)),
+            "cos_abs_max": float(cos_err.max())}
+
+
+def reduce_caches(groups, cache_dir, tag, method="pca", dim=128, sample=20000, n_pairs=2000,
+                  seed=0, chunk_rows=65536, stats=None):
+    """
+    为各组生成降维缓存，返回其 tag (rtag)，用于 pack_store / run_deduplication
+    投影矩阵在第一次时拟合 (PCA 用组内随机 sample 行) 并保存为 REDUCER_{rtag}_{key}.npy，
+    之后原缓存增长时只投影新增的行；维度不超过原始维度
+    stats 不为 None 时写入每个组的维度、新投影的行数与失真 (n_pairs 对随机行，0 为不计算)
+    """
+    if method not in REDUCE_METHODS:
+        raise ValueError(f"Unknown reduction method: {method}")
+    rtag = reduce_param_hash(tag, method, dim, sample, seed)
+    stats = {} if stats is None else stats
+
+    print(f"[REDUCE] {method} to {dim} dims (tag {rtag})")
+    for key, g in groups.items():
+        src = np.load(f"{cache_dir}/SOAP_{tag}_{key}.npy", mmap_mode="r")
+        src_hashes = load_row_hashes(cache_dir, tag, key)
+        n_src, n_in = len(src_hashes), src.shape[1]
+        basis_file = f"{cache_dir}/REDUCER_{rtag}_{key}.npy"
+        red_file = f"{cache_dir}/SOAP_{rtag}_{key}.npy"
+
+        n_done = 0
+        if os.path.exists(basis_file):
+            # 已投影的行必须与原缓存的前 n_done 行逐行相同，否则 (原缓存被重建等) 全部重新拟合
+            red_hashes = load_row_hashes(cache_dir, rtag, key)
+            if len(red_hashes) <= n_src and np.array_equal(red_hashes, src_hashes[:len(red_hashes)]):
+                n_done = len(red_hashes)
+        if n_done == 0:
+            # 重新拟合：先撤销旧的提交记录与投影结果
+            for path in (f"{cache_dir}/HASH_{rtag}_{key}.npy", red_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            if method == "pca":
+                rows = np.unique(np.asarray(g["rows"], dtype=np.int64))
+                rng = np.random.default_rng(seed)
+                fit_rows = np.sort(rng.choice(rows, min(sample, len(rows)), replace=False))
+                basis = fit_pca(src[fit_rows], min(dim, n_in, len(fit_rows)), seed=seed)
+            else:
+                basis = random_projection(n_in, min(dim, n_in), seed)
+            np.save(basis_file, basis)
+        else:
+            basis = np.load(basis_file)
+
+        if n_done < n_src:
+            out = NpyAppender(red_file, basis.shape[1], np.float32,
+                              start_row=n_done if n_done else None)
+            for start in range(n_done, n_src, chunk_rows):
+                blk = np.asarray(src[start:min(start + chunk_rows, n_src)], dtype=np.float32)
+                out.append(blk @ basis)
+            out.close()
+        save_group_index(cache_dir, rtag, key, g["rows"], g["has_label"])
+        np.save(f"{cache_dir}/HASH_{rtag}_{key}.npy", src_hashes)
+
+        info = {"n_dim_in": n_in, "n_dim": basis.shape[1], "n_projected": n_src - n_done}
+        if n_pairs > 0:
+            red = np.load(red_file, mmap_mode="r")
+            info["distortion"] = distortion(take_rows(src, g["rows"]), take_rows(red, g["rows"]),
+                                            n_pairs, seed)
+        stats[key] = info
+
+        line = f"  - Group {key:<10}: {n_in} -> {basis.shape[1]} dims, {n_src - n_done} rows projected"
+        dist = info.get("distortion", {})
+        if dist.get("pairs"):
+            line += (f", distance error median {dist['dist_rel_median']:.2%} / "
+                     f"p95 {dist['dist_rel_p95']:.2%}, cosine distance error p95 "
+                     f"{dist['cos_abs_p95']:.2e}")
+        print(line)
+    return rtag
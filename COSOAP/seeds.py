@@ -0,0 +1,155 @@
+import json
+import numpy as np
+from .filters import frame_features
+from .soap import build_caches, save_group_index, load_row_hashes
+from .utils import match_rows
+
+# =========================================================
+# 增量筛选：已有训练集作为固定种子
+# 种子以 (组 key, 缓存行号) 表示，描述符直接从内容寻址的缓存中读取；
+# train_rows.npz 中保存的是结构的内容摘要，读入时再对应到当前缓存的行号
+# =========================================================
+TRAIN_ROWS_VERSION = 1
+
+
+def _read_train_rows(path, cache_dir, tag):
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        if meta.get("version") != TRAIN_ROWS_VERSION:
+            raise ValueError(f"Unsupported seed file version in {path}")
+        if meta["tag"] != tag:
+            raise ValueError(f"{path} was written with different SOAP parameters "
+                             f"(tag {meta['tag']}, expected {tag})")
+        bounds, hashes, has_label = z["bounds"], z["hashes"], z["has_label"]
+
+    part = {}
+    for i, key in enumerate(meta["keys"]):
+        lo, hi = bounds[i], bounds[i + 1]
+        cached = load_row_hashes(cache_dir, tag, key)
+        rows, missing = match_rows(hashes[lo:hi], cached)
+        if len(missing):
+            raise ValueError(f"{len(missing)} seed structures of group {key} in {path} are not "
+                             f"in {cache_dir}; pass the training structure file instead")
+        part[key] = (rows, has_label[lo:hi])
+    return part
+
+
+def seed_groups_from_structures(structures, cache_dir, nproc, center_elements, rcut=6.0,
+                                pool=None):
+    """种子结构按组成分组并在缓存中查找 (缺失的补算)，不改写各组的 INDEX/HAS_LABEL"""
+    features = frame_features(structures)
+    has_label = ~np.isnan(features["energy_per_atom"])
+    groups = {}
+    for i, key in enumerate(features["key"]):
+        g = groups.setdefault(key, {"species": sorted(set(structures[i].get_chemical_symbols())),
+                                    "atoms": [], "has_label": []})
+        g["atoms"].append(structures[i])
+        g["has_label"].append(bool(has_label[i]))
+    build_caches(groups, cache_dir, nproc, center_elements, rcut, write_index=False, pool=pool)
+    return {key: (g["rows"], np.array(g["has_label"], dtype=bool)) for key, g in groups.items()}
+
+
+def load_seeds(paths, cache_dir, tag, center_elements, nproc, rcut=6.0):
+    """
+    读取已有训练集作为固定种子，返回 {key: (缓存行号, 标签)}，保持种子的先后顺序
+    .npz 为上次运行写出的 train_rows.npz (不需要解析结构，其描述符须已在缓存中)；
+    其他文件 (如 train_labeled.xyz) 读入后按内容摘要在缓存中查找，缺失的描述符会补算
+    """
+    parts, structures = [], []
+    for path in paths:
+        if path.endswith(".npz"):
+            parts.append(_read_train_rows(path, cache_dir, tag))
+        else:
+            from ase.io import read
+            structures.extend(read(path, ":"))
+    if structures:
+        parts.append(seed_groups_from_structures(structures, cache_dir, nproc,
+                                                 center_elements, rcut))
+
+    seeds = {}
+    for part in parts:
+        for key, (rows, has_label) in part.items():
+            if key in seeds:
+                rows = np.concatenate([seeds[key][0], rows])
+                has_label = np.concatenate([seeds[key][1], has_label])
+            seeds[key] = (np.asarray(rows, dtype=np.int64), np.asarray(has_label, dtype=bool))
+    # 同一结构只保留第一次出现
+    for key, (rows, has_label) in seeds.items():
+        first = np.sort(np.unique(rows, return_index=True)[1])
+        seeds[key] = (rows[first], has_label[first])
+
+    print(f"[SEED] {sum(len(r) for r, _ in seeds.values())} seed structures "
+          f"in {len(seeds)} groups")
+    return seeds
+
+
+def exclude_seeded(groups, seeds, cache_dir, tag):
+    """
+    从各组中去掉已在种子中的结构 (同一缓存行)，只在新结构中筛选
+    改写受影响组的 INDEX/HAS_LABEL，去空后的组被删除，返回去掉的结构数
+    """
+    n_skipped = 0
+    for key, (seed_rows, _) in seeds.items():
+        if key not in groups:
+            continue
+        g = groups[key]
+        keep = ~np.isin(np.asarray(g["rows"]), seed_rows)
+        if keep.all():
+            continue
+        n_skipped += int((~keep).sum())
+        g["indices"] = np.asarray(g["indices"], dtype=np.int64)[keep]
+        g["has_label"] = np.asarray(g["has_label"], dtype=bool)[keep]
+        g["rows"] = np.asarray(g["rows"], dtype=np.int64)[keep]
+        if "atoms" in g:
+            g["atoms"] = [a for a, k in zip(g["atoms"], keep) if k]
+        if len(g["indices"]):
+            save_group_index(cache_dir, tag, key, g["rows"], g["has_label"])
+        else:
+            del groups[key]
+    if n_skipped:
+        print(f"[SEED] {n_skipped} input structures are already in the training set and are skipped")
+    return n_skipped
+
+
+def train_rows_arrays(groups, cache_dir, tag, train_label_idx, train_unlabel_idx, seeds=None):
+    """训练集 (种子 + 本次选中) 的内容摘要与标签，返回 train_rows.npz 中的各数组"""
+    keys = list(groups)
+    indices = np.concatenate([np.asarray(groups[k]["indices"], dtype=np.int64) for k in keys]) \
+        if keys else np.empty(0, dtype=np.int64)
+    rows = np.concatenate([np.asarray(groups[k]["rows"], dtype=np.int64) for k in keys]) \
+        if keys else np.empty(0, dtype=np.int64)
+    group_id = np.repeat(np.arange(len(keys)), [len(groups[k]["indices"]) for k in keys])
+
+    selected = np.asarray(list(train_label_idx) + list(train_unlabel_idx), dtype=np.int64)
+    labels = np.concatenate([np.ones(len(train_label_idx), dtype=bool),
+                             np.zeros(len(train_unlabel_idx), dtype=bool)])
+    order = np.argsort(indices, kind="stable")
+    pos = order[np.searchsorted(indices[order], selected)]
+
+    train = dict(seeds or {})
+    for i, key in enumerate(keys):
+        mine = group_id[pos] == i
+        if not mine.any():
+            continue
+        new_rows, new_labels = rows[pos[mine]], labels[mine]
+        if key in train:
+            new_rows = np.concatenate([train[key][0], new_rows])
+            new_labels = np.concatenate([train[key][1], new_labels])
+        train[key] = (new_rows, new_labels)
+
+    out_keys = list(train)
+    hashes = [load_row_hashes(cache_dir, tag, k)[train[k][0]] for k in out_keys]
+    return {"meta": np.array(json.dumps({"version": TRAIN_ROWS_VERSION, "tag": tag,
+                                         "keys": out_keys})),
+            "bounds": np.cumsum([0] + [len(train[k][0]) for k in out_keys]),
+            "hashes": np.concatenate(hashes) if out_keys else np.empty(0, dtype=np.uint64),
+            "has_label": np.concatenate([train[k][1] for k in out_keys]) if out_keys
+            else np.empty(0, dtype=bool)}
+
+
+def save_train_rows(path, groups, cache_dir, tag, train_label_idx, train_unlabel_idx, seeds=None):
+    """
+    写出训练集 (种子 + 本次选中) 的内容摘要与标签，作为下一轮 --seed-train 的输入
+    """
+    np.savez(path, **train_rows_arrays(groups, cache_dir, tag, train_label_idx,
+                                       train_unlabel_idx, seeds))
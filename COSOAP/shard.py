@@ -0,0 +1,231 @@
+import os
+import io
+import json
+import hashlib
+import numpy as np
+from array import array
+from tqdm import tqdm
+from .io import iter_input_frames, TEXT_FORMATS, write_outputs
+from .soap import classify_frame
+from .filters import report_filter
+from .dedup import allocate_fps
+from .seeds import train_rows_arrays, TRAIN_ROWS_VERSION
+from .utils import file_signature
+
+# =========================================================
+# 分片执行：各组在描述符计算与筛选中互相独立，可以分到多个进程/节点上
+#   plan  : 读一遍输入 (只分组与过滤，不算描述符)，把组分到 N 个分片，写 {shard_dir}/plan.npz
+#   shard : 分片 K 只解析自己的帧，计算缓存并筛选，写 {shard_dir}/part_K.npz
+#   merge : 合并各分片结果，写出最终的 xyz 与 train_rows.npz
+# 各步骤之间只通过文件交换，可由任意作业调度系统分别提交
+# =========================================================
+PLAN_VERSION = 1
+
+
+def plan_path(shard_dir):
+    return f"{shard_dir}/plan.npz"
+
+
+def part_path(shard_dir, shard):
+    return f"{shard_dir}/part_{shard:04d}.npz"
+
+
+def balance_groups(n_frames, n_atoms, n_shards):
+    """
+    把各组分到 n_shards 个分片 (LPT 贪心：从大到小放进当前负载最小的分片)，
+    每组的负载为帧数与原子数各自占总量的比例之和；返回每组的分片号
+    """
+    n_frames = np.asarray(n_frames, dtype=np.float64)
+    n_atoms = np.asarray(n_atoms, dtype=np.float64)
+    cost = n_frames / max(n_frames.sum(), 1) + n_atoms / max(n_atoms.sum(), 1)
+    load = np.zeros(n_shards)
+    shard_of = np.zeros(len(cost), dtype=np.int64)
+    for i in np.argsort(-cost, kind="stable"):
+        s = int(np.argmin(load))
+        shard_of[i] = s
+        load[s] += cost[i]
+    return shard_of
+
+
+def plan_shards(shard_dir, n_shards, files, tag, center_elements, rcut, filter_opts,
+                mode, num, simlT, cache_dir="soap_cache"):
+    """
+    逐帧读取输入并分组 (不保留 Atoms，不计算描述符)，把组分到 n_shards 个分片并写出分片计划
+    FPS 的数量分配在此按全体数据完成，各分片只按计划中的 n_select 筛选
+    """
+    if n_shards < 1:
+        raise ValueError("Number of shards must be at least 1")
+    records = {"file": array("i"), "offset": array("q"), "length": array("q")}
+    groups, counts, idx = {}, {}, 0
+    for file_id, offset, length, atoms in tqdm(iter_input_frames(files, cache_dir),
+                                               desc="Planning shards"):
+        res = classify_frame(atoms, filter_opts, counts)
+        if res is None:
+            continue
+        key, has_label = res
+        records["file"].append(file_id)
+        records["offset"].append(offset)
+        records["length"].append(length)
+        if key not in groups:
+            groups[key] = {"species": sorted(set(atoms.get_chemical_symbols())),
+                           "indices": array("q"), "has_label": array("b"), "n_atoms": 0}
+        groups[key]["indices"].append(idx)
+        groups[key]["has_label"].append(has_label)
+        groups[key]["n_atoms"] += len(atoms)
+        idx += 1
+    report_filter(counts)
+
+    keys = list(groups)
+    n_frames = [len(groups[k]["indices"]) for k in keys]
+    n_atoms = [groups[k]["n_atoms"] for k in keys]
+    shard_of = balance_groups(n_frames, n_atoms, n_shards)
+    n_select = allocate_fps(groups, num) if mode == "fps" else {}
+
+    meta = {"version": PLAN_VERSION, "n_shards": n_shards, "files": list(files),
+            "signatures": [file_signature(f) for f in files], "tag": tag,
+            "atoms": list(center_elements), "rcut": rcut, "filters": filter_opts,
+            "mode": mode, "num": num, "simlT": simlT, "filter": counts,
+            "keys": keys, "species": [groups[k]["species"] for k in keys],
+            "shard": shard_of.tolist(), "n_frames": n_frames, "n_atoms": n_atoms,
+            "n_select": [n_select.get(k, 0) for k in keys]}
+    meta["plan_id"] = hashlib.md5(json.dumps(meta, sort_keys=True).encode()).hexdigest()[:12]
+
+    def concat(field, dtype):
+        parts = [np.asarray(groups[k][field], dtype=dtype) for k in keys]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    path = plan_path(shard_dir)
+    tmp_path = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)),
+             bounds=np.cumsum([0] + n_frames),
+             indices=concat("indices", np.int64), has_label=concat("has_label", bool),
+             rec_file=np.asarray(records["file"], dtype=np.int32),
+             rec_offset=np.asarray(records["offset"], dtype=np.int64),
+             rec_length=np.asarray(records["length"], dtype=np.int64))
+    os.replace(tmp_path, path)
+
+    total = max(sum(n_frames), 1), max(sum(n_atoms), 1)
+    print(f"[SHARD] {idx} structures in {len(keys)} groups -> {n_shards} shards ({path})")
+    for s in range(n_shards):
+        mine = shard_of == s
+        print(f"  - Shard {s:<4}: {int(mine.sum()):>5} groups, "
+              f"{sum(np.asarray(n_frames)[mine]) / total[0]:6.1%} of frames, "
+              f"{sum(np.asarray(n_atoms)[mine]) / total[1]:6.1%} of atoms")
+    return meta
+
+
+def load_plan(shard_dir):
+    """读取分片计划，返回 (meta, groups, records)；输入文件自计划以来有变化时报错"""
+    path = plan_path(shard_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Shard plan {path} not found; run with --shard-plan N first")
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        if meta.get("version") != PLAN_VERSION:
+            raise ValueError(f"Shard plan {path} has an unsupported version")
+        bounds, indices, has_label = z["bounds"], z["indices"], z["has_label"]
+        records = {"file": z["rec_file"], "offset": z["rec_offset"], "length": z["rec_length"]}
+    changed = [f for f, sig in zip(meta["files"], meta["signatures"])
+               if not os.path.exists(f) or file_signature(f) != sig]
+    if changed:
+        raise ValueError(f"Input files changed since the shard plan was written: "
+                         f"{', '.join(changed)}")
+
+    groups = {}
+    for i, key in enumerate(meta["keys"]):
+        lo, hi = bounds[i], bounds[i + 1]
+        groups[key] = {"species": meta["species"][i], "indices": indices[lo:hi],
+                       "has_label": has_label[lo:hi], "n_select": meta["n_select"][i],
+                       "shard": meta["shard"][i]}
+    return meta, groups, records
+
+
+def read_frames(files, records, idx):
+    """
+    按记录读取指定的帧 (Atoms 列表，顺序同 idx)：文本格式按字节范围只解析这些帧，
+    其他格式按帧号读取
+    """
+    from ase.io import read
+    idx = np.asarray(idx, dtype=np.int64)
+    out = [None] * len(idx)
+    handles = {}
+    for j in np.argsort(records["offset"][idx], kind="stable"):
+        i = idx[j]
+        fid, offset, length = int(records["file"][i]), int(records["offset"][i]), \
+            int(records["length"][i])
+        if length >= 0 and files[fid].lower().endswith(TEXT_FORMATS):
+            if fid not in handles:
+                handles[fid] = open(files[fid], "rb")
+            handles[fid].seek(offset)
+            out[j] = read(io.StringIO(handles[fid].read(length).decode()), format="extxyz")
+        else:
+            out[j] = read(files[fid], index=offset)
+    for fh in handles.values():
+        fh.close()
+    return out
+
+
+def shard_groups(groups, records, files, shard):
+    """分片 shard 的组 (带 atoms)，只解析属于这些组的帧"""
+    mine = {k: g for k, g in groups.items() if g["shard"] == shard}
+    idx = np.concatenate([g["indices"] for g in mine.values()]) if mine \
+        else np.empty(0, dtype=np.int64)
+    print(f"[SHARD] Shard {shard}: {len(idx)} structures in {len(mine)} groups")
+    atoms = read_frames(files, records, idx)
+    start = 0
+    for g in mine.values():
+        g["atoms"] = atoms[start:start + len(g["indices"])]
+        start += len(g["indices"])
+    return mine
+
+
+def save_part(shard_dir, shard, meta, groups, cache_dir, tag, results):
+    """
+    写出分片结果：四类全局序号，以及训练集的内容摘要 (与 train_rows.npz 格式相同，
+    合并时不再需要描述符缓存)
+    """
+    path = part_path(shard_dir, shard)
+    train_rows = train_rows_arrays(groups, cache_dir, tag, results[0], results[1])
+    tmp_path = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(tmp_path, plan_id=np.array(meta["plan_id"]), shard=np.array(shard),
+             **{f"idx_{i}": np.asarray(r, dtype=np.int64) for i, r in enumerate(results)},
+             **{f"train_{k}": v for k, v in train_rows.items()})
+    os.replace(tmp_path, path)
+    print(f"[SHARD] Wrote {path}")
+
+
+def merge_shards(shard_dir, out_rows="train_rows.npz"):
+    """合并全部分片结果，写出四个 xyz 与 train_rows.npz；缺少或过期的分片会被列出并报错"""
+    meta, _, records = load_plan(shard_dir)
+    results = [[], [], [], []]
+    keys, bounds, hashes, labels = [], [0], [], []
+    missing, stale = [], []
+    for s in range(meta["n_shards"]):
+        path = part_path(shard_dir, s)
+        if not os.path.exists(path):
+            missing.append(s)
+            continue
+        with np.load(path) as z:
+            if str(z["plan_id"]) != meta["plan_id"]:
+                stale.append(s)
+                continue
+            for i in range(4):
+                results[i].extend(z[f"idx_{i}"].tolist())
+            part_keys = json.loads(str(z["train_meta"]))["keys"]
+            keys.extend(part_keys)
+            bounds.extend((bounds[-1] + z["train_bounds"][1:]).tolist())
+            hashes.append(z["train_hashes"])
+            labels.append(z["train_has_label"])
+    if missing or stale:
+        raise ValueError(f"Cannot merge {shard_dir}: missing shards {missing}, "
+                         f"shards from another plan {stale}")
+
+    print(f"[SHARD] Merging {meta['n_shards']} shards")
+    write_outputs(None, *results, files=meta["files"], records=records)
+    np.savez(out_rows, meta=np.array(json.dumps({"version": TRAIN_ROWS_VERSION,
+                                                 "tag": meta["tag"], "keys": keys})),
+             bounds=np.asarray(bounds, dtype=np.int64),
+             hashes=np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64),
+             has_label=np.concatenate(labels) if labels else np.empty(0, dtype=bool))
+    return results
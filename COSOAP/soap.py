@@ -1,90 +1,610 @@
 import os
+import time
+import contextlib
 import numpy as np
-from dscribe.descriptors import SOAP
-from multiprocessing import Pool
+from array import array
+from collections import deque, OrderedDict
+from multiprocessing import Pool, get_start_method
 from tqdm import tqdm
-from .utils import soap_param_hash, get_Kpts
+from .filters import frame_features, prefilter, report_filter, composition_key
+from .utils import (soap_param_hash, NpyAppender, frame_hash, match_rows,
+                    resize_npy_rows, take_rows)
+
+# 流式模式同时打开的缓存写入器上限 (组很多时避免耗尽文件句柄)
+MAX_OPEN_WRITERS = 64
 
 # soap.py
-def split_structures(atoms_all, center_elements):
+def classify_frame(atoms, filter_opts=None, counts=None):
+    """
+    单帧的过滤与分组 (流式模式使用)：返回 (key, has_label)，被过滤掉的结构返回 None
+    counts 不为 None 时累加各过滤条件的计数
+    """
+    features = frame_features([atoms])
+    keep, has_label, frame_counts = prefilter(features, filter_opts)
+    if counts is not None:
+        for k, v in frame_counts.items():
+            counts[k] = counts.get(k, 0) + v
+    if not keep[0]:
+        return None
+    return features["key"][0], bool(has_label[0])
+
+def split_structures(atoms_all, center_elements, filter_opts=None, features=None, stats=None):
     """
     按化学组成分组，所有结构（无论有无标签）放在一起
     同时记录每个结构是否有标签
+    features 为 frame_features 的结果 (可由读取阶段按文件并行提取)，缺省时在此提取；
+    stats 不为 None 时写入各过滤条件丢弃的数量
     """
-    groups = {}
-    center_set = set(center_elements)
-
-    for idx, atoms in enumerate(atoms_all):
-        if get_Kpts(atoms.cell) > 100:
-            continue
-
-        key = "".join(sorted(atoms.symbols))
-
-        # 判断是否有标签
-        try:
-            if (-10 <= atoms.get_potential_energy()/len(atoms) <= -1) and (\
-                    max(np.linalg.norm(atoms.get_forces(), axis=1)) <= 10):
-                energy = atoms.get_potential_energy()
-                forces = atoms.get_forces()
-                per_atom_e = energy / len(atoms)
-                max_force = np.linalg.norm(forces, axis=1).max()
-                has_label = True
-            else: continue
-        except:
-            has_label = False
+    if features is None:
+        features = frame_features(atoms_all)
+    keep, has_label, counts = prefilter(features, filter_opts)
+    report_filter(counts)
+    if stats is not None:
+        stats.update(counts)
 
+    groups = {}
+    keys = features["key"]
+    for idx in np.flatnonzero(keep).tolist():
+        key = keys[idx]
         if key not in groups:
             groups[key] = {
-                "symbols": sorted(atoms.symbols),
+                "species": sorted(set(atoms_all[idx].get_chemical_symbols())),
                 "atoms": [],
                 "indices": [],
                 "has_label": []   # 新增：记录每个结构是否有标签
             }
 
-        groups[key]["atoms"].append(atoms)
+        groups[key]["atoms"].append(atoms_all[idx])
         groups[key]["indices"].append(idx)
-        groups[key]["has_label"].append(has_label)
+        groups[key]["has_label"].append(bool(has_label[idx]))
 
-    return groups  
+    return groups
 
-def build_cache(group, cache_dir, nproc, center_elements, rcut=6.0):
-    symbols = group["symbols"]
-    atoms_list = group["atoms"]
-    #indices = group["indices"]
-    indices = range(len(atoms_list))
-    symbols_str = "".join(sorted(symbols))
-    tag = soap_param_hash(rcut)
-    soap_file = f"{cache_dir}/SOAP_{tag}_{symbols_str}.npy"
-
-    if os.path.exists(soap_file):
+# 进程池内每个 worker 的状态：SOAP 参数与按元素集合缓存的 SOAP 对象
+_WORKER = {"rcut": 6.0, "center_elements": (), "soaps": {}, "groups": None}
+
+
+def _init_soap_worker(rcut, center_elements, groups=None):
+    # 参数不变时保留已构造的 SOAP 对象 (进程内 API 反复调用时不必重建)
+    same = (_WORKER["rcut"], _WORKER["center_elements"]) == (rcut, tuple(center_elements))
+    _WORKER.update(rcut=rcut, center_elements=tuple(center_elements),
+                   soaps=_WORKER["soaps"] if same else {}, groups=groups)
+
+
+def _get_soap(species, setting=None):
+    """
+    每个进程、每种元素集合 (与参数) 只构造一次 SOAP 对象 (dscribe 在此时才导入)
+    setting 为 (rcut, n_max, l_max)，缺省为 worker 的 rcut 与 n_max=8, l_max=6
+    """
+    from dscribe.descriptors import SOAP
+    rcut, nmax, lmax = setting or (_WORKER["rcut"], 8, 6)
+    key = (tuple(species), rcut, nmax, lmax)
+    if key not in _WORKER["soaps"]:
+        _WORKER["soaps"][key] = SOAP(species=list(species), r_cut=rcut, n_max=nmax, l_max=lmax,
+                                     average="inner", periodic=True)
+    return _WORKER["soaps"][key]
+
+
+def _describe_rows(args):
+    """
+    计算一批结构的描述符，一次写入缓存 .npy (mmap) 的 row_start 起的连续行，
+    返回 (key, row_start, 行数, 计算耗时, None)；out_file 为 None 时不写文件，
+    以描述符代替 None 返回 (打包的小组由主进程逐组一次写入)
+    members 为这些结构在组内的位置；atoms_chunk 为 None 时从 fork 继承的 groups 中取结构
+    """
+    out_file, key, species, row_start, members, atoms_chunk = args
+    t0 = time.perf_counter()
+    if atoms_chunk is None:
+        group_atoms = _WORKER["groups"][key]["atoms"]
+        atoms_chunk = [group_atoms[m] for m in members]
+    soap = _get_soap(species)
+    centers = _WORKER["center_elements"]
+    block = np.array([soap.create(atoms, [i for i, s in enumerate(atoms.get_chemical_symbols())
+                                          if s in centers])
+                      for atoms in atoms_chunk], dtype=np.float32).reshape(len(atoms_chunk), -1)
+    if out_file is None:
+        return key, row_start, len(members), time.perf_counter() - t0, block
+    out = np.load(out_file, mmap_mode="r+")
+    out[row_start:row_start + len(block)] = block
+    out.flush()
+    del out
+    return key, row_start, len(members), time.perf_counter() - t0, None
+
+
+def _describe_segments(segments):
+    """
+    一个工作单元：一个或多个 (同一或不同组的) _describe_rows 任务，依次计算，
+    返回各段的结果列表；worker 中按元素集合缓存的 SOAP 对象跨组复用
+    """
+    return [_describe_rows(seg) for seg in segments]
+
+
+def pack_segments(segments, unit_rows):
+    """
+    把许多小组的任务打包为工作单元 (每个单元约 unit_rows 个结构)：按元素集合排序，
+    同一单元内的组尽量使用相同的 SOAP 对象；单个组不拆分
+    """
+    units, current, n_rows = [], [], 0
+    for seg in sorted(segments, key=lambda seg: (tuple(seg[2]), seg[1])):
+        if current and n_rows + len(seg[4]) > unit_rows:
+            units.append(current)
+            current, n_rows = [], 0
+        current.append(seg)
+        n_rows += len(seg[4])
+    if current:
+        units.append(current)
+    return units
+
+
+def load_row_hashes(cache_dir, tag, key):
+    """已提交的缓存行的内容摘要；SOAP 文件中超出这部分的行视为未完成的写入"""
+    hash_file = f"{cache_dir}/HASH_{tag}_{key}.npy"
+    if os.path.exists(hash_file) and os.path.exists(f"{cache_dir}/SOAP_{tag}_{key}.npy"):
+        return np.load(hash_file)
+    return np.empty(0, dtype=np.uint64)
+
+
+def _open_cache(symbols_str, cache_dir, tag, arrays=None, n_rows=0):
+    """
+    组的缓存 .npy (mmap)；arrays 不为 None 时 ({(组名, tag): mmap}) 复用已打开的，
+    行数少于 n_rows (之后又追加了新结构) 时重新打开并存入
+    """
+    path = f"{cache_dir}/SOAP_{tag}_{symbols_str}.npy"
+    if arrays is None:
+        return np.load(path, mmap_mode="r")
+    soap = arrays.get((symbols_str, tag))
+    if soap is None or soap.shape[0] < n_rows:
+        soap = arrays[(symbols_str, tag)] = np.load(path, mmap_mode="r")
+    return soap
+
+
+def load_cache_with_label(symbols_str, cache_dir, tag, arrays=None):
+    """
+    读取组的缓存：返回按组内顺序排列的描述符 (mmap 上的行视图)、缓存行号与标签
+    tag 为 soap_param_hash(rcut, centers=...)，须与建缓存时的参数一致
+    arrays 为跨调用复用的已打开缓存 (见 _open_cache)
+    """
+    idx = np.load(f"{cache_dir}/INDEX_{tag}_{symbols_str}.npy")
+    has_label = np.load(f"{cache_dir}/HAS_LABEL_{tag}_{symbols_str}.npy")
+    soap = _open_cache(symbols_str, cache_dir, tag, arrays, int(idx.max()) + 1 if len(idx) else 0)
+    return take_rows(soap, idx), idx, has_label
+
+
+def load_cache_rows(symbols_str, cache_dir, tag, rows, arrays=None):
+    """按缓存行号读取描述符 (mmap 上的行视图)，用于种子等不在当前组内的结构"""
+    rows = np.asarray(rows, dtype=np.int64)
+    soap = _open_cache(symbols_str, cache_dir, tag, arrays, int(rows.max()) + 1 if len(rows) else 0)
+    return take_rows(soap, rows)
+
+
+def save_group_index(cache_dir, tag, key, rows, has_label):
+    """组内每个结构对应的缓存行 (INDEX) 与标签 (HAS_LABEL)"""
+    np.save(f"{cache_dir}/INDEX_{tag}_{key}.npy", np.asarray(rows, dtype=np.int64))
+    np.save(f"{cache_dir}/HAS_LABEL_{tag}_{key}.npy", np.asarray(has_label, dtype=bool))
+
+
+def commit_rows(cache_dir, tag, key, row_hashes):
+    """
+    写出 HASH (提交记录)：SOAP 文件的前 len(row_hashes) 行视为已完成
+    先写临时文件再原子替换，中断时不会留下损坏的记录
+    """
+    hash_file = f"{cache_dir}/HASH_{tag}_{key}.npy"
+    tmp_file = f"{cache_dir}/HASH_{tag}_{key}.tmp.npy"
+    np.save(tmp_file, np.asarray(row_hashes, dtype=np.uint64))
+    os.replace(tmp_file, hash_file)
+
+
+def _finalize_group(cache_dir, tag, key, row_hashes, rows, has_label, write_index=True):
+    """
+    写出组的缓存元数据：HASH 最后写入，作为新增行的提交记录
+    INDEX 为组内每个结构对应的缓存行，HAS_LABEL 为其标签 (write_index=False 时不写)
+    """
+    if write_index:
+        save_group_index(cache_dir, tag, key, rows, has_label)
+    commit_rows(cache_dir, tag, key, row_hashes)
+
+
+def build_caches(groups, cache_dir, nproc, center_elements, rcut=6.0, max_chunk=256, stats=None,
+                 write_index=True, commit_every=60.0, pool=None):
+    """
+    为所有组计算 SOAP 缓存，整个过程复用同一个进程池
+    缓存按结构内容寻址：每行记录结构摘要 (HASH)，已算过的结构直接复用，
+    新结构追加到已有 .npy 末尾，由 worker 直接写入 (mmap)，内存占用与数据量无关
+    小组 (< nproc * 4 个新结构) 按元素集合排序后打包为共享的工作单元并行计算 (见 pack_segments)，
+    其描述符返回主进程，每组一次追加写入 (不预先扩展文件)；全部新结构都很少时在主进程中串行计算；
+    nproc == 1 且没有给出 pool 时全部在主进程中计算，不创建进程池
+    stats 不为 None 时写入每个组的缓存命中/未命中数与描述符计算耗时 (各 worker 耗时之和)
+    write_index=False 时只补全缓存行 (group["rows"])，不改写该组的 INDEX/HAS_LABEL (用于种子结构)
+    已完成的连续行至少每 commit_every 秒提交一次 (HASH)，中断后重新运行只计算未提交的结构
+    pool 为已有的进程池 (worker 须以相同参数调用过 _init_soap_worker)，此时结构随任务发送
+    """
+    stats = {} if stats is None else stats
+    tag = soap_param_hash(rcut, centers=center_elements)
+    _init_soap_worker(rcut, center_elements)
+    in_process = pool is None and nproc == 1
+    use_fork = pool is None and not in_process and get_start_method() == "fork"
+
+    tasks, small, pending = [], [], {}
+    n_reused, n_computed = 0, 0
+    for key in sorted(groups.keys()):
+        group = groups[key]
+        soap_file = f"{cache_dir}/SOAP_{tag}_{key}.npy"
+        hashes = np.array([frame_hash(a) for a in group["atoms"]], dtype=np.uint64)
+        cached = load_row_hashes(cache_dir, tag, key)
+        rows, new_members = match_rows(hashes, cached)
+        group["rows"] = rows
+        n_old, n_new = len(cached), len(new_members)
+        row_hashes = np.concatenate([cached, hashes[new_members]])
+        n_reused += len(hashes) - n_new
+        n_computed += n_new
+        stats[key] = {"hits": len(hashes) - n_new, "misses": n_new, "compute_s": 0.0}
+
+        if n_new == 0:
+            _finalize_group(cache_dir, tag, key, row_hashes, rows, group["has_label"],
+                            write_index)
+            continue
+
+        species = group["species"]
+        pending[key] = (n_old, n_new, row_hashes, rows)
+        if n_new < nproc * 4:
+            atoms_chunk = None if use_fork else [group["atoms"][m] for m in new_members]
+            small.append((None, key, species, n_old, new_members, atoms_chunk))
+            continue
+
+        if n_old == 0:
+            n_features = _get_soap(species).get_number_of_features()
+            np.lib.format.open_memmap(soap_file, mode="w+", dtype=np.float32,
+                                      shape=(n_new, n_features)).flush()
+        else:
+            resize_npy_rows(soap_file, n_old + n_new)
+
+        chunk_size = max(1, min(max_chunk, -(-n_new // nproc)))
+        for start in range(0, n_new, chunk_size):
+            members = new_members[start:start + chunk_size]
+            atoms_chunk = None if use_fork else [group["atoms"][m] for m in members]
+            tasks.append([(soap_file, key, species, n_old + start, members, atoms_chunk)])
+
+    def store_block(key, block):
+        """小组的全部新行：截去未提交的行后一次追加 (组不拆分，块即该组的全部新结构)"""
+        out = NpyAppender(f"{cache_dir}/SOAP_{tag}_{key}.npy", block.shape[1],
+                          start_row=pending[key][0] or None)
+        out.append(block)
+        out.close()
+
+    n_small = sum(len(seg[4]) for seg in small)
+    if small and (tasks or n_small >= nproc * 4):
+        tasks += pack_segments(small, max(1, min(max_chunk, -(-n_small // (nproc * 4)))))
+    else:
+        # 新结构很少：不值得启动进程池
+        for seg in small:
+            key = seg[1]
+            group = groups[key]
+            atoms_chunk = [group["atoms"][m] for m in seg[4]]
+            _, _, _, seconds, block = _describe_rows(seg[:5] + (atoms_chunk,))
+            stats[key]["compute_s"] += seconds
+            store_block(key, block)
+            _finalize_group(cache_dir, tag, key, pending[key][2], pending[key][3],
+                            group["has_label"], write_index)
+            del pending[key]
+
+    print(f"[CACHE] {n_computed} structures to compute, {n_reused} reused from cache (tag {tag})"
+          + (f"; {len(small)} small groups in shared work units" if small and tasks else ""))
+    if not tasks:
         return
 
-    soap = SOAP(species=symbols, r_cut=rcut, n_max=8, l_max=6,
-                average="inner", periodic=True)
+    # 各组已完成的块 (起始行 -> 行数) 与从头连续完成的行数
+    finished = {key: {} for key in pending}
+    prefix = {key: pending[key][0] for key in pending}
+    committed = dict(prefix)
+    last_commit = time.perf_counter()
+    if pool is None and not in_process:
+        pool_ctx = Pool(nproc, initializer=_init_soap_worker,
+                        initargs=(rcut, center_elements, groups if use_fork else None))
+    else:
+        pool_ctx = contextlib.nullcontext(pool)
+    with pool_ctx as pool:
+        results = (map(_describe_segments, tasks) if in_process
+                   else pool.imap_unordered(_describe_segments, tasks))
+        for done in tqdm(results, total=len(tasks), desc="SOAP chunks"):
+            for key, row_start, n_rows, seconds, block in done:
+                stats[key]["compute_s"] += seconds
+                if block is not None:
+                    store_block(key, block)
+                n_old, n_new, row_hashes, rows = pending[key]
+                finished[key][row_start] = n_rows
+                while prefix[key] in finished[key]:
+                    prefix[key] += finished[key].pop(prefix[key])
+                if prefix[key] == n_old + n_new:
+                    _finalize_group(cache_dir, tag, key, row_hashes, rows,
+                                    groups[key]["has_label"], write_index)
+                    committed[key] = prefix[key]
+            if time.perf_counter() - last_commit >= commit_every:
+                for k in pending:
+                    if committed[k] < prefix[k] < pending[k][0] + pending[k][1]:
+                        commit_rows(cache_dir, tag, k, pending[k][2][:prefix[k]])
+                        committed[k] = prefix[k]
+                last_commit = time.perf_counter()
+
+
+def _describe_sweep_rows(args):
+    """
+    一批结构在多组 SOAP 参数下的描述符：每帧只取一次 (中心原子也只确定一次)，依次计算各参数并写入
+    各自缓存 .npy 的对应行；targets 为 [(setting, 缓存文件, 批内位置, 行号)]
+    返回 (key, 结构数, 计算耗时)
+    """
+    key, species, members, atoms_chunk, targets = args
+    t0 = time.perf_counter()
+    if atoms_chunk is None:
+        group_atoms = _WORKER["groups"][key]["atoms"]
+        atoms_chunk = [group_atoms[m] for m in members]
+    centers = _WORKER["center_elements"]
+    outs = [np.load(out_file, mmap_mode="r+") for _, out_file, _, _ in targets]
+    rows_at = [dict(zip(pos.tolist(), rows.tolist())) for _, _, pos, rows in targets]
+    for j, atoms in enumerate(atoms_chunk):
+        center_idx = [i for i, s in enumerate(atoms.get_chemical_symbols()) if s in centers]
+        for (setting, _, _, _), out, rows in zip(targets, outs, rows_at):
+            if j in rows:
+                out[rows[j]] = _get_soap(species, setting).create(atoms, center_idx)
+    for out in outs:
+        out.flush()
+    del outs
+    return key, len(members), time.perf_counter() - t0
+
+
+def build_sweep_caches(groups, cache_dir, nproc, center_elements, settings, max_chunk=256,
+                       stats=None):
+    """
+    同一次分组结果在多组 SOAP 参数 settings [(rcut, n_max, l_max)] 下的缓存，
+    各自按 soap_param_hash 寻址 (与单参数运行共用缓存)；任一参数缺少的结构只在一个任务中
+    计算其缺少的全部参数，结构只传给 worker 一次
+    返回各参数的 tag；stats 不为 None 时写入 {tag: {key: hits/misses}}
+    每个组全部完成后才提交 (中断后重新运行时，未提交的组重新计算)
+    """
+    stats = {} if stats is None else stats
+    tags = [soap_param_hash(rcut, nmax, lmax, centers=center_elements)
+            for rcut, nmax, lmax in settings]
+    _init_soap_worker(settings[0][0], center_elements)
+    use_fork = get_start_method() == "fork"
+
+    tasks, pending = [], {}
+    n_computed = 0
+    for key in sorted(groups.keys()):
+        group = groups[key]
+        species = group["species"]
+        hashes = np.array([frame_hash(a) for a in group["atoms"]], dtype=np.uint64)
+        need = np.zeros(len(hashes), dtype=bool)
+        plan = []
+        for setting, tag in zip(settings, tags):
+            soap_file = f"{cache_dir}/SOAP_{tag}_{key}.npy"
+            cached = load_row_hashes(cache_dir, tag, key)
+            rows, new_members = match_rows(hashes, cached)
+            n_old, n_new = len(cached), len(new_members)
+            stats.setdefault(tag, {})[key] = {"hits": len(hashes) - n_new, "misses": n_new}
+            row_of = np.full(len(hashes), -1, dtype=np.int64)
+            row_of[new_members] = n_old + np.arange(n_new)
+            need[new_members] = True
+            if n_new and n_old == 0:
+                n_features = _get_soap(species, setting).get_number_of_features()
+                np.lib.format.open_memmap(soap_file, mode="w+", dtype=np.float32,
+                                          shape=(n_new, n_features)).flush()
+            elif n_new:
+                resize_npy_rows(soap_file, n_old + n_new)
+            plan.append((setting, tag, soap_file, row_of,
+                         np.concatenate([cached, hashes[new_members]]), rows))
+
+        union = np.flatnonzero(need)
+        n_computed += len(union)
+        chunk_size = max(1, min(max_chunk, -(-len(union) // nproc)))
+        n_chunks = 0
+        for start in range(0, len(union), chunk_size):
+            members = union[start:start + chunk_size]
+            targets = []
+            for setting, _, soap_file, row_of, _, _ in plan:
+                r = row_of[members]
+                if (r >= 0).any():
+                    targets.append((setting, soap_file, np.flatnonzero(r >= 0), r[r >= 0]))
+            atoms_chunk = None if use_fork else [group["atoms"][m] for m in members]
+            tasks.append((key, species, members, atoms_chunk, targets))
+            n_chunks += 1
+        pending[key] = [n_chunks, plan]
+        if n_chunks == 0:
+            _finalize_sweep_group(cache_dir, key, group, plan)
+
+    print(f"[SWEEP] {n_computed} structures to describe with {len(settings)} settings")
+    if tasks:
+        with Pool(nproc, initializer=_init_soap_worker,
+                  initargs=(settings[0][0], center_elements, groups if use_fork else None)) as pool:
+            for key, _, _ in tqdm(pool.imap_unordered(_describe_sweep_rows, tasks),
+                                  total=len(tasks), desc="SOAP sweep chunks"):
+                pending[key][0] -= 1
+                if pending[key][0] == 0:
+                    _finalize_sweep_group(cache_dir, key, groups[key], pending[key][1])
+    return tags
+
+
+def _finalize_sweep_group(cache_dir, key, group, plan):
+    for _, tag, _, _, row_hashes, rows in plan:
+        _finalize_group(cache_dir, tag, key, row_hashes, rows, group["has_label"])
+
+
+def build_cache(group, cache_dir, nproc, center_elements, rcut=6.0):
+    """单个组的缓存 (见 build_caches)"""
+    key = composition_key(group["atoms"][0].numbers)
+    build_caches({key: group}, cache_dir, nproc, center_elements, rcut)
 
-    centers_list = [[i for i, a in enumerate(atoms) if a.symbol in center_elements]
-                    for atoms in atoms_list]
 
-    N = len(atoms_list)
-    descs = []
+def _describe_batch(args):
+    """计算一批结构的描述符并返回 (float32 数组)，用于流式模式"""
+    species, atoms_list = args
+    soap = _get_soap(species)
+    centers = _WORKER["center_elements"]
+    return np.array([soap.create(atoms, [i for i, s in enumerate(atoms.get_chemical_symbols())
+                                         if s in centers])
+                     for atoms in atoms_list], dtype=np.float32)
 
-    if N < nproc * 4:
-        for atoms, centers in zip(atoms_list, centers_list):
-            descs.append(soap.create(atoms, centers))
+
+def stream_structures(frames, center_elements, cache_dir, nproc, rcut=6.0, batch_size=512,
+                      filter_opts=None, stats=None, cache_stats=None, commit_every=60.0,
+                      pool=None, on_group_done=None):
+    """
+    流式分组 + 描述符计算：frames 逐帧产出 (file_id, offset, length, atoms)，
+    每帧只保留紧凑记录 (来源文件、字节偏移、长度) 以及组内的全局序号、标签和缓存行号，
+    缓存中没有的结构按组缓冲，满 batch_size 即交给进程池计算，描述符按顺序追加写入 .npy
+    返回 (groups, records)，groups 中不含 atoms；stats 不为 None 时写入过滤计数，
+    cache_stats 不为 None 时写入每个组的缓存命中/未命中数
+    峰值内存由 batch_size 决定，与数据集大小无关；已写入的行至少每 commit_every 秒提交一次；
+    同时打开的写入器不超过 MAX_OPEN_WRITERS 个，最久未写的先关闭，再次写入时从已写的行之后续写
+    pool 为已有的进程池 (worker 须以相同参数调用过 _init_soap_worker)；
+    on_group_done(key, groups) 在读取结束后、每个组的缓存全部写完 (INDEX/HASH 已提交) 时调用，
+    此时其他组可能仍在计算；已知描述符维度的组 (已有缓存或已写入一批) 记录在 group["n_dim"]
+    """
+    tag = soap_param_hash(rcut, centers=center_elements)
+    records = {"file": array("i"), "offset": array("q"), "length": array("q")}
+    groups, state, buffers, writers = {}, {}, {}, OrderedDict()
+    in_flight = deque()
+    n_pending = {}         # 每个组已提交、尚未写入的批次数
+    reading = [True]
+    counts = {}
+    max_buffered = batch_size * 4
+    last_commit = [time.perf_counter()]
+    _init_soap_worker(rcut, center_elements)
+
+    def commit():
+        """提交各组已写入的行：先改写 .npy 头并落盘，再写 HASH"""
+        for writer in writers.values():
+            writer.flush()
+        for key, st in state.items():
+            if st["done"] or st["n_file"] == st["n_committed"]:
+                continue
+            n_written = st["n_file"] - st["n_old"]
+            new_hashes = np.fromiter(st["new_rows"], dtype=np.uint64, count=n_written)
+            commit_rows(cache_dir, tag, key, np.concatenate([st["cached"], new_hashes]))
+            st["n_committed"] = st["n_file"]
+        last_commit[0] = time.perf_counter()
+
+    def write(key, rows):
+        """追加写入组的缓存；写入器按最近使用排序，超过上限时关闭最久未写的 (已落盘，可续写)"""
+        if key in writers:
+            writers.move_to_end(key)
+        else:
+            if len(writers) >= MAX_OPEN_WRITERS:
+                _, old = writers.popitem(last=False)
+                old.flush()
+                old.close()
+            writers[key] = NpyAppender(f"{cache_dir}/SOAP_{tag}_{key}.npy", rows.shape[1],
+                                       start_row=state[key]["n_file"] or None)
+        writers[key].append(rows)
+        state[key]["n_file"] = writers[key].n_rows
+        groups[key]["n_dim"] = rows.shape[1]
+
+    def finalize(key):
+        """组的全部结构都已写入：关闭写入器并提交"""
+        if key in writers:
+            writers.pop(key).close()
+        st, group = state[key], groups[key]
+        st["done"] = True
+        if cache_stats is not None:
+            cache_stats[key] = {"hits": len(group["rows"]) - len(st["new_rows"]),
+                                "misses": len(st["new_rows"])}
+        row_hashes = np.concatenate([st["cached"], np.array(list(st["new_rows"]), dtype=np.uint64)])
+        _finalize_group(cache_dir, tag, key, row_hashes, group["rows"], group["has_label"])
+        if on_group_done is not None:
+            on_group_done(key, groups)
+
+    def drain(limit):
+        while len(in_flight) > limit:
+            key, res = in_flight.popleft()
+            write(key, res.get())
+            n_pending[key] -= 1
+            if not reading[0] and n_pending[key] == 0 and key not in buffers:
+                finalize(key)
+        if time.perf_counter() - last_commit[0] >= commit_every:
+            commit()
+
+    def flush(key):
+        atoms_list = buffers.pop(key)
+        species = groups[key]["species"]
+        n_pending[key] = n_pending.get(key, 0) + 1
+        in_flight.append((key, pool.apply_async(_describe_batch, ((species, atoms_list),))))
+        drain(nproc * 2)
+
+    def lookup(key, h):
+        """结构摘要对应的缓存行号，以及是否需要新计算"""
+        st = state[key]
+        pos = np.searchsorted(st["sorted"], h)
+        if pos < len(st["sorted"]) and st["sorted"][pos] == h:
+            return int(st["order"][pos]), False
+        if h in st["new_rows"]:
+            return st["new_rows"][h], False
+        row = st["n_old"] + len(st["new_rows"])
+        st["new_rows"][h] = row
+        return row, True
+
+    if pool is None:
+        pool_ctx = Pool(nproc, initializer=_init_soap_worker, initargs=(rcut, center_elements))
     else:
-        chunk_size = max(1, N // nproc)
-        for start in range(0, N, chunk_size):
-            end = min(start + chunk_size, N)
-            chunk_atoms = atoms_list[start:end]
-            chunk_centers = centers_list[start:end]
-            with Pool(nproc) as p:
-                chunk_descs = p.starmap(soap.create, zip(chunk_atoms, chunk_centers))
-            descs.extend(chunk_descs)
+        pool_ctx = contextlib.nullcontext(pool)
+    with pool_ctx as pool:
+        n_buffered, idx = 0, 0
+        for file_id, offset, length, atoms in tqdm(frames, desc="Streaming frames"):
+            res = classify_frame(atoms, filter_opts, counts)
+            if res is None:
+                continue
+            key, has_label = res
+
+            records["file"].append(file_id)
+            records["offset"].append(offset)
+            records["length"].append(length)
 
-    np.save(soap_file, np.array(descs, dtype=np.float32))
-    np.save(f"{cache_dir}/INDEX_{symbols_str}.npy", np.array(indices, dtype=np.int32))
+            if key not in groups:
+                groups[key] = {
+                    "species": sorted(set(atoms.get_chemical_symbols())),
+                    "indices": array("q"),
+                    "has_label": array("b"),
+                    "rows": array("q"),
+                }
+                cached = load_row_hashes(cache_dir, tag, key)
+                if len(cached):
+                    groups[key]["n_dim"] = np.load(f"{cache_dir}/SOAP_{tag}_{key}.npy",
+                                                   mmap_mode="r").shape[1]
+                order = np.argsort(cached, kind="stable")
+                state[key] = {"cached": cached, "order": order, "sorted": cached[order],
+                              "n_old": len(cached), "n_file": len(cached),
+                              "n_committed": len(cached), "new_rows": {}, "done": False}
+            row, is_new = lookup(key, frame_hash(atoms))
+            groups[key]["indices"].append(idx)
+            groups[key]["has_label"].append(has_label)
+            groups[key]["rows"].append(row)
+            idx += 1
 
-    np.save(f"{cache_dir}/HAS_LABEL_{symbols_str}.npy", np.array(group["has_label"], dtype=bool))
+            if not is_new:
+                continue
+            buffers.setdefault(key, []).append(atoms)
+            n_buffered += 1
+            if len(buffers[key]) >= batch_size:
+                n_buffered -= len(buffers[key])
+                flush(key)
+            elif n_buffered >= max_buffered:
+                # 组太多时先提交缓冲最多的组，保证总缓冲量有上限
+                largest = max(buffers, key=lambda k: len(buffers[k]))
+                n_buffered -= len(buffers[largest])
+                flush(largest)
 
+        # 读取结束：之后每个组的最后一批写完即提交该组
+        reading[0] = False
+        for key in list(buffers):
+            flush(key)
+        for key in groups:
+            if n_pending.get(key, 0) == 0 and not state[key]["done"]:
+                finalize(key)
+        drain(0)
 
+    n_computed = sum(len(st["new_rows"]) for st in state.values())
 
+    if counts:
+        report_filter(counts)
+    if stats is not None:
+        stats.update(counts)
+    print(f"[STREAM] {len(records['file'])} structures kept in {len(groups)} groups, "
+          f"{n_computed} descriptors computed")
+    return groups, records
@@ -0,0 +1,174 @@
+import os
+import json
+import struct
+import numpy as np
+from .soap import load_cache_with_label
+
+# =========================================================
+# 合并存储：一次运行的所有组放在一个可 mmap 的文件中
+# 布局: MAGIC | uint64 目录长度 | JSON 目录 | 对齐到 64 字节的各数据段
+# 每个组一个描述符块 (float32 / float16 / int8)，逐行的范数、缩放因子与标签为全局数组
+# =========================================================
+MAGIC = b"COSOAPST"
+ALIGN = 64
+STORE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+OUTPUT_NAMES = ("train_labeled", "train_unlabeled", "test_labeled", "test_unlabeled")
+
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+class QuantizedRows:
+    """
+    量化描述符的只读视图：按行切片时反量化为 float32
+    norms 为量化前的行范数 (normalize_rows 直接使用，不再从量化值重新计算)
+    """
+    def __init__(self, data, scale=None, norms=None):
+        self.data, self.scale, self.norms = data, scale, norms
+        self.shape = data.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        out = np.asarray(self.data[item], dtype=np.float32)
+        if self.scale is not None:
+            s = self.scale[item]
+            out *= s[..., None] if np.ndim(s) else s
+        return out
+
+
+def store_path(cache_dir, tag, dtype):
+    return f"{cache_dir}/STORE_{tag}_{dtype}.bin"
+
+
+def pack_store(groups, cache_dir, tag, dtype="float16", chunk_rows=65536):
+    """
+    把各组的 float32 缓存合并为一个存储文件 (按组内顺序)，可选 float16 / int8 量化
+    int8 为逐行对称量化: q = round(x / s)，s = max|x| / 127
+    返回存储文件路径
+    """
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"Unknown store dtype: {dtype}")
+    data_dtype = np.dtype(STORE_DTYPES[dtype])
+    path = store_path(cache_dir, tag, dtype)
+    keys = sorted(groups)
+    sources = {k: load_cache_with_label(k, cache_dir, tag) for k in keys}
+
+    # 目录：各段相对数据区起点的偏移
+    directory = {"version": 1, "tag": tag, "dtype": dtype, "groups": {}}
+    offset, row_start = 0, 0
+    for k in keys:
+        n_rows, n_dim = sources[k][0].shape
+        directory["groups"][k] = {"offset": offset, "row_start": row_start,
+                                  "n_rows": n_rows, "n_dim": n_dim}
+        offset = _align(offset + n_rows * n_dim * data_dtype.itemsize)
+        row_start += n_rows
+    n_total = row_start
+    sections = {}
+    for name, itemsize in (("norms", 4), ("scale", 4), ("has_label", 1)):
+        if name == "scale" and dtype != "int8":
+            continue
+        sections[name] = offset
+        offset = _align(offset + n_total * itemsize)
+    directory["sections"] = sections
+    directory["n_rows"] = n_total
+
+    blob = json.dumps(directory).encode()
+    base = _align(len(MAGIC) + 8 + len(blob))
+    directory_bytes = MAGIC + struct.pack("<Q", len(blob)) + blob
+
+    norms = np.empty(n_total, dtype=np.float32)
+    scale = np.ones(n_total, dtype=np.float32)
+    has_label = np.empty(n_total, dtype=bool)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(directory_bytes.ljust(base, b"\0"))
+        for k in keys:
+            soap, _, labels = sources[k]
+            info = directory["groups"][k]
+            f.seek(base + info["offset"])
+            r0 = info["row_start"]
+            has_label[r0:r0 + info["n_rows"]] = labels
+            for start in range(0, info["n_rows"], chunk_rows):
+                blk = np.asarray(soap[start:start + chunk_rows], dtype=np.float32)
+                rows = slice(r0 + start, r0 + start + len(blk))
+                norms[rows] = np.linalg.norm(blk, axis=1)
+                if dtype == "int8":
+                    s = np.abs(blk).max(axis=1) / 127.0
+                    s[s == 0] = 1.0
+                    scale[rows] = s
+                    blk = np.rint(blk / s[:, None])
+                f.write(blk.astype(data_dtype).tobytes())
+        for name, arr in (("norms", norms), ("scale", scale), ("has_label", has_label)):
+            if name in sections:
+                f.seek(base + sections[name])
+                f.write(arr.tobytes())
+        f.truncate(base + offset)
+    os.replace(tmp_path, path)
+
+    size_f32 = sum(g["n_rows"] * g["n_dim"] * 4 for g in directory["groups"].values())
+    print(f"[STORE] {len(keys)} groups, {n_total} rows -> {path} "
+          f"({os.path.getsize(path) / 2**20:.1f} MiB, float32 descriptors {size_f32 / 2**20:.1f} MiB)")
+    return path
+
+
+class DescriptorStore:
+    """合并存储的只读访问，数据段按需 mmap"""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a COSOAP descriptor store: {path}")
+            n = struct.unpack("<Q", f.read(8))[0]
+            self.directory = json.loads(f.read(n))
+        self.path = path
+        self.base = _align(len(MAGIC) + 8 + n)
+        self.dtype = np.dtype(STORE_DTYPES[self.directory["dtype"]])
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def keys(self):
+        return list(self.directory["groups"])
+
+    def _section(self, offset, dtype, count):
+        start = self.base + offset
+        return self._mm[start:start + count * np.dtype(dtype).itemsize].view(dtype)
+
+    def group(self, key):
+        """返回 (描述符视图, 行号, 标签)，与 load_cache_with_label 一致"""
+        info = self.directory["groups"][key]
+        sections = self.directory["sections"]
+        rows = slice(info["row_start"], info["row_start"] + info["n_rows"])
+        n_total = self.directory["n_rows"]
+        data = self._section(info["offset"], self.dtype, info["n_rows"] * info["n_dim"])
+        data = data.reshape(info["n_rows"], info["n_dim"])
+        norms = self._section(sections["norms"], np.float32, n_total)[rows]
+        scale = self._section(sections["scale"], np.float32, n_total)[rows] \
+            if "scale" in sections else None
+        has_label = self._section(sections["has_label"], bool, n_total)[rows]
+        return (QuantizedRows(data, scale, norms), np.arange(info["n_rows"]),
+                np.array(has_label))
+
+
+def selection_diff(ref, res):
+    """两次筛选结果 (四个序号列表) 的差异：各列表的数量、交集与 Jaccard 系数"""
+    diff = {}
+    pairs = list(zip(OUTPUT_NAMES, ref, res))
+    pairs.append(("train_all", list(ref[0]) + list(ref[1]), list(res[0]) + list(res[1])))
+    for name, a, b in pairs:
+        a, b = set(a), set(b)
+        union = len(a | b)
+        diff[name] = {"ref": len(a), "new": len(b), "common": len(a & b),
+                      "jaccard": len(a & b) / union if union else 1.0}
+    return diff
+
+
+def report_selection_diff(ref, res, label="quantized"):
+    """打印量化存储与 float32 描述符的筛选差异，并返回 selection_diff 的结果"""
+    diff = selection_diff(ref, res)
+    print(f"[STORE] Selection difference, float32 vs {label}:")
+    for name, d in diff.items():
+        print(f"  - {name:<16}: {d['ref']:>8} -> {d['new']:>8}, common {d['common']:>8}, "
+              f"jaccard {d['jaccard']:.4f}")
+    return diff
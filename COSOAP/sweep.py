@@ -0,0 +1,126 @@
+import json
+import time
+import numpy as np
+from .soap import build_sweep_caches, load_cache_with_label
+from .dedup import run_deduplication, allocate_fps, nearest_distances
+
+# =========================================================
+# 参数扫描：同一次读取与分组，在多组 SOAP 参数 (rcut, n_max, l_max) 下分别计算缓存并筛选，
+# 比较各参数选出的训练集 (重合度与在彼此描述符空间中的覆盖半径)
+# =========================================================
+def parse_setting(spec):
+    """'rcut[:n_max[:l_max]]' -> (rcut, n_max, l_max)，缺省 n_max=8, l_max=6"""
+    parts = spec.split(":")
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"Bad sweep setting '{spec}', expected rcut[:n_max[:l_max]]")
+    defaults = ["8", "6"]
+    parts += defaults[len(parts) - 1:]
+    return float(parts[0]), int(parts[1]), int(parts[2])
+
+
+def setting_label(setting):
+    rcut, nmax, lmax = setting
+    return f"r{rcut:g} n{nmax} l{lmax}"
+
+
+def train_overlap(trains):
+    """各参数训练集两两的 Jaccard 系数"""
+    n = len(trains)
+    out = np.ones((n, n))
+    for a in range(n):
+        for b in range(a + 1, n):
+            union = len(trains[a] | trains[b])
+            out[a, b] = out[b, a] = len(trains[a] & trains[b]) / union if union else 1.0
+    return out
+
+
+def cross_coverage(groups, cache_dir, tags, trains, metric, n_sample=2000, seed=0):
+    """
+    覆盖矩阵：参数 a 的训练集在参数 b 的描述符空间中，各组随机 n_sample 行到该组已选结构的
+    最小距离，返回其平均值 mean[a, b] 与最大值 (覆盖半径) radius[a, b]；
+    某参数在组内没有选中结构时该组不计入
+    """
+    rng = np.random.default_rng(seed)
+    total = np.zeros((len(tags), len(tags)))
+    R = np.zeros((len(tags), len(tags)))
+    n_rows = 0
+    for key, g in groups.items():
+        indices = np.asarray(g["indices"], dtype=np.int64)
+        sample = np.sort(rng.choice(len(indices), min(n_sample, len(indices)), replace=False))
+        picked = [np.flatnonzero(np.isin(indices, list(t))) for t in trains]
+        if any(len(p) == 0 for p in picked):
+            continue
+        n_rows += len(sample)
+        for b, tag in enumerate(tags):
+            X = load_cache_with_label(key, cache_dir, tag)[0]
+            Xs = np.asarray(X[sample], dtype=np.float32)
+            for a, p in enumerate(picked):
+                sub = np.concatenate([Xs, np.asarray(X[p], dtype=np.float32)])
+                d = nearest_distances(sub, np.arange(len(sample), len(sub)), metric)[:len(sample)]
+                total[a, b] += d.sum()
+                R[a, b] = max(R[a, b], d.max(initial=0.0))
+    return total / max(n_rows, 1), R
+
+
+def _print_matrix(title, M, fmt):
+    n = M.shape[0]
+    print(title)
+    print("        " + "".join(f"{f'[{j}]':>10}" for j in range(n)))
+    for i in range(n):
+        print(f"  {f'[{i}]':<6}" + "".join(f"{M[i, j]:>10{fmt}}" for j in range(n)))
+
+
+def run_sweep(groups, cache_dir, nproc, center_elements, settings, mode, num=1000, simlT=0.005,
+              backend="exact", backend_opts=None, hier_opts=None, checkpoint_opts=None,
+              coverage_sample=2000, report_path="sweep_report.json", stats=None):
+    """
+    groups 为 split_structures 的结果 (带 atoms)；依次在每组参数下筛选并打印比较，
+    比较结果写入 report_path (JSON)，返回 {tag: 四个序号列表}
+    """
+    tags = build_sweep_caches(groups, cache_dir, nproc, center_elements, settings, stats=stats)
+    if mode == "fps":
+        allocate_fps(groups, num)
+    param = None if mode == "fps" else simlT
+
+    results, times = {}, {}
+    for setting, tag in zip(settings, tags):
+        print(f"[SWEEP] Selecting with {setting_label(setting)} (tag {tag})")
+        t0 = time.perf_counter()
+        results[tag] = run_deduplication(groups, cache_dir, tag, nproc, mode, param,
+                                         backend=backend, backend_opts=backend_opts,
+                                         hier_opts=hier_opts, checkpoint_opts=checkpoint_opts)
+        times[tag] = time.perf_counter() - t0
+
+    trains = [set(results[t][0]) | set(results[t][1]) for t in tags]
+    overlap = train_overlap(trains)
+    metric = "euclidean" if mode == "fps" else "cosine"
+    mean, R = cross_coverage(groups, cache_dir, tags, trains, metric, coverage_sample) \
+        if coverage_sample > 0 else (None, None)
+
+    print("[SWEEP] Settings:")
+    for i, (setting, tag) in enumerate(zip(settings, tags)):
+        res = results[tag]
+        print(f"  [{i}] {setting_label(setting):<16} tag {tag}: train {len(trains[i])} "
+              f"({len(res[0])} labeled), test {len(res[2]) + len(res[3])}, "
+              f"selection {times[tag]:.1f}s")
+    _print_matrix("[SWEEP] Train-set overlap (Jaccard):", overlap, ".3f")
+    if R is not None:
+        # 以每个空间自身参数的结果为 1，行为训练集、列为描述符空间；小于 1 表示覆盖更好
+        for name, M in (("Mean distance to train", mean), ("Coverage radius", R)):
+            rel = M / np.where(np.diag(M) > 0, np.diag(M), 1.0)[None, :]
+            _print_matrix(f"[SWEEP] {name} ({metric}) of each setting's train set (rows) in each "
+                          f"setting's descriptor space (columns), relative to the diagonal:",
+                          rel, ".3f")
+
+    report = {"mode": mode, "settings": [dict(zip(("rcut", "n_max", "l_max"), s), tag=t,
+                                              selection_s=times[t],
+                                              counts=[len(r) for r in results[t]])
+                                         for s, t in zip(settings, tags)],
+              "overlap_jaccard": overlap.tolist(),
+              "coverage_metric": metric,
+              "coverage_mean_distance": mean.tolist() if mean is not None else None,
+              "coverage_radius": R.tolist() if R is not None else None}
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[SWEEP] Comparison written to {report_path}")
+    return results
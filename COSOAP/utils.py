@@ -1,10 +1,61 @@
+import os
 import hashlib
+import struct
+import contextlib
 import numpy as np
 
-def soap_param_hash(rcut=6.0, nmax=8, lmax=6):
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # 可选依赖：未安装时不限制 BLAS 线程
+    threadpool_limits = None
+
+def soap_param_hash(rcut=6.0, nmax=8, lmax=6, centers=None):
     s = f"r{rcut}_n{nmax}_l{lmax}_inner_periodic"
+    if centers:
+        s += "_c" + "-".join(sorted(set(centers)))
     return hashlib.md5(s.encode()).hexdigest()[:8]
 
+def frame_hash(atoms):
+    """
+    结构内容摘要 (uint64)：原子序数、坐标、晶胞与周期性，即 SOAP 描述符依赖的全部输入
+    能量/力等标签不参与，标签变化不会使描述符缓存失效
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(np.ascontiguousarray(atoms.numbers, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(atoms.positions, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(atoms.cell.array, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(atoms.pbc, dtype=bool).tobytes())
+    return np.uint64(int.from_bytes(h.digest(), "little"))
+
+def match_rows(hashes, cached_hashes):
+    """
+    按内容摘要把每个结构对应到缓存行：命中的取已有行号，
+    未命中的 (去重后按首次出现顺序) 依次分配到缓存末尾之后
+    返回 (rows, new_members)，new_members 为需要新计算的结构在 hashes 中的位置
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    cached_hashes = np.asarray(cached_hashes, dtype=np.uint64)
+    rows = np.empty(len(hashes), dtype=np.int64)
+
+    order = np.argsort(cached_hashes, kind="stable")
+    pos = np.searchsorted(cached_hashes[order], hashes).clip(0, max(len(order) - 1, 0))
+    hit = cached_hashes[order][pos] == hashes if len(order) else np.zeros(len(hashes), dtype=bool)
+    rows[hit] = order[pos[hit]]
+
+    miss = np.flatnonzero(~hit)
+    _, first, inverse = np.unique(hashes[miss], return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+    rows[miss] = len(cached_hashes) + rank[inverse]
+    new_members = miss[np.sort(first)]
+    return rows, new_members
+
+def file_signature(path):
+    """文件的 (绝对路径, 大小, 修改时间) 摘要，用于判断缓存是否过期"""
+    st = os.stat(path)
+    s = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.md5(s.encode()).hexdigest()[:12]
+
 def get_Kpts(cell, Rk=25):
     """Estimate k-point density"""
     if np.linalg.det(cell) == 0:
@@ -13,4 +64,204 @@ def get_Kpts(cell, Rk=25):
     n1 = max(1, int(Rk * np.linalg.norm(np.cross(cell[1], cell[2]) / tmp_0) + 0.5))
     n2 = max(1, int(Rk * np.linalg.norm(np.cross(cell[2], cell[0]) / tmp_0) + 0.5))
     n3 = max(1, int(Rk * np.linalg.norm(np.cross(cell[0], cell[1]) / tmp_0) + 0.5))
-    return n1 * n2 * n3
\ No newline at end of file
+    return n1 * n2 * n3
+
+def get_Kpts_batch(cells, Rk=25):
+    """
+    get_Kpts 的向量化版本：cells 形状 (N, 3, 3)，返回 (N,) 的 k 点数
+    每个方向的 k 点数截断在 10^6 以内 (近奇异的 cell 不会溢出 int64)
+    """
+    cells = np.asarray(cells, dtype=np.float64).reshape(-1, 3, 3)
+    c0, c1, c2 = cells[:, 0], cells[:, 1], cells[:, 2]
+    crosses = np.stack([np.cross(c1, c2), np.cross(c2, c0), np.cross(c0, c1)], axis=1)
+    vol = np.einsum("ij,ij->i", c0, crosses[:, 0])
+    singular = np.linalg.det(cells) == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = np.trunc(Rk * np.linalg.norm(crosses, axis=2) / np.abs(vol)[:, None] + 0.5)
+    n = np.clip(np.nan_to_num(n, nan=1, posinf=1e6), 1, 1e6).astype(np.int64)
+    return np.where(singular, 1000, n.prod(axis=1))
+
+def normalize_rows(soap, chunk_rows=65536):
+    """
+    一次性归一化 SOAP 矩阵 (float32)，按行分块读取以兼容 mmap 缓存
+    零向量保持为零 (与原始 dot / (norm * norm + 1e-12) 的结果一致)
+    soap 带有 norms 属性 (量化存储保存的原始行范数) 时直接使用
+    """
+    N = soap.shape[0]
+    stored_norms = getattr(soap, "norms", None)
+    out = np.empty(soap.shape, dtype=np.float32)
+    for start in range(0, N, chunk_rows):
+        blk = np.asarray(soap[start:start + chunk_rows], dtype=np.float32)
+        if stored_norms is None:
+            norms = np.linalg.norm(blk, axis=1, keepdims=True)
+        else:
+            norms = np.asarray(stored_norms[start:start + chunk_rows], dtype=np.float32)[:, None]
+        np.divide(blk, norms + 1e-12, out=out[start:start + chunk_rows])
+    return out
+
+class NormalizedRows:
+    """
+    行归一化的只读视图：只保存每行的 1 / 范数，按行取出时才读取 (量化存储在此反量化) 并缩放，
+    不构造完整的 N x D 归一化矩阵；soap 带有 norms 属性 (量化存储保存的原始行范数) 时直接使用
+    零向量保持为零 (与 normalize_rows 一致)
+    """
+    def __init__(self, soap, chunk_rows=4096):
+        self.soap = soap
+        self.shape = soap.shape
+        self.dtype = np.dtype(np.float32)
+        stored_norms = getattr(soap, "norms", None)
+        norms = np.empty(soap.shape[0], dtype=np.float32)
+        for start in range(0, soap.shape[0], chunk_rows):
+            if stored_norms is None:
+                blk = np.asarray(soap[start:start + chunk_rows], dtype=np.float32)
+                norms[start:start + len(blk)] = np.linalg.norm(blk, axis=1)
+            else:
+                blk = np.asarray(stored_norms[start:start + chunk_rows], dtype=np.float32)
+                norms[start:start + len(blk)] = blk
+        self.inv_norms = 1.0 / (norms + 1e-12)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        out = np.array(self.soap[item], dtype=np.float32)
+        s = self.inv_norms[item]
+        out *= s[..., None] if np.ndim(s) else s
+        return out
+
+    def matmul(self, item, other):
+        """归一化后的 self[item] @ other：先用原始行相乘，再按行缩放结果 (省去缩放整块输入)"""
+        out = np.asarray(self.soap[item], dtype=np.float32) @ other
+        s = self.inv_norms[item]
+        out *= s[:, None] if out.ndim == 2 else s
+        return out
+
+def row_mean(soap, chunk_rows=65536):
+    """按行分块计算均值向量"""
+    total = np.zeros(soap.shape[1], dtype=np.float64)
+    for start in range(0, soap.shape[0], chunk_rows):
+        total += np.asarray(soap[start:start + chunk_rows], dtype=np.float64).sum(axis=0)
+    return total / max(soap.shape[0], 1)
+
+def row_sq_norms(soap, chunk_rows=65536, center=None):
+    """按行分块计算平方范数 (float64)，兼容 mmap 缓存；可先减去 center"""
+    N = soap.shape[0]
+    out = np.empty(N, dtype=np.float64)
+    for start in range(0, N, chunk_rows):
+        blk = np.asarray(soap[start:start + chunk_rows], dtype=np.float64)
+        if center is not None:
+            blk = blk - center
+        out[start:start + chunk_rows] = np.einsum("ij,ij->i", blk, blk)
+    return out
+
+def limit_blas_threads(n_threads):
+    """限制 BLAS 线程数，避免多进程/多线程叠加时超额订阅 (需要 threadpoolctl)"""
+    if threadpool_limits is None:
+        return contextlib.nullcontext()
+    return threadpool_limits(limits=n_threads, user_api="blas")
+
+def map_row_chunks(fn, N, chunk_rows, executor=None):
+    """对 [0, N) 按行分块调用 fn(start, end)，传入 executor 时多线程执行，结果按块顺序返回"""
+    spans = [(start, min(start + chunk_rows, N)) for start in range(0, N, chunk_rows)]
+    if executor is None:
+        return [fn(start, end) for start, end in spans]
+    return list(executor.map(lambda span: fn(*span), spans))
+
+def _npy_header(dtype, shape, size):
+    """固定总长度 size 的 .npy (v1.0) 头"""
+    d = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+         "shape": tuple(shape)}
+    body = repr(d)
+    if len(body) + 11 > size:
+        raise ValueError(f"npy header does not fit in {size} bytes")
+    body = body.ljust(size - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(body)) + body.encode("latin1")
+
+def _read_npy_header(f):
+    """返回 (数据起始偏移, shape, dtype)"""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return f.tell(), shape, dtype
+
+def resize_npy_rows(path, n_rows):
+    """原地修改二维 .npy 的行数 (截断或扩展，扩展出的行内容未定义)"""
+    with open(path, "r+b") as f:
+        offset, shape, dtype = _read_npy_header(f)
+        f.seek(0)
+        f.write(_npy_header(dtype, (n_rows,) + tuple(shape[1:]), offset))
+        f.truncate(offset + n_rows * int(np.prod(shape[1:])) * dtype.itemsize)
+
+class NpyAppender:
+    """
+    逐批追加行的 .npy 写入器：先写固定长度的头，关闭时原地改写为最终 shape
+    不需要事先知道行数，也不需要把数据留在内存里
+    start_row 不为 None 且文件已存在时，保留前 start_row 行并在其后继续追加
+    """
+    HEADER_SIZE = 128
+
+    def __init__(self, path, n_cols, dtype=np.float32, start_row=None):
+        self.path, self.n_cols, self.dtype = path, n_cols, np.dtype(dtype)
+        if start_row is not None and os.path.exists(path):
+            self._f = open(path, "r+b")
+            self.header_size, _, _ = _read_npy_header(self._f)
+            self.n_rows = start_row
+            self._f.seek(self.header_size + start_row * n_cols * self.dtype.itemsize)
+            self._f.truncate()
+        else:
+            self._f = open(path, "wb")
+            self.header_size, self.n_rows = self.HEADER_SIZE, 0
+            self._f.write(self._header())
+
+    def _header(self):
+        return _npy_header(self.dtype, (self.n_rows, self.n_cols), self.header_size)
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape(-1, self.n_cols)
+        self._f.write(rows.tobytes())
+        self.n_rows += rows.shape[0]
+
+    def flush(self):
+        """把头改写为当前行数并落盘，之后可继续追加 (中断后文件仍可按已写的行读取)"""
+        pos = self._f.tell()
+        self._f.seek(0)
+        self._f.write(self._header())
+        self._f.seek(pos)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.seek(0)
+        self._f.write(self._header())
+        self._f.close()
+
+class RowView:
+    """
+    按行号取子集的只读视图，切片时才读取对应行 (不会整体复制 mmap 缓存)
+    支持 shape / dtype / len 与整数、切片索引
+    """
+    def __init__(self, data, rows):
+        self.data = data
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.shape = (len(self.rows),) + tuple(data.shape[1:])
+        self.dtype = data.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        rows = self.rows[item]
+        if np.ndim(rows) == 0:
+            return self.data[int(rows)]
+        if len(rows) and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+            return self.data[rows[0]:rows[-1] + 1]   # 连续行直接切片
+        return self.data[rows]
+
+def take_rows(data, rows):
+    """rows 恰为 0..len(data)-1 时直接返回 data，否则返回 RowView"""
+    rows = np.asarray(rows)
+    if len(rows) == len(data) and np.array_equal(rows, np.arange(len(data))):
+        return data
+    return RowView(data, rows)
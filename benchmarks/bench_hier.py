@@ -0,0 +1,63 @@
+"""
+两级筛选基准：精确 FPS / Threshold vs 粗分簇 + 簇内筛选 (--hier)
+
+用法:
+    python benchmarks/bench_hier.py --size 200000 --dim 256 -n 2000 --oversample 2 4 8
+对每个 oversample (FPS) 记录耗时与覆盖半径 (全部行到 train 的最小距离的最大值)，
+用于在速度与覆盖之间取舍；--skip-exact 时只运行两级筛选
+"""
+import argparse
+import time
+
+from bench_threshold import make_data
+from COSOAP.dedup import (fps_selection_target_n, cosine_threshold_dedup, hier_fps_selection,
+                          hier_threshold_dedup, coverage_radius)
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    res = fn(*args, **kwargs)
+    return res, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark two-stage (clustered) selection")
+    parser.add_argument("--size", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=2000,
+                        help="Centres of the synthetic data")
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("-n", "--num", type=int, default=2000)
+    parser.add_argument("-s", "--simlT", type=float, default=0.005)
+    parser.add_argument("--oversample", type=float, nargs="+", default=[2.0, 4.0, 8.0])
+    parser.add_argument("--hier-clusters", dest="hier_clusters", type=int, default=None)
+    parser.add_argument("--skip-exact", dest="skip_exact", action="store_true")
+    args = parser.parse_args()
+
+    soap, has_label = make_data(args.size, args.dim, args.clusters, args.noise)
+
+    print(f"FPS, N={args.size}, n_select={args.num}")
+    print(f"{'method':>16} {'time (s)':>10} {'radius':>10} {'labeled':>8}")
+    if not args.skip_exact:
+        res, t = timed(fps_selection_target_n, soap, has_label, args.num)
+        print(f"{'exact':>16} {t:>10.2f} {coverage_radius(soap, res[0] + res[1]):>10.4g} "
+              f"{len(res[0]):>8}")
+    for f in args.oversample:
+        res, t = timed(hier_fps_selection, soap, has_label, args.num,
+                       n_clusters=args.hier_clusters, oversample=f)
+        print(f"{f'hier x{f:g}':>16} {t:>10.2f} {coverage_radius(soap, res[0] + res[1]):>10.4g} "
+              f"{len(res[0]):>8}")
+
+    print(f"\nThreshold, N={args.size}, simlT={args.simlT}")
+    print(f"{'method':>16} {'time (s)':>10} {'radius':>10} {'train':>8}")
+    runs = [("hier", hier_threshold_dedup, {"n_clusters": args.hier_clusters})]
+    if not args.skip_exact:
+        runs.insert(0, ("exact", cosine_threshold_dedup, {}))
+    for name, fn, kwargs in runs:
+        res, t = timed(fn, soap, has_label, args.simlT, **kwargs)
+        radius = coverage_radius(soap, res[0] + res[1], metric="cosine")
+        print(f"{name:>16} {t:>10.2f} {radius:>10.4g} {len(res[0]) + len(res[1]):>8}")
+
+
+if __name__ == "__main__":
+    main()
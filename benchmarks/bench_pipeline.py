@@ -0,0 +1,154 @@
+"""
+全流程分阶段基准：合成数据 -> 读取 -> 帧索引 -> 分组 -> SOAP 缓存 (冷/热) -> FPS -> Threshold -> 输出
+
+用法:
+    python benchmarks/bench_pipeline.py --frames 20000 --atoms 24 --compositions 20 -p 8 -o bench.json
+    python benchmarks/compare.py old.json new.json
+每个阶段记录墙钟时间、CPU 时间 (含已结束的子进程) 与峰值 RSS，结果写入 JSON，
+同一台机器上对比两个提交时使用相同的参数与 --seed
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from ase.io import write
+
+from synth import make_structures
+import COSOAP
+from COSOAP.io import read_input, frame_records, write_outputs
+from COSOAP.soap import split_structures, build_caches, load_cache_with_label
+from COSOAP.dedup import fps_selection_target_n, cosine_threshold_dedup
+from COSOAP.profiling import measure
+from COSOAP.utils import soap_param_hash
+
+
+def git_commit():
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        out = subprocess.run(["git", "-C", repo, "rev-parse", "HEAD"], capture_output=True,
+                             text=True, check=True)
+        dirty = subprocess.run(["git", "-C", repo, "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine_info():
+    return {"platform": platform.platform(), "machine": platform.machine(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__}
+
+
+def run(args):
+    centers = args.atoms_centers.split()
+    stages = {}
+
+    def stage(name):
+        return measure(stages.setdefault(name, {}))
+
+    with stage("generate") as rec:
+        frames = make_structures(args.frames, args.atoms, args.compositions, args.labeled,
+                                 seed=args.seed)
+        write("input.xyz", frames, format="extxyz")
+        rec["n_frames"] = len(frames)
+        rec["bytes"] = os.path.getsize("input.xyz")
+    del frames
+
+    with stage("read_input") as rec:
+        atoms_all, features = read_input("input.xyz", args.nproc, with_features=True)
+        rec["n_frames"] = len(atoms_all)
+
+    with stage("frame_index") as rec:
+        records = frame_records(["input.xyz"], "soap_cache")
+        rec["n_frames"] = len(records["file"])
+
+    with stage("split_structures") as rec:
+        groups = split_structures(atoms_all, centers, features=features)
+        rec["n_groups"] = len(groups)
+        rec["n_kept"] = sum(len(g["indices"]) for g in groups.values())
+
+    with stage("build_cache_cold"):
+        build_caches(groups, "soap_cache", args.nproc, centers)
+    with stage("build_cache_warm"):
+        build_caches(groups, "soap_cache", args.nproc, centers)
+
+    tag = soap_param_hash(centers=centers)
+    train_lbl, train_unlbl = [], []
+    with stage("fps_selection_target_n") as rec:
+        for key, group in groups.items():
+            soap, _, has_label = load_cache_with_label(key, "soap_cache", tag)
+            n_select = max(1, int(len(has_label) * args.fps_fraction))
+            u_lbl, u_unlbl, _, _ = fps_selection_target_n(soap, has_label, n_select)
+            indices = np.asarray(group["indices"])
+            train_lbl.extend(indices[u_lbl].tolist())
+            train_unlbl.extend(indices[u_unlbl].tolist())
+        rec["n_selected"] = len(train_lbl) + len(train_unlbl)
+
+    with stage("cosine_threshold_dedup") as rec:
+        n_train = 0
+        for key in groups:
+            soap, _, has_label = load_cache_with_label(key, "soap_cache", tag)
+            u_lbl, u_unlbl, _, _ = cosine_threshold_dedup(soap, has_label, args.simlT)
+            n_train += len(u_lbl) + len(u_unlbl)
+        rec["n_selected"] = n_train
+
+    with stage("write_outputs"):
+        write_outputs(atoms_all, train_lbl, train_unlbl, [], [], files=["input.xyz"], records=records)
+
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data")
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--atoms", type=int, default=24, help="Mean atoms per frame")
+    parser.add_argument("--compositions", type=int, default=10)
+    parser.add_argument("--labeled", type=float, default=0.5, help="Fraction of labeled frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-p", "--nproc", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("-a", "--atoms-centers", dest="atoms_centers", default="C H O")
+    parser.add_argument("--fps-fraction", dest="fps_fraction", type=float, default=0.1,
+                        help="Fraction of each group selected by FPS")
+    parser.add_argument("-s", "--simlT", type=float, default=0.005)
+    parser.add_argument("--workdir", default=None,
+                        help="Working directory (default: a temporary directory, removed afterwards)")
+    parser.add_argument("-o", "--output", default="bench_pipeline.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cosoap_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if os.path.exists("soap_cache"):
+            shutil.rmtree("soap_cache")
+        os.makedirs("soap_cache")
+        stages = run(args)
+    finally:
+        os.chdir(cwd)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {"version": COSOAP.__version__, "commit": git_commit(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine_info(),
+              "params": {k: v for k, v in vars(args).items() if k not in ("output", "workdir")},
+              "stages": stages}
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\n{'stage':<24} {'wall (s)':>10} {'cpu (s)':>10} {'peak RSS (MiB)':>15}")
+    for name, rec in stages.items():
+        print(f"{name:<24} {rec['wall_s']:>10.3f} {rec['cpu_s']:>10.3f} {rec['peak_rss_mb']:>15.1f}")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+对比两次 bench_pipeline.py 的结果
+
+用法:
+    python benchmarks/compare.py old.json new.json
+ratio = new / old，小于 1 表示变快 (或内存更少)
+"""
+import json
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two bench_pipeline.py result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"old: {old.get('commit')}  new: {new.get('commit')}")
+    if old.get("params") != new.get("params"):
+        print("[WARN] Benchmark parameters differ")
+    if old.get("machine") != new.get("machine"):
+        print("[WARN] Results come from different machines")
+
+    print(f"{'stage':<24} {'wall old':>9} {'wall new':>9} {'ratio':>7} "
+          f"{'cpu ratio':>10} {'RSS old':>9} {'RSS new':>9}")
+    for name, o in old["stages"].items():
+        n = new["stages"].get(name)
+        if n is None:
+            print(f"{name:<24} {o['wall_s']:>9.3f} {'-':>9}")
+            continue
+        ratio = n["wall_s"] / o["wall_s"] if o["wall_s"] else float("nan")
+        cpu_ratio = n["cpu_s"] / o["cpu_s"] if o["cpu_s"] else float("nan")
+        print(f"{name:<24} {o['wall_s']:>9.3f} {n['wall_s']:>9.3f} {ratio:>7.2f} "
+              f"{cpu_ratio:>10.2f} {o['peak_rss_mb']:>9.1f} {n['peak_rss_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,9 @@ setup(
         "tqdm",
     ],
     extras_require={
+        "parallel": [
+            "threadpoolctl",
+        ],
         "dev": [
             "black",
             "isort",